@@ -179,38 +179,31 @@ def run_query(form):
 		#  entries
 		idxlist = []
 		for i in range(len(idxfiles)):
-			idxfile = open(os.path.join(work_dir,idxfiles[i]))
 			idxlist.append(matchoutput.idxFile( \
 			 os.path.join(work_dir,idxfiles[i])) )
 
 			
-			linenum = 0
-			line = idxfile.readline()
-			x = matchoutput.idxEntry()
-			while line:
+			linenum = -1
+			for x in matchoutput.idx_entries( \
+			 os.path.join(work_dir,idxfiles[i])):
+				linenum += 1
 				# If this wasn't included, keep going
 				if (not form.has_key('A*%d*%d' % (i, linenum))) and \
 				   (not form.has_key('B*%d*%d' % (i, linenum))):
-				   line = idxfile.readline()
-				   linenum += 1
 				   continue
 				
-				# Get the entry
-				x = matchoutput.idxEntry()
-				x.fromIDX(line)
-
-				# Get the full entry (using idxFile)
-				x = (idxlist[i])[x.start]
+				# Get the full entry (using idxFile), keeping
+				#  the name of this file as several files
+				#  may share the same start
+				full = (idxlist[i])[x.start]
+				x.len = full.len
+				x.idx = full.idx
 
 				# Add to each list as necessary
 				if form.has_key('A*%d*%d' % (i, linenum)):
 					entrylist[0].append(x)
 				if form.has_key('B*%d*%d' % (i, linenum)):
 					entrylist[1].append(x)
-					
-				# Keep going
-				linenum += 1
-				line = idxfile.readline()
 
 		# We've now got a bunch of entries, some without len (just
 		#  offsets).  Fill in the details and generate a series of 
@@ -252,18 +245,12 @@ def run_query(form):
 		for i in range(len(idxfiles)):
 			print '<li> %s' % idxfiles[i]
 			print ' <ul>'
-			idxfile = open(os.path.join(work_dir,idxfiles[i]))
-			
 			# Loop preconditions...
-			x = matchoutput.idxEntry()
-			line = idxfile.readline()
 			linenum = 0
 			curarchive = ''
-			# Read all lines from this file
-			while line:
-				# Process
-				x.fromIDX(line)
-
+			# Read all entries from this file
+			for x in matchoutput.idx_entries( \
+			 os.path.join(work_dir,idxfiles[i])):
 				# Need another level for a new archive?
 				if x.archive == curarchive:
 					pass
@@ -284,9 +271,8 @@ def run_query(form):
 					i, linenum,
 					x.file)
 
-				# Get the next line
+				# Get the next entry
 				linenum += 1
-				line = idxfile.readline()
 			if curarchive:
 				print "  </ol>"
 			print ' </ul>'
@@ -334,14 +320,16 @@ def display_side_by_side(form):
 
 	print_header('Display query - %d vs. %d, %d' % (startA, startB, lenB) )
 
-	# Disassemble the entries
+	# Disassemble just the matches
 	matches = [matchA, matchB]
 	disassembly = []
 	for i in matches:
 		# TODO: It's going to try to mount an iso if there is a
 		#  distname
 		i.entry.distname = ''
-		disassembly.append( matchoutput.disassemble_entry(i.entry) )
+		(window, label) = matchoutput.disassemble_window(i.entry,
+			i.offset, matches[0].len)
+		disassembly.append(window)
 	
 	# Print the table
 	print '<table>'
@@ -358,7 +346,7 @@ def display_side_by_side(form):
 		# Figure out the alignment
 		aligned = []
 		for i in range(len(matches)):
-			aligned.append( disassembly[i][offset + matches[i].offset ])
+			aligned.append( disassembly[i][offset] )
 
 		# Print this
 		print '<tr>'
@@ -459,15 +447,16 @@ def display_coverage(form):
 
 	# Find all of the FileA's present
 	fileAs = []
-	for match in matches:
-		if matches[match].a and \
-		   (not matches[match].entry in fileAs):
-			fileAs.append(matches[match].entry)
+	seen = set()
+	for match in matches.values():
+		if match.a and id(match.entry) not in seen:
+			seen.add(id(match.entry))
+			fileAs.append(match.entry)
 
 	# Figure out what files are present
 	files = []
 	for idxfile in idxfiles.values():
-		for file in idxfile.entry:
+		for file in idxfile.cached_entries():
 			files.append(file)
 			
 	# Iterate through each fileA
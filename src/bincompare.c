@@ -14,6 +14,7 @@
 #include <unistd.h>
 #include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
 #include <sys/time.h>
 
 #define OPT_THRESHOLD_DEFAULT	10
@@ -26,6 +27,20 @@ int MATCH_X2 = OPT_X2_DEFAULT;
 int MATCH_X3 = OPT_X3_DEFAULT;
 int MATCH_X4 = OPT_X4_DEFAULT;
 
+/* The versioned .dat header written by library.py */
+#define DAT_MAGIC	"BBLD"
+#define DAT_VERSION	1
+
+/* The binary output format, see bincompareoutput.py */
+#define OUT_MAGIC	"BBCB"
+#define OUT_VERSION	1
+#define OUT_HEADER	48	/* Bytes in a block header */
+#define OUT_RECORD	16	/* Bytes in a match record */
+#define OUT_CHUNK	4096	/* Match records in a chunk */
+int BINARY_OUTPUT = 0;
+unsigned char out_chunk[OUT_CHUNK * OUT_RECORD];
+unsigned long out_count = 0;
+
 #define WORD  unsigned char
 #define DWORD unsigned short int
 #define QWORD unsigned long int
@@ -42,6 +57,121 @@ double dtime() {
 	return(t.tv_sec + t.tv_usec/1000000.0);
 }
 
+/**************************************************
+ * dat_header_size(filename)
+ * Returns the number of bytes before the first token
+ *  of filename: the header length for a versioned
+ *  .dat, 0 for a headerless one, or -1 if filename
+ *  can't be read or is a newer version
+ ************************************************/
+long dat_header_size(char *filename)
+{
+	FILE *file;
+	unsigned char header[16];
+	unsigned long version, hdrlen;
+
+	file = fopen(filename,"rb");
+	if( file == 0 ) return(-1);
+
+	if( (fread(header, sizeof(header), 1, file) != 1) ||
+	    (memcmp(header, DAT_MAGIC, 4) != 0) ) {
+		fclose(file);
+		return(0);
+	}
+	fclose(file);
+
+	/*** Little-endian, whatever this machine is ***/
+	version = header[4] | (header[5] << 8) | (header[6] << 16) |
+		((unsigned long)header[7] << 24);
+	hdrlen = header[8] | (header[9] << 8) | (header[10] << 16) |
+		((unsigned long)header[11] << 24);
+	if(version > DAT_VERSION) {
+		fprintf(stderr,"%s is version %lu, only %d is supported\n",
+			filename, version, DAT_VERSION);
+		return(-1);
+	}
+	return(hdrlen);
+}
+
+/**************************************************
+ * put_le(p, value, bytes)
+ * p - where to store value
+ * value - the value to store
+ * bytes - how many bytes of it to store
+ * Stores value little-endian, whatever this machine is
+ ************************************************/
+void put_le(unsigned char *p, unsigned long long value, int bytes)
+{
+	int i;
+
+	for(i=0;i<bytes;i++) {
+		p[i] = value & 0xff;
+		value >>= 8;
+	}
+}
+
+/**************************************************
+ * flush_chunk()
+ * Writes the buffered match records as a chunk of
+ *  binary output, a count followed by the records
+ ************************************************/
+void flush_chunk()
+{
+	unsigned char count[4];
+
+	if(out_count == 0) return;
+	put_le(count, out_count, 4);
+	fwrite(count, sizeof(count), 1, stdout);
+	fwrite(out_chunk, OUT_RECORD, out_count, stdout);
+	out_count = 0;
+}
+
+/**************************************************
+ * write_match(a, b, score, len)
+ * Writes a match as a line of text or, for binary
+ *  output, buffers it as a record
+ ************************************************/
+void write_match(long a, long b, long score, long len)
+{
+	unsigned char *record;
+
+	if(!BINARY_OUTPUT) {
+		printf("%ld,%ld,%ld,%ld\n", a, b, score, len);
+		return;
+	}
+
+	record = out_chunk + out_count * OUT_RECORD;
+	put_le(record, a, 4);
+	put_le(record + 4, b, 4);
+	put_le(record + 8, (unsigned long)score, 4);
+	put_le(record + 12, len, 4);
+	out_count++;
+	if(out_count == OUT_CHUNK) flush_chunk();
+}
+
+/**************************************************
+ * write_end(seconds)
+ * seconds - how long the comparison took
+ * Ends the output of the comparison
+ ************************************************/
+void write_end(double seconds)
+{
+	unsigned char end[12];
+	unsigned long long bits;
+
+	if(!BINARY_OUTPUT) {
+		printf("Comparison took %g seconds.\n", seconds);
+		return;
+	}
+
+	/*** A zero count, then the time as a double ***/
+	flush_chunk();
+	memcpy(&bits, &seconds, sizeof(bits));
+	put_le(end, 0, 4);
+	put_le(end + 4, bits, 8);
+	fwrite(end, sizeof(end), 1, stdout);
+}
+
 /**************************************************
  * load_file(dat, filename, offset, len)
  * dat - a pointer to what will be a pointer to the
@@ -50,14 +180,19 @@ double dtime() {
  * offset - the offset within the file from which to
  *           start (in quadwords)
  * len - the length to load into memory (in quadwords)
- * Opens filename, allocates *dat, seeks to offset,
- *  and fills *dat with len quadwords
+ * Opens filename, allocates *dat, seeks to offset
+ *  (past any header), and fills *dat with len quadwords
  * Returns 0 on success, -1 on failure
  ************************************************/
 int load_file(void **dat, char *filename, unsigned long offset, unsigned long len)
 {
 	FILE *file;
+	long header;
 	
+	/*** Tokens start after the header ***/
+	header = dat_header_size(filename);
+	if( header < 0 ) return(-1);
+
 	/*** Open filename ***/
 	file = fopen(filename,"rb");
 	if( file == 0 ) return(-1);
@@ -70,7 +205,7 @@ int load_file(void **dat, char *filename, unsigned long offset, unsigned long le
 	}
 
 	/*** Seek file ***/
-	if(fseek(file, offset * 4, SEEK_SET) != 0) {
+	if(fseek(file, header + offset * 4, SEEK_SET) != 0) {
 		free(*dat);
 		fclose(file);
 		return(-1);
@@ -239,8 +374,7 @@ int correlate(void *a, long aqwords,
 			if((dscore < 13) || (dlen < 4)) continue;
 			
 			/* Add to the results */
-			printf("%ld,%ld,%ld,%ld\n",
-				j,
+			write_match(j,
 				j + i,
 				dscore,
 				dlen);
@@ -279,6 +413,7 @@ typedef struct options_ {
 	int threshold;	    /* The threshold parameter for  */
 			    /*  MSP estimation	 */
 	int x1,x2,x3,x4;    /* Scoring constants */
+	int binary;         /* Write binary output */
 } options;
 
 /************************************************************
@@ -353,6 +488,7 @@ void print_usage(char *name)
 	printf("Usage: %s [options] fileA [offset [len]] fileB [offset [len]]\n", name);
 	printf("Options:\n");
 	printf("  -h Print this help\n");
+	printf("  -b Write binary output, see bincompareoutput.py\n");
 	printf("  -t=N: Set the threshold parameter to N, default is %d\n",
 			OPT_THRESHOLD_DEFAULT);
 	printf("  -x1=N: Set scoring parameter x1 to N, default is %d\n", 
@@ -375,6 +511,42 @@ printf("Files:\n");
 	exit(-1);
 }	
 
+/************************************************************
+ * void write_header(opts)
+ * opts - a fully populated, validated options structure
+ * Writes the names, offsets and lengths of the files being
+ *  compared, as text or as a binary block header
+ ***********************************************************/
+void write_header(options *opts)
+{
+	unsigned char header[OUT_HEADER];
+	int i;
+
+	if(!opts->binary) {
+		for(i=0;i<2;i++) {
+			printf("File %s, offset %ld, len %ld\n",
+				opts->f[i].name,
+				opts->f[i].compareoffset,
+				opts->f[i].comparelen);
+		}
+		return;
+	}
+
+	memcpy(header, OUT_MAGIC, 4);
+	put_le(header + 4, OUT_VERSION, 4);
+	put_le(header + 8, 0, 4);	/* Flags */
+	put_le(header + 12, strlen(opts->f[0].name), 2);
+	put_le(header + 14, strlen(opts->f[1].name), 2);
+	for(i=0;i<2;i++) {
+		put_le(header + 16 + i * 16, opts->f[i].compareoffset, 8);
+		put_le(header + 24 + i * 16, opts->f[i].comparelen, 8);
+	}
+	fwrite(header, sizeof(header), 1, stdout);
+	for(i=0;i<2;i++) {
+		fwrite(opts->f[i].name, strlen(opts->f[i].name), 1, stdout);
+	}
+}
+
 /************************************************************
  * void parse_args(argc, argv, opts)
  * argc - the number of arguments to parse
@@ -389,6 +561,7 @@ void parse_args(int argc, char **argv, options *opts)
 	int argcur = 1; /* Something to keep track of which */
 	                /*  argument to be processed */
 	struct stat filestats; /* Needed to capture file stats */
+	long header; /* Bytes before the first token */
 	int i; /* A counter */
 
 	/* Before getting started, the minimum number of */
@@ -403,14 +576,20 @@ void parse_args(int argc, char **argv, options *opts)
 	opts->x2 = OPT_X2_DEFAULT;
 	opts->x3 = OPT_X3_DEFAULT;
 	opts->x4 = OPT_X4_DEFAULT;
+	opts->binary = 0;
 	
 	/* Options */
-	while(argv[argcur][1] == '-' && argcur < argc) {
+	for(;argcur < argc && argv[argcur][0] == '-';argcur++) {
 		/* Usage */
 		if (strncmp(argv[argcur],"-h",3) == 0) {
 			print_usage(argv[0]);
 		}
 
+		/* Binary output */
+		if (strncmp(argv[argcur],"-b",3) == 0) {
+			opts->binary = 1;
+		}
+
 		/* Threshold  */
 		if (strncmp(argv[argcur],"-t=",3) == 0) {
 			opts->threshold = useful_strtoul(&argv[argcur][3]);
@@ -453,6 +632,14 @@ void parse_args(int argc, char **argv, options *opts)
 		if(argcur >= argc) print_usage(argv[0]);
 		opts->f[i].name = argv[argcur];
 		argcur++;
+
+		/* Versioned files have a header before the tokens */
+		header = dat_header_size(opts->f[i].name);
+		if(header < 0) {
+			fprintf(stderr,"Unable to read %s\n",
+					opts->f[i].name);
+			exit(-2);
+		}
 		
 		/* Offset */
 		if( (argcur < argc) && 
@@ -471,7 +658,7 @@ void parse_args(int argc, char **argv, options *opts)
 
 		} else {
 			if(stat(opts->f[i].name,&filestats) == 0) {
-				opts->f[i].comparelen = filestats.st_size / 4;
+				opts->f[i].comparelen = (filestats.st_size - header) / 4;
 				opts->f[i].comparelen -= opts->f[i].compareoffset;
 			} else {
 				fprintf(stderr,"Unable to stat %s\n",
@@ -483,7 +670,7 @@ void parse_args(int argc, char **argv, options *opts)
 		/* Offset + len cannot excede the file */
 		if(stat(opts->f[i].name,&filestats) == 0) {
 			if ((opts->f[i].compareoffset + opts->f[i].comparelen) >
-			    (filestats.st_size / 4)) {
+			    ((filestats.st_size - header) / 4)) {
 				fprintf(stderr,"Offset + len execedes size of %s\n", opts->f[i].name);
 				exit(-3);
 			}
@@ -499,12 +686,15 @@ void parse_args(int argc, char **argv, options *opts)
 			fprintf(stderr,"Offset + len overflows for %s\n", opts->f[i].name);
 			exit(-4);
 		}
-		
-		printf("File %s, offset %ld, len %ld\n",
-			opts->f[i].name,
-			opts->f[i].compareoffset,
-			opts->f[i].comparelen);
+
+		/* Binary records have 32-bit offsets */
+		if(opts->binary && opts->f[i].comparelen > 0xffffffffUL) {
+			fprintf(stderr,"len is too long for binary output for %s\n", opts->f[i].name);
+			exit(-5);
+		}
 	}
+
+	write_header(opts);
 }
 
 /************************************************************
@@ -524,6 +714,7 @@ int perform_bincompare(options *opts)
 	MATCH_X2 = opts->x2;
 	MATCH_X3 = opts->x3;
 	MATCH_X4 = opts->x4;
+	BINARY_OUTPUT = opts->binary;
 
 	/* Load the files */
 	if(
@@ -544,7 +735,7 @@ int perform_bincompare(options *opts)
 	  	  datB,opts->f[1].comparelen,
 		  opts->threshold);
 	toc = dtime();
-	printf("Comparison took %g seconds.\n",toc-tic);
+	write_end(toc-tic);
 
 	/* Free memory */
 	free(datA); free(datB);
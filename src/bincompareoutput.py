@@ -0,0 +1,526 @@
+#!/usr/bin/python
+# Program:    bincompareoutput.py
+# Programmer: Scott Miller
+# Function:   A streaming parser for the output of bincompare, shared by
+#              matchoutput and filterbincompare
+
+# binBLAST suite of binary analysis tools
+# Copyright (C) 2006 Scott Miller
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+# bincompare output is a series of comparisons, each of the form
+#
+#   File FILEA, offset OFFSETA, len LENA
+#   File FILEB, offset OFFSETB, len LENB
+#   A,B,SCORE,LEN
+#   ...
+#   Comparison took SECONDS seconds.
+#
+# where A and B are relative to OFFSETA and OFFSETB.  Output that has
+#  been through filterbincompare also has `#' comment lines.
+#
+# `bincompare -b' writes the same thing in binary, as one block per
+#  comparison (all integers little-endian):
+#    magic    'BBCB'
+#    version  uint32
+#    flags    uint32, ABSOLUTE if the matches aren't relative to the
+#             offsets, see Comparison.timed
+#    namelenA uint16
+#    namelenB uint16
+#    offsetA  uint64
+#    lenA     uint64
+#    offsetB  uint64
+#    lenB     uint64
+#    FILEA and FILEB, namelenA and namelenB bytes
+#  then chunks of matches, each a uint32 count followed by that many
+#  16 byte records
+#    a        uint32
+#    b        uint32
+#    score    int32
+#    len      uint32
+#  and finally a zero count and the seconds the comparison took as a
+#  double, or -1 if that isn't known.  Blocks can be concatenated like
+#  text output, and parse() reads either.
+
+# The kinds of record yielded by parse()
+COMPARISON = 0 # A Comparison, the start of a comparison
+MATCHES = 1    # A list of consecutive matches, as (a, b, score, len)
+COMMENT = 2    # A comment or blank line, stripped of whitespace
+
+# How much of the stream is read at a time
+blockSize = 1 << 20
+
+# The binary format
+VERSION = 1
+ABSOLUTE = 1
+
+import re
+import struct
+
+blockMagic = 'BBCB'
+blockHeader = struct.Struct('<4sIIHHQQQQ')
+matchRecord = struct.Struct('<IIiI')
+chunkCount = struct.Struct('<I')
+seconds = struct.Struct('<d')
+
+# The most match records written in a chunk
+chunkSize = 4096
+
+# The end of a run of lines starting with digits, that is, of matches
+runEnd = re.compile(r'\n[^\d]')
+
+class Comparison(object):
+	"""The headers of one comparison.  timed is True if the
+	`Comparison took' line came straight after the headers, in which
+	case the matches are already absolute within the files."""
+	__slots__ = ('fileA', 'offsetA', 'lenA', 'fileB', 'offsetB', 'lenB',
+		'timed', 'seconds')
+
+	def __init__(self):
+		self.fileA = ''
+		self.offsetA = 0L
+		self.lenA = 0L
+		self.fileB = ''
+		self.offsetB = 0L
+		self.lenB = 0L
+		self.timed = False
+		# How long the comparison took, once that's been read
+		self.seconds = None
+
+	def __repr__(self):
+		return( "{ 'fileA':'%s', 'offsetA':%u, 'lenA':%u, 'fileB':'%s', 'offsetB':%u, 'lenB':%u }" % (
+			self.fileA, self.offsetA, self.lenA,
+			self.fileB, self.offsetB, self.lenB ) )
+
+def iter_blocks(stream, size=None, partial=''):
+	"""Yield the contents of stream size bytes at a time, each
+	ending at the end of a line.  partial is anything already read
+	from the start of stream."""
+	if size is None:
+		size = blockSize
+
+	block = stream.read(size)
+	while block:
+		end = block.rfind('\n') + 1
+		if end:
+			yield partial + block[:end]
+			partial = block[end:]
+		else:
+			partial += block
+		block = stream.read(size)
+	if partial:
+		yield partial + '\n'
+
+def convert_run(run):
+	"""Return the (a, b, score, len) tuples of a run of match lines,
+	or None if they aren't all plain matches"""
+	import json
+
+	# The json module's C scanner converts numbers much faster than
+	#  int() on each field
+	if run.count(',') != 3 * run.count('\n'):
+		return None
+	try:
+		fields = json.loads('[' + run[:-1].replace('\n', ',') + ']')
+	except ValueError:
+		return None
+	fields = iter(fields)
+	return(zip(fields, fields, fields, fields))
+
+def parse_header(line):
+	"""Return the (file, offset, len) of a `File ' line, or None"""
+	try:
+		(filename, rest) = line[5:].split(', offset ', 1)
+		(offset, dlen) = rest.split(', len', 1)
+		return( (filename, long(offset), long(dlen)) )
+	except ValueError:
+		return None
+
+# The states of parse()
+HEADER_A = 0 # Looking for the first `File ' line
+HEADER_B = 1 # Looking for the second
+FIRST = 2    # Just after the headers, see Comparison.timed
+IN_MATCHES = 3 # In the matches
+
+def read_exactly(stream, size, what):
+	"""Read size bytes from stream, raising IOError if there aren't
+	that many"""
+	data = stream.read(size)
+	if len(data) != size:
+		raise IOError('Binary bincompare output ends in the %s' % what)
+	return(data)
+
+# The structs of chunks of matches, by count, see match_struct()
+chunkStructs = {}
+
+def match_struct(count):
+	"""The struct of count match records"""
+	try:
+		return(chunkStructs[count])
+	except KeyError:
+		chunk = struct.Struct('<' + 'IIiI' * count)
+		if len(chunkStructs) < 64:
+			chunkStructs[count] = chunk
+		return(chunk)
+
+def unpack_matches(data, count, pos=0):
+	"""Return the (a, b, score, len) tuples of count match records at
+	pos in data"""
+	fields = iter(match_struct(count).unpack_from(data, pos))
+	return(zip(fields, fields, fields, fields))
+
+def parse_binary(stream, magic):
+	"""parse() for binary output.  magic is the start of stream,
+	already read."""
+	header = magic
+	while header:
+		header += read_exactly(stream, blockHeader.size - len(header),
+			'block header')
+		(magic, version, flags, namelenA, namelenB, offsetA, lenA,
+		 offsetB, lenB) = blockHeader.unpack(header)
+		if magic != blockMagic:
+			raise IOError('Not binary bincompare output')
+		if version > VERSION:
+			raise IOError('Binary bincompare output is version %d, only %d is supported' % (
+				version, VERSION))
+
+		comparison = Comparison()
+		comparison.fileA = read_exactly(stream, namelenA, 'file names')
+		comparison.fileB = read_exactly(stream, namelenB, 'file names')
+		(comparison.offsetA, comparison.lenA) = (offsetA, lenA)
+		(comparison.offsetB, comparison.lenB) = (offsetB, lenB)
+		comparison.timed = bool(flags & ABSOLUTE)
+		yield (COMPARISON, comparison)
+
+		while True:
+			count = chunkCount.unpack(read_exactly(stream,
+				chunkCount.size, 'matches'))[0]
+			if count == 0:
+				break
+			yield (MATCHES, unpack_matches(read_exactly(stream,
+				count * matchRecord.size, 'matches'), count))
+
+		comparison.seconds = seconds.unpack(read_exactly(stream,
+			seconds.size, 'time'))[0]
+		if comparison.seconds < 0:
+			comparison.seconds = None
+
+		header = stream.read(len(blockMagic))
+
+def map_stream(stream):
+	"""Return (data, pos), stream mmapped and its position, if it is
+	a regular file, otherwise None"""
+	import mmap
+	import os
+	import stat
+
+	try:
+		fileno = stream.fileno()
+		if not stat.S_ISREG(os.fstat(fileno).st_mode):
+			return None
+		pos = stream.tell()
+		return( (mmap.mmap(fileno, 0, access=mmap.ACCESS_READ), pos) )
+	except (AttributeError, IOError, OSError, ValueError,
+		mmap.error):
+		return None
+
+def mapped_blocks(data, pos=0, name='Binary bincompare output'):
+	"""Yield (comparison, chunks) for every block of binary output in
+	data, a string or mmap, from pos on.  chunks is the (position,
+	count) of each chunk of match records in data."""
+
+	def check(size, what):
+		if pos + size > len(data):
+			raise IOError('%s ends in the %s' % (name, what))
+
+	while pos < len(data):
+		check(blockHeader.size, 'block header')
+		(magic, version, flags, namelenA, namelenB, offsetA, lenA,
+		 offsetB, lenB) = blockHeader.unpack_from(data, pos)
+		if magic != blockMagic:
+			raise IOError('%s is not binary bincompare output' % name)
+		if version > VERSION:
+			raise IOError('%s is version %d, only %d is supported' % (
+				name, version, VERSION))
+		pos += blockHeader.size
+
+		check(namelenA + namelenB, 'file names')
+		comparison = Comparison()
+		comparison.fileA = data[pos:pos + namelenA]
+		pos += namelenA
+		comparison.fileB = data[pos:pos + namelenB]
+		pos += namelenB
+		(comparison.offsetA, comparison.lenA) = (offsetA, lenA)
+		(comparison.offsetB, comparison.lenB) = (offsetB, lenB)
+		comparison.timed = bool(flags & ABSOLUTE)
+
+		chunks = []
+		while True:
+			check(chunkCount.size, 'matches')
+			count = chunkCount.unpack_from(data, pos)[0]
+			pos += chunkCount.size
+			if count == 0:
+				break
+			check(count * matchRecord.size, 'matches')
+			chunks.append( (pos, count) )
+			pos += count * matchRecord.size
+		check(seconds.size, 'time')
+		comparison.seconds = seconds.unpack_from(data, pos)[0]
+		pos += seconds.size
+		if comparison.seconds < 0:
+			comparison.seconds = None
+
+		yield (comparison, chunks)
+
+def parse_mapped(data, pos):
+	"""parse() for binary output in data, see mapped_blocks()"""
+	for (comparison, chunks) in mapped_blocks(data, pos):
+		yield (COMPARISON, comparison)
+		for (start, count) in chunks:
+			yield (MATCHES, unpack_matches(data, count, start))
+
+def parse(stream, size=None):
+	"""Yield (kind, record) for every comparison header, run of
+	matches and comment of the bincompare output in stream, see
+	COMPARISON, MATCHES and COMMENT.  Anything else is skipped.  The
+	stream is read in large blocks, and runs of match lines are
+	converted in one go.  Binary output is recognized and read the
+	same way, straight from an mmap if stream is a file."""
+	start = stream.read(len(blockMagic))
+	if start == blockMagic:
+		mapped = map_stream(stream)
+		if mapped:
+			(data, pos) = mapped
+			records = parse_mapped(data, pos - len(start))
+		else:
+			records = parse_binary(stream, start)
+		for record in records:
+			yield record
+		return
+
+	state = HEADER_A
+	comparison = None
+
+	for block in iter_blocks(stream, size, start):
+		pos = 0
+		# Where a run that couldn't be converted at once ends
+		slow = 0
+		while pos < len(block):
+			# Matches are most of the output
+			if state == IN_MATCHES and pos >= slow and \
+			   block[pos].isdigit():
+				end = runEnd.search(block, pos)
+				if end:
+					end = end.start() + 1
+				else:
+					end = len(block)
+				matches = convert_run(block[pos:end])
+				if matches is not None:
+					yield (MATCHES, matches)
+					pos = end
+					continue
+				# Take it a line at a time
+				slow = end
+
+			end = block.index('\n', pos)
+			line = block[pos:end].strip()
+			pos = end + 1
+
+			if state == FIRST:
+				# Filtered output may say so first
+				if 'Matches above' in line:
+					continue
+				comparison.timed = line.startswith('Comparison took ')
+				yield (COMPARISON, comparison)
+				state = IN_MATCHES
+
+			if line.startswith('#') or line == '':
+				yield (COMMENT, line)
+
+			elif line.startswith('File '):
+				header = parse_header(line)
+				if header is None:
+					if state == IN_MATCHES:
+						state = HEADER_A
+					continue
+				if state == HEADER_B:
+					(comparison.fileB, comparison.offsetB,
+					 comparison.lenB) = header
+					state = FIRST
+				else:
+					comparison = Comparison()
+					(comparison.fileA, comparison.offsetA,
+					 comparison.lenA) = header
+					state = HEADER_B
+
+			elif line.startswith('Comparison took '):
+				try:
+					comparison.seconds = float(
+						line.split()[2])
+				except (AttributeError, IndexError, ValueError):
+					pass
+
+			elif state == IN_MATCHES:
+				# Anything with extra fields
+				fields = line.split(',')
+				if len(fields) >= 4:
+					try:
+						yield (MATCHES, [ (int(fields[0]),
+							int(fields[1]), int(fields[2]),
+							int(fields[3])) ])
+					except ValueError:
+						pass
+
+	# The output ended straight after the headers
+	if state == FIRST:
+		yield (COMPARISON, comparison)
+
+def write_text(records, output):
+	"""Write the records yielded by parse() to output as bincompare
+	text output"""
+	comparison = None
+	pending = None
+
+	def end(comparison, pending):
+		if comparison is None:
+			return
+		if comparison.seconds is not None:
+			output.write('Comparison took %g seconds.\n' %
+				comparison.seconds)
+		# Absolute matches come after the time
+		if pending:
+			for match in pending:
+				output.write('%d,%d,%d,%d\n' % match)
+
+	for (kind, record) in records:
+		if kind == MATCHES:
+			if pending is not None:
+				pending.extend(record)
+			else:
+				output.write(''.join(['%d,%d,%d,%d\n' % match
+					for match in record]))
+
+		elif kind == COMMENT:
+			output.write('%s\n' % record)
+
+		elif kind == COMPARISON:
+			end(comparison, pending)
+			comparison = record
+			output.write('File %s, offset %d, len %d\n' % (
+				record.fileA, record.offsetA, record.lenA))
+			output.write('File %s, offset %d, len %d\n' % (
+				record.fileB, record.offsetB, record.lenB))
+			pending = None
+			if record.timed:
+				pending = []
+
+	end(comparison, pending)
+
+def write_binary(records, output):
+	"""Write the records yielded by parse() to output as binary
+	bincompare output.  Comments are dropped."""
+	comparison = None
+
+	def end(comparison):
+		if comparison is None:
+			return
+		time = comparison.seconds
+		if time is None:
+			time = -1.0
+		output.write(chunkCount.pack(0) + seconds.pack(time))
+
+	for (kind, record) in records:
+		if kind == MATCHES:
+			for i in range(0, len(record), chunkSize):
+				chunk = record[i:i + chunkSize]
+				fields = [ field for match in chunk
+					for field in match ]
+				try:
+					data = struct.pack('<' + 'IIiI' * len(chunk),
+						*fields)
+				except struct.error:
+					raise ValueError('A match in %s is out of range for binary output' % (
+						comparison.fileA))
+				output.write(chunkCount.pack(len(chunk)) + data)
+
+		elif kind == COMPARISON:
+			end(comparison)
+			comparison = record
+			flags = 0
+			if record.timed:
+				flags |= ABSOLUTE
+			output.write(blockHeader.pack(blockMagic, VERSION, flags,
+				len(record.fileA), len(record.fileB),
+				record.offsetA, record.lenA,
+				record.offsetB, record.lenB))
+			output.write(record.fileA + record.fileB)
+
+	end(comparison)
+
+def binary_comparisons(name):
+	"""Yield (comparison, matches) for every comparison in the binary
+	bincompare output file name.  The file is mmapped and matches is
+	a NumPy record array with fields a, b, score and len, a view of
+	the file if the comparison has only one chunk."""
+	import numpy
+	from library import map_file
+
+	dtype = numpy.dtype([ ('a', '<u4'), ('b', '<u4'), ('score', '<i4'),
+		('len', '<u4') ])
+	data = map_file(name)
+	for (comparison, chunks) in mapped_blocks(data, 0, name):
+		chunks = [ numpy.frombuffer(data, dtype, count, pos)
+			for (pos, count) in chunks ]
+		if len(chunks) == 1:
+			matches = chunks[0]
+		elif chunks:
+			matches = numpy.concatenate(chunks)
+		else:
+			matches = numpy.zeros(0, dtype)
+		yield (comparison, matches.view(numpy.recarray))
+
+def set_args():
+	from optparse import OptionParser
+	parser = OptionParser(usage="%prog [options] [FILE ...]")
+
+	parser.add_option("-b","--binary",
+			  dest="binary",
+			  action="store_true",
+			  default=False,
+			  help="Convert bincompare output to binary")
+	parser.add_option("-t","--text",
+			  dest="text",
+			  action="store_true",
+			  default=False,
+			  help="Convert bincompare output to text")
+	(options,args) = parser.parse_args()
+	if options.binary == options.text:
+		parser.error('Give one of -b and -t')
+
+	return (options,args)
+
+if __name__ == "__main__":
+	import sys
+
+	(options, args) = set_args()
+	streams = [ open(name, 'rb') for name in args ]
+	if not streams:
+		streams = [ sys.stdin ]
+	for stream in streams:
+		if options.binary:
+			write_binary(parse(stream), sys.stdout)
+		else:
+			write_text(parse(stream), sys.stdout)
@@ -0,0 +1,247 @@
+#!/usr/bin/python
+# Program:    disasmcache.py
+# Programmer: Scott Miller
+# Function:   An on-disk cache of objdump disassemblies keyed by file content
+
+# binBLAST suite of binary analysis tools
+# Copyright (C) 2006 Scott Miller
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+# Where the cache lives.  Set this to None to disable the default cache
+#  used by get_cache()
+cachedir = "~/.binblast/cache"
+
+# The most bytes the cache may use on disk before the least recently
+#  used disassemblies are thrown away
+cachesize = 512 * 1024 * 1024
+
+import os
+
+def file_digest(path):
+	"""Returns the hex SHA-1 digest of the contents of path"""
+	import hashlib
+
+	hash = hashlib.sha1()
+	f = open(path,'rb')
+	try:
+		block = f.read(1 << 16)
+		while block:
+			hash.update(block)
+			block = f.read(1 << 16)
+	finally:
+		f.close()
+	return(hash.hexdigest())
+
+class DisassemblyCache:
+	"""A cache of the parsed output of objdumputil.Objdump, keyed
+	by the content of the disassembled file and the objdump
+	arguments used.  Entries may also be looked up by name, a
+	(file, archive, distname) tuple as found in a .idx file, so
+	that a file recorded by mklib can be disassembled again without
+	unpacking it.  Entries are kept as individual pickles under
+	directory, the least recently used being removed whenever the
+	cache grows past maxsize bytes."""
+
+	def __init__(self, directory, maxsize=cachesize, objdump=None):
+		import objdumputil
+
+		self.directory = os.path.expanduser(directory)
+		self.maxsize = maxsize
+		if objdump is None:
+			objdump = objdumputil.Objdump()
+		self.objdump = objdump
+		# The size of the cache on disk, determined when first needed
+		self.size = None
+
+	def key(self, digest):
+		"""Combine a content digest with the objdump arguments"""
+		import hashlib
+
+		return(hashlib.sha1('%s %s %s' % (digest,
+			self.objdump.objdumpBin,
+			self.objdump.objdumpArgs)).hexdigest())
+
+	def entry_path(self, key):
+		return(os.path.join(self.directory, key[0:2], key))
+
+	def name_path(self, name):
+		import hashlib
+
+		key = hashlib.sha1(','.join(name)).hexdigest()
+		return(os.path.join(self.directory, 'names', key[0:2], key))
+
+	def read(self, path):
+		"""Unpickle path, marking it as recently used.  Returns None
+		if it is not in the cache."""
+		import cPickle
+
+		try:
+			f = open(path,'rb')
+		except IOError:
+			return None
+		try:
+			try:
+				value = cPickle.load(f)
+			except (EOFError, cPickle.UnpicklingError):
+				return None
+		finally:
+			f.close()
+
+		# Mark this as recently used for eviction
+		try:
+			os.utime(path, None)
+		except os.error:
+			pass
+		return(value)
+
+	def write(self, path, value):
+		"""Pickle value into path, replacing it atomically"""
+		import cPickle
+		import tempfile
+
+		dirname = os.path.dirname(path)
+		if not os.path.isdir(dirname):
+			try:
+				os.makedirs(dirname)
+			except os.error:
+				# Someone else may have just made it
+				if not os.path.isdir(dirname):
+					raise
+
+		(fd, tmpname) = tempfile.mkstemp(dir=dirname)
+		f = os.fdopen(fd,'wb')
+		try:
+			cPickle.dump(value, f, cPickle.HIGHEST_PROTOCOL)
+		finally:
+			f.close()
+		os.rename(tmpname, path)
+
+		self.grow(os.path.getsize(path))
+
+	def get(self, digest, returnbytes=False):
+		"""Return the cached disassembly for digest, in the form
+		Objdump.disassemble() would return it, or None"""
+		value = self.read(self.entry_path(self.key(digest)))
+		if value is None:
+			return None
+		(instructions, bytes) = value
+		if not returnbytes:
+			return(instructions)
+		if bytes is None:
+			return None
+		return([instructions, bytes])
+
+	def put(self, digest, instructions, bytes=None):
+		"""Store the instruction records (and optionally the raw
+		bytes) of the file with content digest"""
+		self.write(self.entry_path(self.key(digest)), (instructions, bytes))
+
+	def lookup(self, name, returnbytes=False):
+		"""Return the cached disassembly of the file known as name,
+		a (file, archive, distname) tuple, or None"""
+		digest = self.read(self.name_path(name))
+		if digest is None:
+			return None
+		return(self.get(digest, returnbytes))
+
+	def disassemble(self, path, returnbytes=False, name=None):
+		"""A drop-in replacement for Objdump.disassemble() that
+		only runs objdump if the content of path has not been seen
+		before.  If name is given, the file can later be found
+		with lookup(name)."""
+		digest = file_digest(path)
+		result = self.get(digest, returnbytes)
+		if result is None:
+			result = self.objdump.disassemble(path, returnbytes)
+			if returnbytes:
+				self.put(digest, result[0], result[1])
+			else:
+				self.put(digest, result)
+		if name:
+			self.name(name, digest)
+		return(result)
+
+	def store(self, path, instructions, bytes=None, name=None):
+		"""Record an already-made disassembly of path"""
+		digest = file_digest(path)
+		self.put(digest, instructions, bytes)
+		if name:
+			self.name(name, digest)
+
+	def name(self, name, digest):
+		"""Associate name with the file content digest"""
+		path = self.name_path(name)
+		if self.read(path) != digest:
+			self.write(path, digest)
+
+	def grow(self, added):
+		"""Account for added bytes, evicting if necessary"""
+		if self.size is None:
+			self.size = 0
+			for (path, stat) in self.files():
+				self.size += stat.st_size
+		else:
+			self.size += added
+
+		if self.size > self.maxsize:
+			self.evict()
+
+	def files(self):
+		"""A list of (path, os.stat) for everything in the cache"""
+		files = []
+		for (dirname, dirs, names) in os.walk(self.directory):
+			for filename in names:
+				path = os.path.join(dirname, filename)
+				try:
+					files.append( (path, os.stat(path)) )
+				except os.error:
+					continue
+		return(files)
+
+	def evict(self):
+		"""Remove the least recently used files until the cache is
+		comfortably below its maximum size"""
+		files = self.files()
+		files.sort(lambda a, b: cmp(a[1].st_mtime, b[1].st_mtime))
+
+		self.size = 0
+		for (path, stat) in files:
+			self.size += stat.st_size
+
+		# Make some room so this isn't done on every write
+		target = self.maxsize * 9 / 10
+		for (path, stat) in files:
+			if self.size <= target:
+				break
+			try:
+				os.remove(path)
+				self.size -= stat.st_size
+			except os.error:
+				continue
+
+# The cache shared by every tool in this process
+defaultCache = None
+
+def get_cache():
+	"""Return the shared DisassemblyCache, or None if the cache has
+	been disabled by setting cachedir to None"""
+	global defaultCache
+
+	if cachedir is None:
+		return None
+	if defaultCache is None:
+		defaultCache = DisassemblyCache(cachedir)
+	return(defaultCache)
@@ -0,0 +1,235 @@
+#!/usr/bin/python
+# Program:    extractsession.py
+# Programmer: Scott Miller
+# Function:   Keeps unpacked archives around for the rest of a session, so
+#              many files from one archive share a single unpack
+
+# binBLAST suite of binary analysis tools
+# Copyright (C) 2006 Scott Miller
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+# The most bytes the unpacked archives of a session may use on disk
+#  before the least recently used are removed
+sessionsize = 1024 * 1024 * 1024
+
+# Unpacked archives unused for this many seconds are removed
+sessionidle = 10 * 60
+
+# The most distribution ISOs kept open at once
+sessionisos = 4
+
+import os
+import re
+
+# The directories made by a session, named for the process that made
+#  them so that ones left by a process that died can be removed
+treePattern = re.compile(r'^extract-(\d+)-')
+
+class ExtractionSession:
+	"""The archives unpacked by extract() during a session, kept in
+	temporary directories until they haven't been used for maxidle
+	seconds or the least recently used have to go to keep the total
+	under maxsize bytes.  Distribution ISOs the archives are read
+	from are also kept open.  close() removes everything, and is
+	called at exit for the session returned by get_session()."""
+
+	def __init__(self, maxsize=sessionsize, maxidle=sessionidle,
+		     maxisos=sessionisos):
+		import mklib
+
+		self.maxsize = maxsize
+		self.maxidle = maxidle
+		self.maxisos = maxisos
+		self.tempdir = mklib.mytempdir
+		# [directory, size, last used], by (archive, distname)
+		self.trees = {}
+		self.size = 0
+		# [ISO9660, last used], by ISO file name
+		self.isos = {}
+
+		self.remove_orphans()
+
+	def remove_orphans(self):
+		"""Remove the directories of sessions whose process is gone"""
+		import shutil
+
+		try:
+			names = os.listdir(self.tempdir)
+		except os.error:
+			return
+		for name in names:
+			parts = treePattern.match(name)
+			if not parts:
+				continue
+			pid = int(parts.group(1))
+			if pid == os.getpid():
+				continue
+			try:
+				os.kill(pid, 0)
+			except OSError, e:
+				import errno
+				if e.errno == errno.ESRCH:
+					shutil.rmtree(os.path.join(self.tempdir, name),
+						True)
+
+	def iso(self, isoname):
+		"""Return the open ISO9660 of isoname"""
+		import time
+
+		try:
+			iso = self.isos[isoname]
+			iso[1] = time.time()
+			return(iso[0])
+		except KeyError:
+			pass
+
+		import iso9660
+		if len(self.isos) >= self.maxisos:
+			oldest = min(self.isos.keys(),
+				key=lambda name: self.isos[name][1])
+			self.isos.pop(oldest)[0].close()
+		self.isos[isoname] = [ iso9660.ISO9660(isoname), time.time() ]
+		return(self.isos[isoname][0])
+
+	def unpack(self, archive, distname):
+		"""Unpack archive, read out of the distribution ISO if there
+		is one, into a new directory and return it"""
+		import mklib
+		import shutil
+		from tempfile import mkdtemp
+
+		prefix = 'extract-%d-' % os.getpid()
+		tree = mkdtemp(prefix=prefix, dir=self.tempdir)
+		isodir = ''
+		try:
+			# Read the archive out of the distribution ISO
+			if distname:
+				isoname = distname + '.iso'
+				if os.path.isfile(isoname):
+					isodir = mkdtemp(prefix=prefix,
+						dir=self.tempdir)
+					copy = isodir + '/' + archive.split('/')[-1]
+					self.iso(isoname).extract(archive, copy)
+					archive = copy
+
+			# Pull the binaries out of the archive
+			mklib.extract_binaries(archive, tree)
+		except:
+			shutil.rmtree(tree, True)
+			raise
+		finally:
+			if isodir:
+				shutil.rmtree(isodir, True)
+		return(tree)
+
+	def extract(self, entry):
+		"""Return the path of the file in entry, a .idx entry,
+		unpacking its archive if it isn't already.  The path stays
+		good until the next call."""
+		import time
+
+		if not entry.archive:
+			return(entry.file)
+
+		key = (entry.archive, entry.distname)
+		try:
+			tree = self.trees[key]
+		except KeyError:
+			directory = self.unpack(entry.archive, entry.distname)
+			tree = [ directory, tree_size(directory), 0 ]
+			self.trees[key] = tree
+			self.size += tree[1]
+		tree[2] = time.time()
+
+		self.evict(key)
+		return(tree[0] + entry.file)
+
+	def evict(self, keep=None):
+		"""Remove idle archives, then the least recently used until
+		the session is under its maximum size.  keep is never
+		removed."""
+		import time
+
+		now = time.time()
+		keys = self.trees.keys()
+		keys.sort(key=lambda key: self.trees[key][2])
+		for key in keys:
+			if key == keep:
+				continue
+			if now - self.trees[key][2] > self.maxidle or \
+			   self.size > self.maxsize:
+				self.remove(key)
+
+	def remove(self, key):
+		import shutil
+
+		(directory, size, used) = self.trees.pop(key)
+		shutil.rmtree(directory, True)
+		self.size -= size
+
+	def close(self):
+		"""Remove every unpacked archive and close the ISOs"""
+		for key in self.trees.keys():
+			self.remove(key)
+		for (iso, used) in self.isos.values():
+			iso.close()
+		self.isos = {}
+
+def tree_size(directory):
+	"""The bytes used by the files under directory"""
+	size = 0
+	for (dirname, dirs, names) in os.walk(directory):
+		for name in names:
+			try:
+				size += os.lstat(os.path.join(dirname, name)).st_size
+			except os.error:
+				continue
+	return(size)
+
+# The session shared by every tool in this process
+defaultSession = None
+
+def get_session():
+	"""Return the shared ExtractionSession, which is closed at exit.
+	A SIGTERM is turned into an exit, unless something else is
+	already handling it, so that this still happens."""
+	global defaultSession
+
+	if defaultSession is None:
+		import atexit
+		import signal
+
+		defaultSession = ExtractionSession()
+		atexit.register(close_session)
+		try:
+			if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+				signal.signal(signal.SIGTERM, terminate)
+		except ValueError:
+			# Not the main thread
+			pass
+	return(defaultSession)
+
+def close_session():
+	"""Close the shared ExtractionSession, if there is one"""
+	global defaultSession
+
+	if defaultSession is not None:
+		defaultSession.close()
+		defaultSession = None
+
+def terminate(signum, frame):
+	import sys
+	sys.exit(128 + signum)
@@ -27,6 +27,8 @@
 
 # This is required for using stdin
 import sys   # Needed for stdin access
+import heapq
+import itertools
 
 # The scoring constants
 x1 = 6
@@ -41,6 +43,17 @@ Ks = 0.249865
 import math
 x = - math.log(math.log(1/0.99)) / lambdaS
 
+# Megabytes of match lines held for sorting a comparison before they
+#  are spilled to a temporary file
+sortmem = 256
+
+# Bytes a held match line takes beyond its text
+matchOverhead = 160
+
+# Spilled runs are merged this many at a time, which bounds the
+#  number of temporary files open at once
+mergeWidth = 16
+
 def set_args():
 	from optparse import OptionParser
 	parser = OptionParser()
@@ -67,65 +80,172 @@ def set_args():
 		action="store_true",
 		default=False,
 		help="Reduce results into matches covering only fileA")
+	parser.add_option("-m","--sortmem",
+		dest="sortmem",
+		default=str(sortmem),
+		help="Megabytes of matches held while sorting a comparison, beyond which they are spilled to temporary files")
+	parser.add_option("-k","--top",
+		dest="top",
+		default=None,
+		help="Keep only the K best scoring matches of each comparison")
 
 	(options,args) = parser.parse_args()
 	return(options,args)
 
 
-def print_sorted(sortdict, output_stream):
-	"""Using a sortdict, keyed on something sortable and valued
-	with a list of items associated with that key, sort the keys
-	in decreasing order and then print each item associated with
-	that key to output_stream, on-per-line."""
+class MatchSorter:
+	"""Collects the match lines of a comparison and writes them out
+	in decreasing order of score, lines with the same score in the
+	order they were added.  The lines are held in a list for each
+	score, and once they take maxmem bytes they are spilled to a
+	temporary file as a sorted run.  The runs are merged as they are
+	written, so a comparison of any size can be sorted.  With top,
+	only the best top lines are kept, in a heap."""
+
+	def __init__(self, maxmem=sortmem * 1024 * 1024, top=None):
+		self.maxmem = maxmem
+		self.top = top
+		# Lists of lines keyed by score, or the heap with top
+		self.matches = {}
+		if top is not None:
+			self.matches = []
+		self.size = 0
+		self.count = 0
+		# [level, file], where a run of level n was merged from
+		#  mergeWidth runs of level n - 1
+		self.runs = []
+
+	def add(self, score, line):
+		self.count += 1
+		if self.top is not None:
+			# The smallest kept is at the top of the heap, and
+			#  of equal scores the one added last goes first
+			item = (score, -self.count, line)
+			if len(self.matches) < self.top:
+				heapq.heappush(self.matches, item)
+			elif self.matches and item > self.matches[0]:
+				heapq.heapreplace(self.matches, item)
+			return
+
+		try:
+			self.matches[score].append(line)
+		except KeyError:
+			self.matches[score] = [ line ]
+		self.size += len(line) + matchOverhead
+		if self.size >= self.maxmem:
+			self.spill()
+
+	def held(self):
+		"""The held lines, best first, one list for each score"""
+		if self.top is not None:
+			self.matches.sort(reverse=True)
+			return([ [ m[2] for m in self.matches ] ])
+		scores = self.matches.keys()
+		scores.sort(reverse=True)
+		return([ self.matches[score] for score in scores ])
 
-	# Get the keys sorted in descending order
-	keylist = sortdict.keys()
-	keylist.sort()
-	keylist.reverse()
+	def spill(self):
+		"""Write the held lines out as a sorted run"""
+		run = run_file()
+		for lines in self.held():
+			run.write('\n'.join(lines) + '\n')
+		self.matches = {}
+		self.size = 0
+		self.runs.append([0, run])
 
-	# Print the values in-order, one item per line
-	for k in keylist:
-		for item in sortdict[k]:
-			output_stream.write('%s\n' % str(item) )
+		# Merge the newest runs once mergeWidth of them have the
+		#  same level.  They were spilled one after another, so
+		#  the merge still keeps equal scores in order.
+		while len(self.runs) >= mergeWidth and \
+		      self.runs[-mergeWidth][0] == self.runs[-1][0]:
+			runs = self.runs[-mergeWidth:]
+			del self.runs[-mergeWidth:]
+			merged = run_file()
+			for line in merge_runs([r[1] for r in runs]):
+				merged.write('%s\n' % line)
+			for r in runs:
+				r[1].close()
+			self.runs.append([runs[0][0] + 1, merged])
 
-	# All done
+	def write(self, output_stream):
+		"""Write the lines, one per line, to output_stream and
+		start over"""
+		held = [ lines for lines in self.held() if lines ]
+		if self.runs:
+			held = [ itertools.chain(*held) ]
+			lines = merge_runs([r[1] for r in self.runs] + held)
+			for line in lines:
+				output_stream.write('%s\n' % line)
+		else:
+			for lines in held:
+				output_stream.write('\n'.join(lines) + '\n')
+		self.close()
+
+	def close(self):
+		"""Drop the held lines and remove the runs"""
+		for r in self.runs:
+			r[1].close()
+		self.runs = []
+		self.matches = {}
+		if self.top is not None:
+			self.matches = []
+		self.size = 0
+		self.count = 0
+
+def run_file():
+	"""A temporary file for a sorted run, removed when closed"""
+	from tempfile import TemporaryFile
+	return(TemporaryFile(prefix='filterbincompare-'))
+
+def merge_runs(runs):
+	"""Merge runs, files or sequences of match lines each in
+	decreasing order of score, into one sequence of lines in
+	decreasing order of score.  Lines of equal score come in the
+	order of their runs, then of their place in the run."""
+
+	def keyed(n, run):
+		if hasattr(run, 'seek'):
+			run.seek(0)
+		i = 0
+		for line in run:
+			line = line.rstrip('\n')
+			i += 1
+			yield (-long(line.split(',')[2]), n, i, line)
+
+	for item in heapq.merge(*[keyed(n, run) for (n, run) in enumerate(runs)]):
+		yield item[3]
+
+def mark_coverage(cov, a, dlen):
+	"""Mark the dlen instructions from a as covered in cov, see
+	print_coverage().  Anything past the end of fileA is ignored."""
+	end = min(a + dlen, len(cov))
+	if end > a:
+		cov[a:end] = '\x01' * (end - a)
 
 def print_coverage(cov, offset, output_stream):
 	"""This will output matches to output_stream to reflect only
 	the coverage of fileA by all matches.  Thus, in this form,
-	fileB and score are unused and are set to 0 and -1 respectively."""
-
-	# Loop preconditions
-	lastCoveredIndex = 0
-	inCovered = False
-	for i in range(len(cov)):
-		# We're entering a covered section
-		if cov[i] and (not inCovered):
-			lastCoveredIndex = i
-			inCovered = True
-			
-		# We've left a covered section, print it out
-		elif (not cov[i]) and inCovered:
-			output_stream.write('%d,0,-1,%d\n' % ( \
-				lastCoveredIndex + offset,
-				i - lastCoveredIndex) )
-			inCovered = False
-	# We had a coverage section that went all the way to the end
-	if inCovered:
-		i = len(cov)
+	fileB and score are unused and are set to 0 and -1 respectively.
+	cov is a bytearray with a 1 for every covered instruction of
+	fileA, so covered sections are found with find()."""
+
+	start = cov.find('\x01')
+	while start >= 0:
+		# Where this covered section ends
+		end = cov.find('\x00', start)
+		if end < 0:
+			end = len(cov)
 		output_stream.write('%d,0,-1,%d\n' % ( \
-			lastCoveredIndex + offset,
-			i - lastCoveredIndex) )
+			start + offset,
+			end - start) )
+		start = cov.find('\x01', end)
 
 	
 def filter_stream(bincompare_stream,output_stream,options):
 	"""Filter the stream of incoming results from 
 	bincompare_stream and write the results to output_stream
 	using the provided options."""
-	# TODO: There is definitely some duplicated code between this
-	#  fucntion and matchoutput.bincompare_matches.  There's
-	#  probably a better way to write a common bincompare output
-	#  interface
+	import bincompareoutput
 
 	# Bincompare streams can contain multiple result streams.
 	# We've not yet seen anything.  Not we're only interested
@@ -136,112 +256,25 @@ def filter_stream(bincompare_stream,output_stream,options):
 	offB = 0
 	lenB = 0
 
-	# Initialize the matches dictionary, which may or may not
-	#  be used
-	matches = {}
-	cov = []
-
 	# Convert the options into something useful
 	minscore = long(options.minscore)
 	minlen = long(options.minlen)
-	
-	# Start looking for the first file
-	lookingFor = 'fileA'
-
-	# Consider the input line-by-line
-	line = bincompare_stream.readline()
-	while line:
-		# Remove whitespace
-		line = line.strip()
-		
-		# Lines starting with `File ' are the cue that we've
-		#  encountered a comparison output
-		if line.startswith('File ') and \
-		   lookingFor not in ['fileA', 'fileB']:
-		   	# Are we storing anything?
-		   	if matches:
-				print_sorted(matches, output_stream)
-				matches = {}
-			if cov:
-				print_coverage(cov, offA, output_stream)
-				cov = {}
-				
-		   	lookingFor = 'fileA'
-			
-		# Assume shellscript-type comments and blank lines
-		#  may be present in the file.  Simply pass them along
-		if line.startswith('#') or line == '':
-			output_stream.write('%s\n' % line)
-		# We're looking for the idx files?
-		elif lookingFor in ['fileA', 'fileB'] :
-			# The rest of this will be in the form
-			# File FILENAME, offset OFFSET, len LEN
-			try:
-				(filename, a)   = line[5:].split(', offset ',2)
-				(offset,   dlen) =        a.split(', len'    ,2)
-				offset = long(offset)
-				dlen    = long(dlen)
-			except ValueError:
-				line = bincompare_stream.readline()
-				continue
-				
-			# Echo this to the output
-			output_stream.write('File %s, offset %d, len %d\n' % ( \
-				filename,
-				offset,
-				dlen) )
-				
-			# If we're compensating for dirout, we need to
-			#  keep the offsets.  Otherwise, discard
-			if not options.dirout:
-				offset = 0
-
-			# Store this in our variables as necessary,
-			#  prepare for the next step
-			if lookingFor == 'fileA':
-				offA = offset
-				lenA = dlen
-				lookingFor = 'fileB'
-			else:
-				offB = offset
-				lenB = dlen
-				lookingFor = 'match'
-				# Before we get carried away, make sure
-				#  to note that this filtering has done
-				#  something
-				optstr = ''
-				if options.dirout:
-					optstr = '%s dirout' % optstr
-				if options.minlen:
-					optstr = '%s minlen=%d' % (optstr, minlen) 
-				if options.minscore:
-					optstr = '%s minscore=%d' % (optstr, minscore)
-				if options.coverage:
-					optstr = '%s coverage' % optstr
-					# Initialize the coverage array
-					cov = []
-					for i in range(lenA):
-						cov.append(False)
-					
-				if options.sort:
-					optstr = '%s sort' % optstr
-
-				output_stream.write('# filterbincompare: %s \n' % optstr)
-		elif lookingFor == 'match':
-			fields = line.split(',')
-
-			# 4+ fields == match
-			if len(fields) >= 4:
-			 try:
-				a =     long(fields[0])
-				b =     long(fields[1])
-				score = long(fields[2])
-				dlen =  long(fields[3])
+	top = None
+	if options.top is not None:
+		top = long(options.top)
 
+	# Initialize the sorter, which may or may not be used
+	matches = MatchSorter(long(float(options.sortmem) * 1024 * 1024), top)
+	cov = []
+	
+	for (kind, record) in bincompareoutput.parse(bincompare_stream):
+		if kind == bincompareoutput.MATCHES:
+			for (a, b, score, dlen) in record:
+				# Nothing is known about an empty match
 				if score < minscore or \
-				   dlen < minlen:
-				   raise ZeroDivisionError
-				   
+				   dlen < minlen or dlen <= 0:
+					continue
+			   
 				# Filtering
 				gain = 20.0 * math.log10(1.0 * score / (x2 * dlen))
 				noise =  ((math.log(dlen) + math.log(Ks)) / lambdaS
@@ -250,36 +283,82 @@ def filter_stream(bincompare_stream,output_stream,options):
 
 				# Anything useful remain?
 				if gain < noisegain:
-					raise ZeroDivisionError
-				
+					continue
+			
 				line = '%d,%d,%d,%d' % (
 					a + offA,
 					b + offB,
 					score,
 					dlen )
-	
+
 				# Include in coverage
 				if options.coverage:
-				 for i in range(a,a+dlen):
-					cov[i] = True
+				 mark_coverage(cov, a, dlen)
 				# Add to sort
-				elif options.sort:
-				 try:
-					matches[score].append( line )
-				 except KeyError:
-					matches[score] = [ line ]
+				elif options.sort or top is not None:
+				 matches.add(score, line)
 				else:
 					output_stream.write('%s\n' % line)	
-			 except ZeroDivisionError:
-				pass 
-		
-		# Get the next line of the input stream
-		line = bincompare_stream.readline()
+
+		# Assume shellscript-type comments and blank lines
+		#  may be present in the file.  Simply pass them along
+		elif kind == bincompareoutput.COMMENT:
+			output_stream.write('%s\n' % record)
+
+		# A new comparison
+		elif kind == bincompareoutput.COMPARISON:
+			# Are we storing anything?
+			if matches.count:
+				matches.write(output_stream)
+			if cov:
+				print_coverage(cov, offA, output_stream)
+				cov = []
+
+			# Echo this to the output
+			output_stream.write('File %s, offset %d, len %d\n' % ( \
+				record.fileA,
+				record.offsetA,
+				record.lenA) )
+			output_stream.write('File %s, offset %d, len %d\n' % ( \
+				record.fileB,
+				record.offsetB,
+				record.lenB) )
+				
+			# If we're compensating for dirout, we need to
+			#  keep the offsets.  Otherwise, discard
+			offA = record.offsetA
+			lenA = record.lenA
+			offB = record.offsetB
+			lenB = record.lenB
+			if not options.dirout:
+				offA = 0
+				offB = 0
+
+			# Before we get carried away, make sure
+			#  to note that this filtering has done
+			#  something
+			optstr = ''
+			if options.dirout:
+				optstr = '%s dirout' % optstr
+			if options.minlen:
+				optstr = '%s minlen=%d' % (optstr, minlen) 
+			if options.minscore:
+				optstr = '%s minscore=%d' % (optstr, minscore)
+			if options.coverage:
+				optstr = '%s coverage' % optstr
+				# Initialize the coverage array
+				cov = bytearray(lenA)
+				
+			if options.sort:
+				optstr = '%s sort' % optstr
+			if top is not None:
+				optstr = '%s top=%d' % (optstr, top)
+
+			output_stream.write('# filterbincompare: %s \n' % optstr)
 
 	# Are we storing anything?
-	if matches:
-		print_sorted(matches, output_stream)
-		matches = {}
+	if matches.count:
+		matches.write(output_stream)
 	if cov:
 		print_coverage(cov, offA, output_stream)
 
@@ -0,0 +1,374 @@
+#!/usr/bin/python
+# Program:    iso9660.py
+# Programmer: Scott Miller
+# Function:   A read-only ISO9660 (Rock Ridge/Joliet) image reader, so
+#              distribution ISOs can be read without mounting them
+
+# binBLAST suite of binary analysis tools
+# Copyright (C) 2006 Scott Miller
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+import struct
+
+# Everything on the image is addressed in logical sectors of this size
+SECTOR = 2048
+
+# The escape sequences that mark a supplementary volume descriptor
+#  as Joliet (UCS-2 levels 1-3)
+jolietEscapes = ['%/@', '%/C', '%/E']
+
+class ISOEntry:
+	"""A storage class for a file or directory on the image"""
+	name = ''
+	extents = []   # A list of (sector, length) pairs
+	size = 0L
+	mtime = 0L
+	isdir = False
+	multiextent = False # More extents follow in the next record
+	relocated = False   # A Rock Ridge relocated directory (RE)
+	childlink = None    # The real location of a moved directory (CL)
+
+	def __init__(self):
+		self.name = ''
+		self.extents = []
+		self.size = 0L
+		self.mtime = 0L
+		self.isdir = False
+		self.multiextent = False
+		self.relocated = False
+		self.childlink = None
+
+	def __repr__(self):
+		return( "{ 'name':'%s', 'size':%u, 'isdir':%s }" % (
+			self.name, self.size, self.isdir ) )
+
+class ISOFile:
+	"""A read-only, seekable file-like object for a file on the
+	image.  Reads go straight to the image file."""
+
+	def __init__(self, image, entry):
+		self.image = image
+		self.entry = entry
+		self.pos = 0L
+		self.closed = False
+
+	def tell(self):
+		return(self.pos)
+
+	def seek(self, offset, whence=0):
+		if whence == 1:
+			offset += self.pos
+		elif whence == 2:
+			offset += self.entry.size
+		self.pos = max(0L, offset)
+
+	def read(self, size=-1):
+		"""Read up to size bytes, or everything that's left"""
+		if size is None or size < 0:
+			size = self.entry.size - self.pos
+		size = min(size, self.entry.size - self.pos)
+
+		data = []
+		# Find where pos falls among the extents
+		extentStart = 0L
+		for (sector, length) in self.entry.extents:
+			if size <= 0:
+				break
+			if self.pos < extentStart + length:
+				skip = self.pos - extentStart
+				count = min(size, length - skip)
+				self.image.seek(sector * SECTOR + skip)
+				block = self.image.read(count)
+				if not block:
+					break
+				data.append(block)
+				self.pos += len(block)
+				size -= len(block)
+			extentStart += length
+
+		return(''.join(data))
+
+	def close(self):
+		self.closed = True
+
+class ISO9660:
+	"""A reader for an ISO9660 image.  Names are taken from Rock Ridge
+	entries if the image has them, otherwise from the Joliet tree if
+	there is one, otherwise from the plain ISO9660 names (lowercased,
+	as mount shows them).  Paths are absolute and '/' separated."""
+
+	def __init__(self, filename):
+		self.filename = filename
+		self.image = open(filename, 'rb')
+		# Directory listings, keyed by path
+		self.dirs = {}
+		self.joliet = False
+		self.rockridge = False
+		# SUSP bytes to skip at the start of each system use field
+		self.suspSkip = 0
+
+		primary = None
+		joliet = None
+		sector = 16
+		while True:
+			self.image.seek(sector * SECTOR)
+			descriptor = self.image.read(SECTOR)
+			if len(descriptor) < SECTOR or descriptor[1:6] != 'CD001':
+				raise IOError('%s is not an ISO9660 image' % filename)
+			type = ord(descriptor[0])
+			# Terminator
+			if type == 255:
+				break
+			if type == 1 and primary is None:
+				primary = descriptor
+			elif type == 2 and descriptor[88:91] in jolietEscapes:
+				joliet = descriptor
+			sector += 1
+
+		if primary is None:
+			raise IOError('%s has no primary volume descriptor' % filename)
+
+		self.root = self.parse_record(primary[156:190], False)
+		self.root.name = ''
+
+		# Does the primary tree have Rock Ridge names?  The SP
+		#  entry is in the root's `.' record
+		self.image.seek(self.root.extents[0][0] * SECTOR)
+		dot = self.image.read(SECTOR)
+		susp = dot[34:ord(dot[0])]
+		if susp[0:2] == 'SP' and susp[4:6] == '\xbe\xef':
+			self.rockridge = True
+			self.suspSkip = ord(susp[6])
+
+		if not self.rockridge and joliet is not None:
+			self.joliet = True
+			self.root = self.parse_record(joliet[156:190], False)
+			self.root.name = ''
+
+	def close(self):
+		self.image.close()
+
+	def parse_record(self, record, rockridge=None):
+		"""Turn a directory record into an ISOEntry"""
+		import calendar
+
+		if rockridge is None:
+			rockridge = self.rockridge
+
+		entry = ISOEntry()
+		(sector, ) = struct.unpack('<I', record[2:6])
+		(size, ) = struct.unpack('<I', record[10:14])
+		entry.extents = [ (long(sector), long(size)) ]
+		entry.size = long(size)
+		flags = ord(record[25])
+		entry.isdir = bool(flags & 2)
+		entry.multiextent = bool(flags & 0x80)
+
+		# Recording date
+		(year, month, day, hour, minute, second, gmtoff) = \
+			struct.unpack('6Bb', record[18:25])
+		try:
+			entry.mtime = long(calendar.timegm( (1900 + year, month,
+				day, hour, minute, second, 0, 0, 0) )) - \
+				gmtoff * 15 * 60
+		except (ValueError, OverflowError):
+			entry.mtime = 0L
+
+		nameLen = ord(record[32])
+		name = record[33:33 + nameLen]
+		if nameLen == 1 and name in '\x00\x01':
+			# `.' and `..'
+			pass
+		elif self.joliet:
+			name = name.decode('utf_16_be').encode('utf_8')
+			name = name.split(';')[0]
+		else:
+			name = name.split(';')[0]
+			if name.endswith('.') and not entry.isdir:
+				name = name[:-1]
+			name = name.lower()
+		entry.name = name
+
+		# The system use area follows the (padded) name
+		if rockridge:
+			start = 33 + nameLen
+			if nameLen % 2 == 0:
+				start += 1
+			self.parse_susp(entry, record[start + self.suspSkip:])
+
+		return(entry)
+
+	def parse_susp(self, entry, susp):
+		"""Apply the Rock Ridge entries in susp to entry"""
+		names = []
+		while len(susp) >= 4:
+			sig = susp[0:2]
+			length = ord(susp[2])
+			if length < 4:
+				break
+			data = susp[4:length]
+			if sig == 'NM':
+				flags = ord(data[0])
+				# Skip the `.' and `..' names
+				if not flags & 6:
+					names.append(data[1:])
+			elif sig == 'RE':
+				entry.relocated = True
+			elif sig == 'CL':
+				(entry.childlink, ) = struct.unpack('<I', data[0:4])
+			elif sig == 'CE':
+				# The entries continue elsewhere
+				(sector, ) = struct.unpack('<I', data[0:4])
+				(offset, ) = struct.unpack('<I', data[8:12])
+				(celen, ) = struct.unpack('<I', data[16:20])
+				self.image.seek(sector * SECTOR + offset)
+				susp = self.image.read(celen)
+				continue
+			elif sig == 'ST':
+				break
+			susp = susp[length:]
+
+		if names:
+			entry.name = ''.join(names)
+
+	def read_dir(self, dirEntry):
+		"""Return the entries of a directory, keyed by name"""
+		entries = {}
+		last = None
+		for (sector, length) in dirEntry.extents:
+			self.image.seek(sector * SECTOR)
+			data = self.image.read(length)
+			pos = 0
+			while pos < len(data):
+				recLen = ord(data[pos])
+				# Records don't cross sector boundaries
+				if recLen == 0:
+					pos = (pos / SECTOR + 1) * SECTOR
+					continue
+				record = data[pos:pos + recLen]
+				pos += recLen
+
+				# Skip `.' and `..'
+				if record[33] in '\x00\x01' and ord(record[32]) == 1:
+					continue
+
+				entry = self.parse_record(record)
+				if entry.relocated:
+					continue
+				if entry.childlink is not None:
+					entry.isdir = True
+					self.image.seek(entry.childlink * SECTOR)
+					child = self.image.read(SECTOR)
+					entry.extents = self.parse_record(child[0:ord(child[0])],
+						False).extents
+
+				# Pieces of a multi-extent file follow each
+				#  other
+				if last is not None and last.multiextent and \
+				   last.name == entry.name:
+					last.extents.extend(entry.extents)
+					last.size += entry.size
+					last.multiextent = entry.multiextent
+					continue
+
+				entries[entry.name] = entry
+				last = entry
+		return(entries)
+
+	def listing(self, path):
+		"""Return the cached listing of the directory path"""
+		path = '/' + path.strip('/')
+		try:
+			return(self.dirs[path])
+		except KeyError:
+			pass
+
+		if path == '/':
+			dirEntry = self.root
+		else:
+			(parent, name) = path.rsplit('/', 1)
+			dirEntry = self.listing(parent or '/')[name]
+			if not dirEntry.isdir:
+				raise IOError('%s is not a directory' % path)
+
+		listing = self.read_dir(dirEntry)
+		self.dirs[path] = listing
+		return(listing)
+
+	def entry(self, path):
+		"""Return the ISOEntry for path"""
+		path = '/' + path.strip('/')
+		if path == '/':
+			return(self.root)
+		(parent, name) = path.rsplit('/', 1)
+		try:
+			return(self.listing(parent or '/')[name])
+		except KeyError:
+			raise IOError('%s not found in %s' % (path, self.filename))
+
+	def listdir(self, path='/'):
+		names = self.listing(path).keys()
+		names.sort()
+		return(names)
+
+	def isdir(self, path):
+		try:
+			return(self.entry(path).isdir)
+		except IOError:
+			return(False)
+
+	def isfile(self, path):
+		try:
+			return(not self.entry(path).isdir)
+		except IOError:
+			return(False)
+
+	def walk(self, path='/'):
+		"""Like os.walk, yields (dirpath, dirnames, filenames) for
+		every directory under path"""
+		path = '/' + path.strip('/')
+		listing = self.listing(path)
+		dirnames = []
+		filenames = []
+		for name in self.listdir(path):
+			if listing[name].isdir:
+				dirnames.append(name)
+			else:
+				filenames.append(name)
+		yield (path, dirnames, filenames)
+
+		for name in dirnames:
+			for result in self.walk(path.rstrip('/') + '/' + name):
+				yield result
+
+	def open(self, path):
+		"""Return a file-like object reading path from the image"""
+		entry = self.entry(path)
+		if entry.isdir:
+			raise IOError('%s is a directory' % path)
+		return(ISOFile(self.image, entry))
+
+	def extract(self, path, destination):
+		"""Copy the file path on the image to destination"""
+		import shutil
+
+		member = self.open(path)
+		out = open(destination, 'wb')
+		try:
+			shutil.copyfileobj(member, out, 1 << 20)
+		finally:
+			out.close()
+			member.close()
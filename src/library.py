@@ -0,0 +1,396 @@
+#!/usr/bin/python
+# Program:    library.py
+# Programmer: Scott Miller
+# Function:   Reader, writer and converter for the binary library format,
+#              a versioned .dat file and a fixed-width binary .idx file
+
+# binBLAST suite of binary analysis tools
+# Copyright (C) 2006 Scott Miller
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+# The binary library format (all integers little-endian):
+#
+#  name.dat  A 16 byte header, followed by the 4-byte tokens exactly as
+#            mklib writes them.  Token offsets are counted from the end
+#            of the header, so they are the same as in a headerless .dat
+#              magic    'BBLD'
+#              version  uint32
+#              hdrlen   uint32, the bytes before the first token
+#              reserved uint32
+#
+#  name.idx  A 32 byte header, a table of fixed-width entries sorted by
+#            start, then a table of NUL-terminated strings
+#              magic    'BBLI'
+#              version  uint32
+#              count    uint32, the number of entries
+#              reserved uint32
+#              tokens   uint64, the number of tokens in name.dat
+#              strlen   uint64, the size of the string table
+#            Each 24 byte entry is
+#              start    uint64, the first token of the file
+#              file     uint32, offset of the name in the string table
+#              archive  uint32, ditto
+#              distname uint32, ditto
+#              reserved uint32
+#
+# Files written by mklib (a headerless .dat and a text .idx) can be
+#  converted with `library.py -c NAME'.
+#
+# With --addresses, mklib also writes two sidecar files, which conversion
+#  leaves alone:
+#
+#  name.addr    The virtual address objdump gave each token of name.dat,
+#               a uint64 per token, so token t is at byte 8 * t.  The
+#               terminator after each file is 0.
+#
+#  name.labels  A `TOKEN<TAB>LABEL' text line for every token objdump
+#               labelled (the first instruction of each function), in
+#               token order.
+
+import struct
+
+VERSION = 1
+
+datMagic = 'BBLD'
+datHeader = struct.Struct('<4sIII')
+
+idxMagic = 'BBLI'
+idxHeader = struct.Struct('<4sIIIQQ')
+idxEntry = struct.Struct('<QIIII')
+
+def dat_header_size(datname):
+	"""Return the number of bytes before the first token of datname,
+	0 for a headerless .dat"""
+	f = open(datname, 'rb')
+	try:
+		header = f.read(datHeader.size)
+	finally:
+		f.close()
+	if len(header) == datHeader.size and header[0:4] == datMagic:
+		(magic, version, hdrlen, reserved) = datHeader.unpack(header)
+		if version > VERSION:
+			raise IOError('%s is version %d, only %d is supported' % (
+				datname, version, VERSION))
+		return(hdrlen)
+	return(0)
+
+def is_binary_index(idxname):
+	"""True if idxname is a binary .idx file rather than text"""
+	try:
+		f = open(idxname, 'rb')
+	except IOError:
+		return(False)
+	try:
+		return(f.read(4) == idxMagic)
+	finally:
+		f.close()
+
+def map_file(name):
+	"""mmap name read-only, or return '' if it is empty"""
+	import mmap
+	import os
+
+	f = open(name, 'rb')
+	try:
+		if os.fstat(f.fileno()).st_size == 0:
+			return('')
+		return(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+	finally:
+		f.close()
+
+class _Starts:
+	"""A read-only sequence view of the start column of a binary
+	.idx, so bisect can search it without loading it"""
+
+	def __init__(self, data, count):
+		self.data = data
+		self.count = count
+
+	def __len__(self):
+		return(self.count)
+
+	def __getitem__(self, i):
+		if i < 0:
+			i += self.count
+		if i < 0 or i >= self.count:
+			raise IndexError(i)
+		return(struct.unpack_from('<Q', self.data,
+			idxHeader.size + i * idxEntry.size)[0])
+
+class Library:
+	"""A reader for a binary library.  name is the library name
+	without the .dat or .idx extension.  Both files are mmapped, and
+	lookups are binary searches over the start column of the .idx."""
+
+	def __init__(self, name):
+		self.name = name
+		self.dat = map_file(name + '.dat')
+		self.idx = map_file(name + '.idx')
+
+		# The .dat may be headerless
+		self.datStart = 0
+		if self.dat[0:4] == datMagic:
+			self.datStart = datHeader.unpack_from(self.dat, 0)[2]
+
+		if self.idx[0:4] != idxMagic:
+			raise IOError('%s.idx is not a binary index' % name)
+		(magic, version, self.count, reserved, self.tokens,
+		 strlen) = idxHeader.unpack_from(self.idx, 0)
+		if version > VERSION:
+			raise IOError('%s.idx is version %d, only %d is supported' % (
+				name, version, VERSION))
+		self.strings = idxHeader.size + self.count * idxEntry.size
+		self.starts = _Starts(self.idx, self.count)
+
+	def __len__(self):
+		return(self.count)
+
+	def string(self, offset):
+		"""Return the string at offset in the string table"""
+		start = self.strings + offset
+		end = self.idx.find('\x00', start)
+		return(self.idx[start:end])
+
+	def end(self, i):
+		"""The token after the last token of entry i"""
+		# Entries sharing a start (mklib --dedup) end at the next
+		#  different start
+		import bisect
+
+		start = self.starts[i]
+		j = bisect.bisect_right(self.starts, start)
+		if j < self.count:
+			return(self.starts[j])
+		return(self.tokens)
+
+	def entry(self, i):
+		"""Return entry i as a (start, len, file, archive, distname)
+		tuple"""
+		(start, file, archive, distname, reserved) = \
+			idxEntry.unpack_from(self.idx,
+				idxHeader.size + i * idxEntry.size)
+		return( (start, self.end(i) - start, self.string(file),
+			self.string(archive), self.string(distname)) )
+
+	def find(self, offset):
+		"""Return the index of the entry containing the token offset,
+		the first of them if several share its start, or -1"""
+		import bisect
+
+		i = bisect.bisect_right(self.starts, offset) - 1
+		if i < 0:
+			return(-1)
+		# Go back to the first entry with this start
+		return(bisect.bisect_left(self.starts, self.starts[i]))
+
+	def aliases(self, i):
+		"""Return the indexes of every entry sharing entry i's start"""
+		import bisect
+
+		start = self.starts[i]
+		return(range(bisect.bisect_left(self.starts, start),
+			bisect.bisect_right(self.starts, start)))
+
+	def token_slice(self, start, length):
+		"""Return a zero-copy buffer of length tokens from start"""
+		offset = self.datStart + start * 4
+		return(buffer(self.dat, offset, length * 4))
+
+	def entry_tokens(self, i):
+		"""Return a zero-copy buffer of the tokens of entry i"""
+		entry = self.entry(i)
+		return(self.token_slice(entry[0], entry[1]))
+
+	def close(self):
+		for m in [self.dat, self.idx]:
+			if m:
+				m.close()
+
+class AddressTable:
+	"""A reader for the .addr and .labels sidecar files of library
+	name.  Both are mmapped, and labels are found by a binary search
+	over the lines of the .labels file."""
+
+	def __init__(self, name):
+		self.name = name
+		self.addr = map_file(name + '.addr')
+		try:
+			self.labels = map_file(name + '.labels')
+		except IOError:
+			self.labels = ''
+
+	def __len__(self):
+		return(len(self.addr) / 8)
+
+	def address(self, token):
+		"""The address of token, or 0 if it isn't known"""
+		if token < 0 or token >= len(self):
+			return(0)
+		return(struct.unpack_from('<Q', self.addr, token * 8)[0])
+
+	def label(self, token, first=0):
+		"""Return the label of the nearest labelled token at or
+		before token, but not before first, or None"""
+		data = self.labels
+		lo = 0
+		hi = len(data)
+		best = None
+		# lo and hi are always at the start of a line
+		while lo < hi:
+			mid = (lo + hi) / 2
+			start = data.rfind('\n', 0, mid) + 1
+			end = data.find('\n', mid)
+			if end < 0:
+				end = len(data)
+			(labelled, label) = data[start:end].split('\t', 1)
+			if long(labelled) <= token:
+				best = (long(labelled), label)
+				lo = end + 1
+			else:
+				hi = start
+		if best is None or best[0] < first:
+			return(None)
+		return(best[1])
+
+	def close(self):
+		for m in [self.addr, self.labels]:
+			if m:
+				m.close()
+
+def write_index(idxname, entries, tokens):
+	"""Write a binary .idx file.  entries is a list of (start, file,
+	archive, distname) and tokens the number of tokens in the .dat"""
+	import os
+
+	# Stable, so files sharing a start keep their order
+	entries = sorted(entries, key=lambda e: e[0])
+
+	strings = {}
+	table = []
+	size = [0]
+	def intern(s):
+		try:
+			return(strings[s])
+		except KeyError:
+			strings[s] = size[0]
+			table.append(s + '\x00')
+			size[0] += len(s) + 1
+			return(strings[s])
+
+	rows = []
+	for (start, file, archive, distname) in entries:
+		rows.append(idxEntry.pack(start, intern(file), intern(archive),
+			intern(distname), 0))
+
+	tmpname = idxname + '.tmp'
+	out = open(tmpname, 'wb')
+	try:
+		out.write(idxHeader.pack(idxMagic, VERSION, len(rows), 0,
+			tokens, size[0]))
+		out.write(''.join(rows))
+		out.write(''.join(table))
+	finally:
+		out.close()
+	os.rename(tmpname, idxname)
+
+def read_text_index(idxname):
+	"""Return the (start, file, archive, distname) entries of a text
+	.idx file as written by mklib"""
+	entries = []
+	f = open(idxname)
+	for line in f:
+		parts = line.rstrip('\n').split(',')
+		try:
+			start = long(parts[0])
+		except ValueError:
+			continue
+		# Commas in file names can't be told apart from the
+		#  separators, so the archive and distname are taken from
+		#  the end
+		while len(parts) < 4:
+			parts.append('')
+		distname = parts[-1]
+		archive = parts[-2]
+		file = ','.join(parts[1:-2])
+		entries.append( (start, file, archive, distname) )
+	f.close()
+	return(entries)
+
+def convert(name):
+	"""Convert the mklib library name (a headerless .dat and text
+	.idx) into the binary format in place.  The text index is kept
+	as name.idx.txt."""
+	import os
+	import shutil
+
+	if is_binary_index(name + '.idx'):
+		raise IOError('%s.idx is already a binary index' % name)
+
+	entries = read_text_index(name + '.idx')
+
+	# Give the .dat a header, if it doesn't have one
+	hdrlen = dat_header_size(name + '.dat')
+	tokens = (os.path.getsize(name + '.dat') - hdrlen) / 4
+	if hdrlen == 0:
+		tmpname = name + '.dat.tmp'
+		out = open(tmpname, 'wb')
+		dat = open(name + '.dat', 'rb')
+		try:
+			out.write(datHeader.pack(datMagic, VERSION,
+				datHeader.size, 0))
+			shutil.copyfileobj(dat, out, 1 << 20)
+		finally:
+			dat.close()
+			out.close()
+		os.rename(tmpname, name + '.dat')
+
+	shutil.copy(name + '.idx', name + '.idx.txt')
+	write_index(name + '.idx', entries, tokens)
+
+def set_args():
+	from optparse import OptionParser
+	parser = OptionParser(usage="%prog [options] NAME ...")
+
+	parser.add_option("-c","--convert",
+			  dest="convert",
+			  action="store_true",
+			  default=False,
+			  help="Convert the mklib output NAME.dat and NAME.idx to the binary format")
+	parser.add_option("-p","--print",
+			  dest="dump",
+			  action="store_true",
+			  default=False,
+			  help="Print a binary NAME.idx in the text .idx format")
+	(options,args) = parser.parse_args()
+	if not args or not (options.convert or options.dump):
+		parser.error('Nothing to do')
+
+	return (options,args)
+
+if __name__ == "__main__":
+	import sys
+
+	(options, args) = set_args()
+	for name in args:
+		if options.convert:
+			convert(name)
+		if options.dump:
+			lib = Library(name)
+			for i in range(len(lib)):
+				(start, dlen, file, archive, distname) = lib.entry(i)
+				sys.stdout.write('%ld,%s,%s,%s\n' % (start, file,
+					archive, distname))
+			lib.close()
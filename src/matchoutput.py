@@ -20,49 +20,110 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 
+def extract_entry(entry):
+	"""Locate the file in entry, extracting it from its archive (and
+	the distribution ISO) if needed, and return its path.  Archives
+	stay unpacked for the rest of the session, see extractsession.py,
+	and the path is good until the next call."""
+	import extractsession
+
+	return(extractsession.get_session().extract(entry))
+
 def disassemble_entry(entry,returnbytes=False):
 	"""Attempt to locate the file in entry and disassemble."""
-	import mklib
-	import os
-	import time
-
-	# For the moment, assume we're working with a relative
-	#  directory (no leading /)
-	basedir = ''
-	# The directory where the archive was packed
-	arcdir = ''
-	# The directory where the ISO was mounted
-	mntdir = ''
-
-	try:
-		# Mount distribution
-		if entry.distname:
-			isoname = basedir + entry.distname + '.iso'
-			if os.path.isfile(isoname):
-				mntdir = mklib.mount_isofile(basedir + entry.distname + '.iso') 
-				basedir = mntdir
-
-		# Unpack archive
-		if entry.archive:
-			arcdir = mklib.unpack_archive(basedir + entry.archive)
-			basedir = arcdir
-
-		# Disassemble file
+	# If this was seen before, there's no need to find it again
+	import disasmcache
+	cache = disasmcache.get_cache()
+	name = (entry.file, entry.archive, entry.distname)
+	if cache:
+		instructions = cache.lookup(name, returnbytes)
+		if instructions is not None:
+			return(instructions)
+
+	# Disassemble file
+	path = extract_entry(entry)
+	if cache:
+		instructions = cache.disassemble(path,
+			returnbytes, name)
+	else:
 		import objdumputil
 		binaryFile = objdumputil.Objdump()
-		instructions = binaryFile.disassemble(basedir + entry.file,returnbytes)
-
-	finally:
-		if arcdir: 
-			os.system('rm -rf %s' % arcdir) 
-		if mntdir: 
-			os.system('umount -d %s' % mntdir) 
-			# Umount is non-blocking
-			time.sleep(1)
-			os.rmdir(mntdir)
+		instructions = binaryFile.disassemble(path,returnbytes)
 
 	return(instructions)
 
+def nearest_label(instructions, offset):
+	"""Return the label of the nearest labelled instruction at or
+	before offset in instructions, or ''"""
+	for j in range(offset, -1, -1):
+		if len(instructions[j]) == 4:
+			return(instructions[j][3])
+	return('')
+
+def disassemble_window(entry, offset, length):
+	"""Return (instructions, label): the disassembly of the length
+	instructions of entry from offset, and the label of the nearest
+	labelled instruction at or before offset ('' if there is none).
+	If the library has an address table (see library.py), only that
+	window is disassembled and the label is looked up; otherwise the
+	whole file is, unless it is in the disassembly cache."""
+	import disasmcache
+
+	table = None
+	if entry.idx is not None:
+		table = entry.idx.address_table()
+	label = None
+	if table is not None:
+		label = table.label(entry.start + offset, entry.start) or ''
+
+	# A cached disassembly is as good as a window
+	cache = disasmcache.get_cache()
+	instructions = None
+	if cache:
+		instructions = cache.lookup((entry.file, entry.archive,
+			entry.distname))
+
+	first = 0
+	if table is not None and instructions is None:
+		first = table.address(entry.start + offset)
+	if first:
+		# The token after the window may be the terminator
+		stop = table.address(entry.start + offset + length) or None
+		import objdumputil
+		binaryFile = objdumputil.Objdump()
+		window = []
+		for instruction in binaryFile.iter_disassemble(
+				extract_entry(entry), start=first, stop=stop):
+			window.append(instruction)
+			if len(window) == length:
+				break
+
+		# Object files can have several sections at the same
+		#  addresses, so make sure this is the right window
+		ok = (len(window) == length)
+		for i in range(len(window)):
+			if not ok:
+				break
+			try:
+				ok = (long(window[i][2], 16) ==
+					table.address(entry.start + offset + i))
+			except ValueError:
+				ok = False
+		if ok:
+			# objdump labels the start address, as sym+0x..., if
+			#  it isn't the start of a function
+			token = entry.start + offset
+			if len(window[0]) == 4 and \
+			   table.label(token, token) is None:
+				window[0] = window[0][:3]
+			return(window, label)
+
+	if instructions is None:
+		instructions = disassemble_entry(entry)
+	if label is None:
+		label = nearest_label(instructions, offset)
+	return(instructions[offset:offset + length], label)
+
 def text_aligned_disassembly(matches):
 	"""Given a list of matches, [matchA, matchB, ...] print the associated
 	disassembly side-by-side"""
@@ -85,18 +146,20 @@ def text_aligned_disassembly(matches):
 		print '|' + ''.center(width) + '|',
 	print
 
-	# Get the disassembly for all matches
+	# Get the disassembly of just the matches
 	disassembly = []
+	labels = []
 	for i in range(len(matches)):
-		disassembly.append( disassemble_entry(matches[i].entry) )
+		(window, label) = disassemble_window(matches[i].entry,
+			matches[i].offset, matches[0].len)
+		disassembly.append(window)
+		labels.append(label)
 	
 	# Print the most recent label before the match starts
 	for i in range(len(matches)):
 		label = ''
-		for j in range(-1,-(matches[i].offset + 1),-1):
-			if len(disassembly[i][j + matches[i].offset]) == 3:
-				label = '( %s )' % disassembly[i][j + matches[i].offset][2]
-				break
+		if labels[i]:
+			label = '( %s )' % labels[i]
 		print '|' + label.center(width) + '|',
 	print
 
@@ -106,7 +169,7 @@ def text_aligned_disassembly(matches):
 		# Figure out the alignment
 		aligned = []
 		for i in range(len(matches)):
-			aligned.append( disassembly[i][offset + matches[i].offset] )
+			aligned.append( disassembly[i][offset] )
 		
 		# Print the matches
 		for instruction in aligned:
@@ -138,17 +201,38 @@ def safeLabel(s):
 	
 	return('l%s' % hash.hexdigest())
 
-class idxFile:
+class idxFile(object):
 	"""A storage class for an .idx file generated by mklib.py
 	that features an automatic cache of the entries.  
 	idxFile[ idxOffset ] will retrieve the entry in the .idx file
-	assocaited with that offset"""
+	assocaited with that offset.  The start offsets of every entry
+	are read once into a sorted array and searched with bisect; the
+	same idxEntry is handed back for every offset within it."""
 	name = '' # The filename associated with this structure
-	entry = [] # The cached entries for this file
+	library = None # A library.Library, if this is a binary .idx
+	starts = None # The sorted start of every entry in the file
+	lines = None # The text .idx line of each of starts
+	end = 0L # The token after the last entry, the .dat length
+	cache = {} # The cached entries, keyed by their index in starts
+	addresses = None # A library.AddressTable, False if there is none
 
 	def __init__(self,idxfilename):
 		self.name = idxfilename
-		self.entry = []
+		self.library = None
+		self.starts = None
+		self.lines = None
+		self.end = 0L
+		self.cache = {}
+		self.addresses = None
+
+	def cached_entries(self):
+		"""The cached entries, by descending start"""
+		keys = self.cache.keys()
+		keys.sort(reverse=True)
+		return([ self.cache[i] for i in keys ])
+
+	# The cached entries, by descending start
+	entry = property(cached_entries)
 
 	def __hash__(self):
 		return(hash(self.name))
@@ -162,102 +246,161 @@ class idxFile:
 		return(not a==b)
 	
 	def __getitem__(self, offset):
-		"""Search the current cache for the entry that would
-		contain this offset *or* load from file if not found"""
-
-		# Search to find cache entry
-		# TODO: More efficient search
-		for entry in self.entry:
-			if entry.start <= offset and \
-			   entry.start + entry.len > offset:
-				return(entry)
-			
-		# Entry was not found, load from cache
-		return(self.file_get_entry(offset))
-		
+		"""Return the cached entry that contains this offset,
+		loading the index first if needed"""
+		import bisect
+
+		if self.starts is None:
+			self.load()
+
+		# The last entry starting at or before offset, then the
+		#  first of any entries sharing that start
+		i = bisect.bisect_right(self.starts, long(offset)) - 1
+		if i < 0:
+			i = 0
+		i = bisect.bisect_left(self.starts, self.starts[i])
+
+		try:
+			return(self.cache[i])
+		except KeyError:
+			return(self.make_entry(i))
+
 	def file_get_entry(self, offset):
 		"""Load an entry from file, adding to the entry cache
 		if found."""
-		# Open the index
+		return(self[offset])
+
+	def open_index(self):
+		"""Open the index, falling back on a file of the same name
+		in the local directory"""
 		try:
-			idxfile = open(self.name)
-		# If this didn't work, try getting opening the same file
-		#  in the local directory
+			return(open(self.name, 'rb'))
 		except IOError:
 			dirs = self.name.split('/')
 			if len(dirs) > 1:
 				self.name = dirs[-1]
-				return( self.file_get_entry(offset) )
+				return( self.open_index() )
 			else:
-				raise "Can't open %s" % self.name
-
-		# Make sure offset is a long number
-		offset = long(offset)
-		
-		# Search through each line
-		oldlineidx = lineidx = 0
-		oldline = line = idxfile.readline()
-		while line:
-			# Break the field into parts
-			field = line.split(',')
-
-			# Determine the offset of the next file
-			lineidx = long(field[0])
-
-			# If the starting offset of the next file is
-			#  beyond the offset we're looking at, oldfield
-			#  has the correct entry
-			if offset < lineidx:
-				break
-			
-			# This may have the entry, we won't know until
-			#  after we look at the next line
-			oldline = line
-			oldlineidx = lineidx
-
-			# Look at the next line
-			line = idxfile.readline()
-
-		# All done with this file
-		idxfile.close()
-		
-		# Did we reach the end of the file?
-		if oldlineidx == lineidx:
-			# We need to get the length of the .dat file
+				raise IOError("Can't open %s" % self.name)
+
+	def load(self):
+		"""Read the start offsets of every entry in the index"""
+		import array
+		import library
+
+		idxfile = self.open_index()
+		binary = (idxfile.read(4) == library.idxMagic)
+		idxfile.seek(0)
+
+		# Binary indexes are already sorted, and their entries are
+		#  read from the mmapped file when needed
+		if binary:
+			idxfile.close()
+			self.library = library.Library(self.name[:-4])
+			lib = self.library
+			self.starts = array.array('L', [ lib.starts[i]
+				for i in xrange(len(lib)) ])
+			self.end = lib.tokens
+		else:
+			# Binaries stored only once by mklib --dedup have
+			#  several lines with the same start, which need not
+			#  be in order
+			rows = []
+			for line in idxfile:
+				rows.append( (long(line.split(',',1)[0]), line) )
+			idxfile.close()
+			rows.sort(key=lambda row: row[0])
+			self.starts = array.array('L', [ row[0] for row in rows ])
+			self.lines = [ row[1] for row in rows ]
+
+			# The last entry ends with the .dat file
 			import os
 			datfile = self.name[:-3] + 'dat'
 			stat = os.stat(datfile)
-			lineidx = stat.st_size / 4;
-			#raise 'Unable to determine IDX entry length, truncated .idx file?'
+			self.end = (stat.st_size -
+				library.dat_header_size(datfile)) / 4
+
+		if not self.starts:
+			raise IOError('%s has no entries' % self.name)
+
+	def address_table(self):
+		"""Return the library.AddressTable of this library, or None
+		if mklib didn't write one"""
+		import library
 
-		# Create a real entry
+		if self.addresses is None:
+			if self.starts is None:
+				self.load()
+			try:
+				self.addresses = library.AddressTable(self.name[:-4])
+			except (IOError, ValueError):
+				self.addresses = False
+		return(self.addresses or None)
+
+	def read_entry(self, i):
+		"""Return a new idxEntry for entry i of starts"""
 		newEntry = idxEntry()
-		newEntry.fromIDX(oldline)
-		newEntry.len = lineidx - oldlineidx
+		if self.library is not None:
+			(newEntry.start, newEntry.len, newEntry.file,
+			 newEntry.archive, newEntry.distname) = self.library.entry(i)
+		else:
+			newEntry.fromIDX(self.lines[i])
 		newEntry.idx = self
-		
-		# Figure out where this should go in the cache
-		for i in range(len(self.entry)):
-			# If the starting index is now greater
-			#  than this index...
-			if self.entry[i].start < newEntry.start:
-				# ...insert before this index
-				self.entry.insert(i,newEntry)
-				return(newEntry)
-
-		# Wasn't inserted yet, place at end
-		self.entry.append(newEntry)
 		return(newEntry)
-		
-		
-class idxEntry:
-	"""A storage class for holding IDX file entries"""
-	idx = None
-	start = 0L
-	len = 0L
-	file = ''
-	archive = ''
-	distname = ''
+
+	def make_entry(self, i):
+		"""Create the entry for i, the first index in starts of its
+		start, with every other file sharing its content as
+		aliases, and add it to the cache"""
+		import bisect
+
+		start = self.starts[i]
+		j = bisect.bisect_right(self.starts, start)
+		if j < len(self.starts):
+			end = self.starts[j]
+		else:
+			end = self.end
+
+		newEntry = self.read_entry(i)
+		newEntry.len = end - start
+		for k in range(i + 1, j):
+			alias = self.read_entry(k)
+			alias.len = newEntry.len
+			newEntry.aliases.append(alias)
+
+		self.cache[i] = newEntry
+		return(newEntry)
+
+def idx_entries(idxfilename):
+	"""Yield an idxEntry for every entry of a text or binary .idx
+	file, in file order.  Entries from a text .idx have no len."""
+	import library
+
+	if library.is_binary_index(idxfilename):
+		lib = library.Library(idxfilename[:-4])
+		try:
+			for i in range(len(lib)):
+				x = idxEntry()
+				(x.start, x.len, x.file, x.archive,
+				 x.distname) = lib.entry(i)
+				yield x
+		finally:
+			lib.close()
+		return
+
+	idxfile = open(idxfilename)
+	for line in idxfile:
+		x = idxEntry()
+		x.fromIDX(line)
+		yield x
+	idxfile.close()
+
+class idxEntry(object):
+	"""A storage class for holding IDX file entries.  aliases holds
+	the entries of any other files with the same content, stored
+	only once by mklib --dedup."""
+	__slots__ = ('idx', 'start', 'len', 'file', 'archive', 'distname',
+		'aliases')
 
 	def __init__(self):
 		self.idx = None
@@ -266,6 +409,7 @@ class idxEntry:
 		self.file = ''
 		self.archive = ''
 		self.distname = ''
+		self.aliases = []
 
 	def __hash__(self):
 		if self.idx:
@@ -329,6 +473,10 @@ class idxEntry:
 		"""Given a dictionary of matches, return another 
 		dictionary that only contains matches associated
 		with this entry."""
+		# A MatchGraph has these indexed already
+		if isinstance(matches, MatchGraph):
+			return(matches.filter(self))
+
 		retmatches = {}
 		for key in matches.keys():
 			if matches[key].entry == self:
@@ -336,22 +484,30 @@ class idxEntry:
 			
 		return(retmatches)
 	
-class bincompareMatch:
-	"""A storage class for holding bincompare matches"""
-	entry = None 
-	offset = 0L
-	len = 0
-	score = 0
-	targets = []
-	a = False
+class bincompareMatch(object):
+	"""A storage class for holding bincompare matches.  Matches in a
+	MatchGraph are views of a row of its table, made on demand: their
+	targets come from the graph, and graph and index are set."""
+	__slots__ = ('entry', 'offset', 'len', 'score', 'a', 'graph', 'index',
+		'_targets')
 
 	def __init__(self, dEntry, dOffset, dLen, dScore):
 		self.entry = dEntry
 		self.offset = dOffset
 		self.len = dLen
 		self.score = dScore
-		self.targets = []
 		self.a = False
+		self.graph = None
+		self.index = None
+		self._targets = []
+
+	def get_targets(self):
+		if self.graph is not None:
+			return(self.graph.targets(self.index))
+		return(self._targets)
+	def set_targets(self, targets):
+		self._targets = targets
+	targets = property(get_targets, set_targets)
 		
 	def __hash__(self):
 		if self.entry:
@@ -379,181 +535,299 @@ class bincompareMatch:
 			ret += "'entry':%s" % self.entry
 		ret += ' }'
 		return(ret)
-	
+
+	def link(self, target):
+		"""Add target to self.targets, if it's not there"""
+		if self.graph is not None and self.graph is target.graph:
+			self.graph.link(self.index, target.index, False)
+		else:
+			for t in self._targets:
+				if t is target:
+					return
+			self._targets.append(target)
+
 	def merge(self, other):
-		"""Remove empty targets from other and add them
-		to self, allowing other to be removed.  If other
-		!= self"""
+		"""Add the targets of other to self, allowing other to be
+		removed.  If other != self"""
 		if(self == other):
-			# Go through all targets
-			for j in range(len(other.targets)):
-				target = other.targets.pop()
-
-				# Remove all instances of `other' in the
-				#  back-links, target.targets
-				for i in range(target.targets.count(other)):
-					target.targets.remove(other)
-
-				# Add self in the back-links, target.targets
-				#  but only if it's not there
-				if target.targets.count(self) == 0:
-					target.targets.append(self)
-				# Add target in self.targets only if
-				#  it's not there
-				if self.targets.count(target) == 0:
-					self.targets.append(target)
-
+			for target in other.targets:
+				self.link(target)
+				target.link(self)
 		else:
 			raise 'self != other'
+
+class MatchGraph:
+	"""The matches of a bincompare output and the links between
+	them, kept as a table of typed arrays: one row per match, interned
+	by its (entry, offset, len, score) key, and an array of links.
+	Entries are shared by their idxFile, so they are numbered by
+	identity.  bincompareMatch views of rows are made on demand.
+
+	A MatchGraph can be used as the dictionary of matches
+	bincompare_matches() used to return, keyed by row number."""
+
+	def __init__(self):
+		import array
+
+		self.entries = [] # idxEntry'es, by entry number
+		self.entryNumbers = {} # Entry numbers, by id(entry)
+
+		# The match table
+		self.entry = array.array('l')
+		self.offset = array.array('l')
+		self.len = array.array('L')
+		self.score = array.array('l')
+		self.side = array.array('b') # 1 if seen as fileA
+		self.rows = {} # Row numbers, by packed key
+
+		# The links, as pairs of rows.  Repeated links are dropped
+		#  by adjacency()
+		self.linkA = array.array('L')
+		self.linkB = array.array('L')
+
+		# Built from the above when needed, see adjacency()
+		self.adjacent = None
+		self.byEntry = None
+
+	def entry_number(self, entry):
+		try:
+			return(self.entryNumbers[id(entry)])
+		except KeyError:
+			number = len(self.entries)
+			self.entries.append(entry)
+			self.entryNumbers[id(entry)] = number
+			return(number)
+
+	def key(self, entry, offset, dlen, score):
+		"""Pack a match key into a single number, 32 bits each for
+		offset and score, which are signed, and dlen"""
+		if not (-0x80000000L <= offset <= 0x7fffffffL and
+			0 <= dlen <= 0xffffffffL and
+			-0x80000000L <= score <= 0x7fffffffL):
+			raise ValueError('Match at %d, len %d, score %d is out of range' % (
+				offset, dlen, score))
+		return( (self.entry_number(entry) << 96) |
+			((long(offset) & 0xffffffffL) << 64) |
+			(long(dlen) << 32) | (score & 0xffffffffL) )
+
+	def intern(self, entry, offset, dlen, score, a=False):
+		"""Return the row of this match, adding it if it has not
+		been seen before.  a marks a new row as seen as fileA."""
+		key = self.key(entry, offset, dlen, score)
+		try:
+			return(self.rows[key])
+		except KeyError:
+			row = len(self.offset)
+			self.rows[key] = row
+			self.entry.append(self.entryNumbers[id(entry)])
+			self.offset.append(offset)
+			self.len.append(dlen)
+			self.score.append(score)
+			self.side.append(int(a))
+			self.byEntry = None
+			return(row)
+
+	def link(self, a, b, both=True):
+		"""Link rows a and b, both ways unless both is False"""
+		self.linkA.append(a)
+		self.linkB.append(b)
+		if both and a != b:
+			self.linkA.append(b)
+			self.linkB.append(a)
+		self.adjacent = None
+
+	def adjacency(self):
+		"""Return, for every row, the rows it links to in the order
+		they were first linked, as (starts, targets) arrays: the
+		targets of row are targets[starts[row]:starts[row + 1]]"""
+		import array
+
+		if self.adjacent is None:
+			# Group the links by their first row
+			rows = len(self.offset)
+			counts = array.array('L', [0]) * (rows + 1)
+			for x in self.linkA:
+				counts[x + 1] += 1
+			for i in xrange(rows):
+				counts[i + 1] += counts[i]
+			fill = array.array('L', counts)
+			grouped = array.array('L', [0]) * len(self.linkA)
+			for i in xrange(len(self.linkA)):
+				x = self.linkA[i]
+				grouped[fill[x]] = self.linkB[i]
+				fill[x] += 1
+
+			# Drop repeated links
+			starts = array.array('L', [0]) * (rows + 1)
+			targets = array.array('L')
+			for row in xrange(rows):
+				seen = set()
+				for i in xrange(counts[row], counts[row + 1]):
+					if grouped[i] not in seen:
+						seen.add(grouped[i])
+						targets.append(grouped[i])
+				starts[row + 1] = len(targets)
+			self.adjacent = (starts, targets)
+		return(self.adjacent)
+
+	def target_rows(self, row):
+		(starts, targets) = self.adjacency()
+		return(targets[starts[row]:starts[row + 1]])
+
+	def targets(self, row):
+		return([ self[target] for target in self.target_rows(row) ])
+
+	def view(self, row):
+		"""Return a bincompareMatch view of row"""
+		match = bincompareMatch(self.entries[self.entry[row]],
+			self.offset[row], self.len[row], self.score[row])
+		match.a = bool(self.side[row])
+		match.graph = self
+		match.index = row
+		return(match)
+
+	def filter(self, entry):
+		"""Return a dictionary of the matches of entry, by row"""
+		if self.byEntry is None:
+			self.byEntry = {}
+			for row in xrange(len(self.entry)):
+				try:
+					self.byEntry[self.entry[row]].append(row)
+				except KeyError:
+					self.byEntry[self.entry[row]] = [ row ]
+
+		retmatches = {}
+		number = self.entryNumbers.get(id(entry))
+		for row in self.byEntry.get(number, []):
+			retmatches[row] = self.view(row)
+		return(retmatches)
+
+	# The dictionary interface
+	def __len__(self):
+		return(len(self.offset))
+	def __iter__(self):
+		return(iter(xrange(len(self.offset))))
+	def __getitem__(self, row):
+		if row < 0 or row >= len(self.offset):
+			raise KeyError(row)
+		return(self.view(row))
+	def __contains__(self, row):
+		return(0 <= row < len(self.offset))
+	def has_key(self, row):
+		return(row in self)
+	def keys(self):
+		return(range(len(self.offset)))
+	def values(self):
+		return([ self.view(row) for row in xrange(len(self.offset)) ])
+	def items(self):
+		return([ (row, self.view(row)) for row in xrange(len(self.offset)) ])
 	
+def match_id(match):
+	"""A number identifying match, the same for every view of a
+	MatchGraph row"""
+	if match.index is not None:
+		return(match.index)
+	return(-id(match))
+
 def bincompare_matches(bincompare):
 	"""Given a filestream `bincompare' that has the output of 
 	bincompare, return a tuple of 
-	[dictionary of bincompareMatch'es indexed by the hash value of the entry	, idxfiles]"""
-	
-	# We've not seen the match files yet
-	fileA = ''
-	fileB = ''
+	[MatchGraph of bincompareMatch'es, idxfiles]"""
+	import bincompareoutput
 
 	# We've no matches for this yet
-	matches = {}
+	matches = MatchGraph()
 
 	# We've no IDX files seen
 	idxfiles = {}
 
-	# We're going to start for looking for the first file
-	lookingFor = 'fileA'
-
-	# Start looking at the input line by line
-	line = bincompare.readline()
-	while line:
-		# If we see a line that starts with `File ', we need to
-		#  look for a new file A and B
-		if line[0:5] == 'File ' and \
-		   lookingFor not in ['fileA', 'fileB']:
-			lookingFor = 'fileA'
-
-		if lookingFor in ['fileA','fileB'] :
-			# The file name is everything after this file until
-			#  an offset is seen
-			try:
-				(filename, unused) = line[5:].split(', offset ',2)
-				(offset, unused) = unused.split(', len',2)
-				offset = long(offset)
-				
+	for (kind, record) in bincompareoutput.parse(bincompare):
+		if kind == bincompareoutput.MATCHES:
+			for (a, b, score, dlen) in record:
+				# We need the IDX entries involved
+				entryA = fileA[ a + offsetA ]
+				entryB = fileB[ b + offsetB ]
+
+				# Figure out the in-file offsets
+				offA = a + offsetA - entryA.start
+				offB = b + offsetB - entryB.start
+
+				# Find or create the matches for these
+				matchA = matches.intern(entryA, offA, dlen,
+					score, True)
+				matchB = matches.intern(entryB, offB, dlen, score)
+				matches.link(matchA, matchB)
+
+		elif kind == bincompareoutput.COMPARISON:
+			files = []
+			for filename in [record.fileA, record.fileB]:
 				idxfilename = filename[:-4] + '.idx'
 				# See if we've got this cached
-				if idxfiles.has_key(idxfilename):
-					dfile = idxfiles[idxfilename]
-				else:
-					dfile = idxFile(idxfilename)
-					idxfiles[idxfilename] = dfile
-					
-				# Now look for fileB
-				if lookingFor == 'fileA':
-					fileA = dfile
-					offsetA = offset
-					lookingFor = 'fileB'
-				else:
-					fileB = dfile
-					offsetB = offset
-					lookingFor = 'time'
-					
-			except ValueError:
-				lookingFor = 'fileA'
-
-		elif lookingFor == 'time':
-			# If we see `matches above', this is a filtered
-			#  output. 
-			if 'Matches above' in line:
-				continue
-			# If the time is missing here, this is most
-			#  likely the output from bincompare-dirout.
-			#  This means that numbers are relative to the
-			#  file's offsets and not absolute within the
-			#  file.
-			elif not 'Comparison took ' in line:
-				lookingFor = 'match'
-				continue
-			#Otherwise, zero the offsets (the matches are absolute)
-			# expect matches
-			else:
+				if not idxfiles.has_key(idxfilename):
+					idxfiles[idxfilename] = idxFile(idxfilename)
+				files.append(idxfiles[idxfilename])
+			(fileA, fileB) = files
+
+			# If the time followed the headers, the matches are
+			#  absolute.  Otherwise (as in the output of
+			#  bincompare-dirout) they are relative to the
+			#  offsets
+			if record.timed:
 				offsetA = 0
 				offsetB = 0
-				lookingFor = 'match'
+			else:
+				offsetA = record.offsetA
+				offsetB = record.offsetB
 
-		elif lookingFor == 'match':
-			fields = line.split(',')
-			fields[-1] = fields[-1].rstrip()
+	return(matches,idxfiles)
 
-			# If we have four fields, this is some sort of
-			#  match
-			if len(fields) >= 4:
-				# We need the IDX entries involved
-				entryA = fileA[ long(fields[0]) + offsetA ]
-				entryB = fileB[ long(fields[1]) + offsetB ]
-				
-				# Figure out the in-file offsets
-				offA = long(fields[0]) + offsetA - entryA.start
-				offB = long(fields[1]) + offsetB - entryB.start
-		
-				# Create new matches for these
-				matchA = bincompareMatch(entryA, \
-						offA, \
-						long(fields[3]), \
-						long(fields[2]) )
-				matchA.a = True
-				matchB = bincompareMatch(entryB, \
-						offB, \
-						long(fields[3]), \
-						long(fields[2]) )
-			
-				# Do not consider trivial matches
-				if True: # matchA != matchB:
-					hashA = safeLabel(matchA)
-					hashB = safeLabel(matchB)
-					matchA.targets.append(matchB)
-					matchB.targets.append(matchA)
-
-					if matches.has_key(hashA):
-						if matches[hashA] == \
-						   matchA:
-							matches[hashA].merge(matchA)
-							matchA = None
-						else:
-
-							raise 'Hash collision, %s / %s' % (matchA, matches[hashA])
-					else:
-						matches[hashA] = matchA
-						
-					if matches.has_key(hashB):
-						if matches[hashB] == \
-						   matchB:
-							matches[hashB].merge(matchB)
-							matchB = None
-						else:
-							raise 'Hash collision, %s / %s' % (matchB, matches[hashB])
-					else:
-						matches[hashB] = matchB
-				else:
-					matchA = None
-					matchB = None
-
-		# filterbin compare can throw in some extras
-		elif 'Filtered, sorted results' in line:
-			pass
-		# Ignore blank lines
-		elif line.strip() == '':
-			pass
-		# We've no idea of what this was
-		else:
-			lookingFor = 'fileA'
+def graph_groups(matches, idxfiles):
+	"""Return (groups, motifs): groups is a list of (entry, [match,
+	...]) for every entry of idxfiles with matches, in the order of
+	idxfiles and their entries, and motifs the motif of every match
+	linked to one (see add_motifs()), by match_id().  The matches are
+	grouped in one pass."""
+	groups = {}
+	motifs = {}
+	for match in matches.values():
+		if match.entry.file[0:6] == 'motif_':
+			# Motifs are linked both ways
+			for target in match.targets:
+				motifs[match_id(target)] = match
 			continue
+		try:
+			groups[id(match.entry)].append(match)
+		except KeyError:
+			groups[id(match.entry)] = [ match ]
 
-		# Get the next line
-		line = bincompare.readline()
-
-	return(matches,idxfiles)
+	ret = []
+	for idxfile in idxfiles.values():
+		for entry in idxfile.cached_entries():
+			if groups.has_key(id(entry)):
+				ret.append( (entry, groups[id(entry)]) )
+	return(ret, motifs)
+
+def graph_edges(groups, motifs):
+	"""Yield (match, target, motif) for every link between the
+	matches of groups, each undirected link once, see graph_groups().
+	Matches linked to a motif are instead linked to the motif only,
+	and yielded as (match, motif, True)."""
+	listed = set([ id(entry) for (entry, fmatches) in groups ])
+
+	for (entry, fmatches) in groups:
+		for f in fmatches:
+			fid = match_id(f)
+			if motifs.has_key(fid):
+				yield (f, motifs[fid], True)
+				continue
+			# Links are both ways, so the link is left to the
+			#  target if it will be drawing it
+			for target in f.targets:
+				tid = match_id(target)
+				if tid < fid and id(target.entry) in listed and \
+				   not motifs.has_key(tid):
+					continue
+				yield (f, target, False)
 
 def graph(matches,idxfiles,output):
 	"""Using a match dictionary, indexed by the hash of the matches
@@ -561,181 +835,447 @@ def graph(matches,idxfiles,output):
 	involved create a graphviz description for this graph and write it 
 	to the FileStream output.
 	"""
-	
+	# safeLabel() is an md5 of the name, so remember them
+	labels = {}
+	def label(name):
+		try:
+			return(labels[name])
+		except KeyError:
+			labels[name] = safeLabel(name)
+			return(labels[name])
+
 	# This is an undirected graph
 	output.write('graph G {\n')
 
-	# Loop through all of the idx files considered
-	for idxfile in idxfiles.values():
-		# ...and each entry in those files
-		for entry in idxfile.entry:
-			# Get only the matches for this entry	
-			fmatches = entry.filter(matches)
-
-			# Add every entry into a dictionary of offsets
-			offsetList = {}
-			for f in fmatches.values():
-				if offsetList.has_key(f.offset):
-					offsetList[f.offset].append(f)
-				else:
-					offsetList[f.offset] = [ f ]
-
-			# Get an ordered list of the offsets
-			if len(offsetList) == 0: 
-				continue
-			
-			offsetsOrdered = offsetList.keys()
-			offsetsOrdered.sort()
-			
-			# Make a subgraph cluster for this file
-			file = entry.file
-			output.write('subgraph cluster_%s {\n' % safeLabel(file))
-			output.write('style=filled;\n')
-			output.write('color=lightgrey;\n')
-			output.write('label = "%s";\n' % (file) )
-			
-			# Link the offsets together (in order)
-			output.write( safeLabel(file + str(offsetsOrdered[0])) )
-			for thisOffset in offsetsOrdered[1:]:
-				output.write(' -- %s' % safeLabel(file + str(thisOffset)) )
-			output.write(';\n')
-			output.write('}\n')
-
-			# Create nodes for each of the matches
-			for thisOffset in offsetsOrdered:
-				output.write('\"%s\" [ \n' % safeLabel(file + str(thisOffset)) )
-				output.write('label="%u | ' % (thisOffset))
-				lens = []
-				for match in offsetList[thisOffset]:
-					if match.len  not in lens:
-						lens.append(match.len)
-				lens.sort()
-				output.write('%u' % lens[0])
-				for dlen in lens[1:]:
-					output.write(',%u' % dlen)
-				output.write('"\n')
-				output.write('shape="record"\n')
-				output.write('];\n');
-			output.write('\n\n')
-
-			# Add match interdependencies
-			for f in fmatches.values():
-				motif = None
-				for target in f.targets:
-					if target.entry.file[0:6] == 'motif_':
-						motif = target
-				if not motif:
-					for target in f.targets:
-						output.write('%s -- %s;\n' % (
-							safeLabel(file + str(f.offset) ),
-							safeLabel(target.entry.file +
-								  str(target.offset) )
-							))
-					
-
-						# Remove the back-link to prevent
-						#  redrawing the same line
-						if target.targets.count(f) > 0:
-							target.targets.remove(f)
-						else:
-							pass
-				else:
-					output.write('%s -- %s;\n' % ( \
-						safeLabel(file + str(f.offset)),\
-						safeLabel(motif.entry.file + \
-							file + str(f.offset)) \
-						))
-					output.write('"%s" [ \n' % \
-						safeLabel(motif.entry.file + \
-							file + str(f.offset)) \
-						)
-					output.write('shape=ellipse\n')
-					output.write('label="%s"\n' %
-						motif.entry.file[6:] )
-					output.write('];\n')
-
-			output.write('\n\n')
+	(groups, motifs) = graph_groups(matches, idxfiles)
+	for (entry, fmatches) in groups:
+		# Add every entry into a dictionary of offsets
+		offsetList = {}
+		for f in fmatches:
+			try:
+				offsetList[f.offset].append(f)
+			except KeyError:
+				offsetList[f.offset] = [ f ]
+
+		# Get an ordered list of the offsets
+		offsetsOrdered = offsetList.keys()
+		offsetsOrdered.sort()
+		
+		# Make a subgraph cluster for this file
+		file = entry.file
+		output.write('subgraph cluster_%s {\n' % label(file))
+		output.write('style=filled;\n')
+		output.write('color=lightgrey;\n')
+		output.write('label = "%s";\n' % (file) )
+		
+		# Link the offsets together (in order)
+		output.write(' -- '.join([ label(file + str(thisOffset))
+			for thisOffset in offsetsOrdered ]))
+		output.write(';\n')
+		output.write('}\n')
+
+		# Create nodes for each of the matches
+		for thisOffset in offsetsOrdered:
+			lens = list(set([ match.len
+				for match in offsetList[thisOffset] ]))
+			lens.sort()
+			output.write('\"%s\" [ \n' % label(file + str(thisOffset)) )
+			output.write('label="%u | %s"\n' % (thisOffset,
+				','.join([ '%u' % dlen for dlen in lens ])))
+			output.write('shape="record"\n')
+			output.write('];\n');
+		output.write('\n\n')
+
+	# Add match interdependencies
+	for (f, target, motif) in graph_edges(groups, motifs):
+		file = f.entry.file
+		if not motif:
+			output.write('%s -- %s;\n' % (
+				label(file + str(f.offset)),
+				label(target.entry.file + str(target.offset))
+				))
+		else:
+			# Each match gets its own motif node
+			name = target.entry.file + file + str(f.offset)
+			output.write('%s -- %s;\n' % (
+				label(file + str(f.offset)), label(name)))
+			output.write('"%s" [ \n' % label(name))
+			output.write('shape=ellipse\n')
+			output.write('label="%s"\n' % target.entry.file[6:] )
+			output.write('];\n')
+
 	# All done
 	output.write('}\n')	
 
-def motif_name(number):
-	"""Convert a number into A, B, ..., AA, ..., AAA, ... etc"""
-	modulus = number % 26
-	div = number / 26
-	if div >= 26:
-		raise 'Too many motifs!'
+def graph_edgelist(matches,idxfiles,output):
+	"""Write the links of graph() as a tab separated edge list, one
+	`FILEA OFFSETA FILEB OFFSETB' line per link, for tools that
+	handle larger graphs than graphviz.  A match linked to a motif
+	has a single link to `motif_NAME 0'."""
+	(groups, motifs) = graph_groups(matches, idxfiles)
+	for (f, target, motif) in graph_edges(groups, motifs):
+		offset = target.offset
+		if motif:
+			offset = 0
+		output.write('%s\t%u\t%s\t%u\n' % (f.entry.file, f.offset,
+			target.entry.file, offset))
+
+def graph_graphml(matches,idxfiles,output):
+	"""Write the graph() of the matches to output as GraphML.  There
+	is a node for every offset with matches, with its file, offset and
+	match lengths, and one motif node for every motif."""
+	from xml.sax.saxutils import escape
+
+	output.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+	output.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+	output.write('<key id="file" for="node" attr.name="file" attr.type="string"/>\n')
+	output.write('<key id="offset" for="node" attr.name="offset" attr.type="long"/>\n')
+	output.write('<key id="lens" for="node" attr.name="lens" attr.type="string"/>\n')
+	output.write('<graph id="G" edgedefault="undirected">\n')
+
+	# Nodes are numbered in the order they are written
+	nodes = {}
+	(groups, motifs) = graph_groups(matches, idxfiles)
+	for (entry, fmatches) in groups:
+		offsetList = {}
+		for f in fmatches:
+			try:
+				offsetList[f.offset].add(f.len)
+			except KeyError:
+				offsetList[f.offset] = set([ f.len ])
+		offsetsOrdered = offsetList.keys()
+		offsetsOrdered.sort()
+		for thisOffset in offsetsOrdered:
+			nodes[(id(entry), thisOffset)] = len(nodes)
+			lens = list(offsetList[thisOffset])
+			lens.sort()
+			output.write('<node id="n%d"><data key="file">%s</data><data key="offset">%u</data><data key="lens">%s</data></node>\n' % (
+				nodes[(id(entry), thisOffset)], escape(entry.file),
+				thisOffset, ','.join([ '%u' % dlen for dlen in lens ])))
+
+	def node(match, motif):
+		if motif:
+			key = (match.entry.file, 0)
+		else:
+			key = (id(match.entry), match.offset)
+		if not nodes.has_key(key):
+			nodes[key] = len(nodes)
+			output.write('<node id="n%d"><data key="file">%s</data><data key="offset">%u</data></node>\n' % (
+				nodes[key], escape(match.entry.file), key[1]))
+		return(nodes[key])
+
+	for (f, target, motif) in graph_edges(groups, motifs):
+		output.write('<edge source="n%d" target="n%d"/>\n' % (
+			node(f, False), node(target, motif)))
+
+	output.write('</graph>\n')
+	output.write('</graphml>\n')
 
+def motif_name(number):
+	"""Convert a number into A, B, ..., Z, AA, AB, ..., ZZ, AAA, ...
+	etc, without limit"""
 	str = ''
-	for i in range(div + 1):
-		str += chr( ord('A') + modulus )
-		
+	number += 1
+	while number > 0:
+		number -= 1
+		str = chr( ord('A') + number % 26 ) + str
+		number /= 26
 	return(str)
+
+def is_motif(match):
+	return(match.entry.file[0:6] == 'motif_')
+
+def match_components(matches):
+	"""Return the connected components of the links between the
+	matches, leaving out any motifs, as lists of keys of matches in
+	the order of matches.keys().  The components are found by
+	union-find, in near-linear time."""
+	import array
+	import itertools
+
+	keys = matches.keys()
+	if isinstance(matches, MatchGraph):
+		# Work on the rows and links directly, keys are rows
+		motifEntries = set([ e for e in range(len(matches.entries))
+			if matches.entries[e].file[0:6] == 'motif_' ])
+		motif = [ matches.entry[row] in motifEntries for row in keys ]
+		links = itertools.izip(matches.linkA, matches.linkB)
+	else:
+		motif = [ is_motif(matches[key]) for key in keys ]
+		numbers = {}
+		for i in xrange(len(keys)):
+			numbers[match_id(matches[keys[i]])] = i
+		links = ( (i, numbers[match_id(target)])
+			for i in xrange(len(keys))
+			for target in matches[keys[i]].targets
+			if numbers.has_key(match_id(target)) )
+
+	parent = array.array('L', xrange(len(keys)))
+	def find(x):
+		while parent[x] != x:
+			# Path halving
+			parent[x] = parent[parent[x]]
+			x = parent[x]
+		return(x)
+
+	for (a, b) in links:
+		if motif[a] or motif[b]:
+			continue
+		a = find(a)
+		b = find(b)
+		if a != b:
+			parent[max(a, b)] = min(a, b)
+
+	components = {}
+	order = []
+	for i in xrange(len(keys)):
+		if motif[i]:
+			continue
+		root = find(i)
+		try:
+			components[root].append(keys[i])
+		except KeyError:
+			components[root] = [ keys[i] ]
+			order.append(root)
+	return([ components[root] for root in order ])
 	
 def add_motifs(matches,threshold):
-	"""Given a match dictionary, generate motif targets for any
-	links that have a target order higher than threshold."""
+	"""Given a match dictionary, generate a motif for every connected
+	group of linked matches with more than threshold + 1 members,
+	that is, with more places than each could be linked to
+	otherwise, and link it to every member.  Groups that already have
+	a motif are left alone."""
 	
 	num = 0
 	for match in matches.values():
-		if len( match.targets ) > threshold:
-			motif = None
-			for target in match.targets:
-				if target.entry.file[0:6] == 'motif_':
-					motif = target
-			if not motif:
-				newMotif = idxEntry()	
-				newMotif.file = 'motif_%s' % motif_name(num)
-				newMatch = bincompareMatch(0,0,0,0)
-				newMatch.entry = newMotif
-			
-				for target in match.targets:
-					if newMatch not in target.targets:
-						target.targets.append(newMatch)
-					if target not in newMatch.targets:
-						newMatch.targets.append(target)
-				if newMatch not in match.targets:
-					match.targets.append(newMatch)
-				if match not in newMatch.targets:
-					newMatch.targets.append(match)
-				num += 1	
+		if is_motif(match):
+			num += 1
+
+	# Find the groups first, as linking the motifs changes the links
+	groups = []
+	for component in match_components(matches):
+		if len(component) <= threshold + 1:
+			continue
+		hasMotif = False
+		for key in component:
+			for target in matches[key].targets:
+				if is_motif(target):
+					hasMotif = True
+					break
+			if hasMotif:
+				break
+		if not hasMotif:
+			groups.append(component)
+
+	for component in groups:
+		newMotif = idxEntry()	
+		newMotif.file = 'motif_%s' % motif_name(num)
+		if isinstance(matches, MatchGraph):
+			row = matches.intern(newMotif, 0, 0, 0)
+			for key in component:
+				matches.link(row, key)
+		else:
+			newMatch = bincompareMatch(0,0,0,0)
+			newMatch.entry = newMotif
+			for key in component:
+				matches[key].link(newMatch)
+				newMatch.link(matches[key])
+		num += 1	
+
+def covered_length(intervals, length):
+	"""Return the number of instructions in [0, length) covered by
+	intervals, a list of (start, end) pairs, by sorting and merging
+	them.  NumPy is used for long lists if it is available."""
+	if not intervals:
+		return(0)
+
+	if len(intervals) > 256:
+		try:
+			import numpy
+		except ImportError:
+			numpy = None
+		if numpy is not None:
+			bounds = numpy.clip(numpy.array(intervals, dtype=numpy.int64),
+				0, length)
+			bounds = bounds[numpy.argsort(bounds[:,0], kind='mergesort')]
+			starts = bounds[:,0]
+			ends = bounds[:,1]
+			# Each interval only adds what lies past the furthest
+			#  end of those before it
+			reach = numpy.maximum.accumulate(ends)
+			reach = numpy.concatenate( ([0], reach[:-1]) )
+			added = ends - numpy.maximum(starts, reach)
+			return(int(added[added > 0].sum()))
+
+	intervals = sorted(intervals)
+	covered = 0
+	reach = 0
+	for (start, end) in intervals:
+		start = max(start, reach, 0)
+		end = min(end, length)
+		if end > start:
+			covered += end - start
+			reach = end
+	return(covered)
+
+def match_intervals(matches):
+	"""Group the target intervals of every match in one pass.
+	Returns a dictionary keyed by (id(target entry), id(match
+	entry)) and valued by lists of the (start, end) intervals of the
+	target entry covered by the match entry."""
+	intervals = {}
+
+	if isinstance(matches, MatchGraph):
+		# Straight from the table, without making views
+		ids = [ id(entry) for entry in matches.entries ]
+		entry = matches.entry
+		offset = matches.offset
+		dlen = matches.len
+		linkA = matches.linkA
+		linkB = matches.linkB
+		for i in xrange(len(linkA)):
+			target = linkB[i]
+			key = (ids[entry[target]], ids[entry[linkA[i]]])
+			interval = (offset[target], offset[target] + dlen[target])
+			try:
+				intervals[key].append(interval)
+			except KeyError:
+				intervals[key] = [ interval ]
+		return(intervals)
+
+	for match in matches.values():
+		for target in match.targets:
+			key = (id(target.entry), id(match.entry))
+			interval = (target.offset, target.offset + target.len)
+			try:
+				intervals[key].append(interval)
+			except KeyError:
+				intervals[key] = [ interval ]
+	return(intervals)
+
+class Coverage:
+	"""The coverage of every entry by every other, computed from
+	the match intervals grouped by match_intervals()"""
+
+	def __init__(self, matches):
+		self.intervals = match_intervals(matches)
+
+	def coverage(self, idxentry, other):
+		"""The fraction of idxentry covered by the matches of
+		other, as coverage(idxentry, other.filter(matches))"""
+		intervals = self.intervals.get( (id(idxentry), id(other)) )
+		# Note: idxentry.len includes the null-terminator, so it's
+		#  length is one too long
+		return( 1.0 * covered_length(intervals, idxentry.len) /
+			(idxentry.len - 1) )
 
 def coverage(idxentry,matches):
 	"""Compute the coverage, the percentage of instructions that
 	are included by the targets of matches."""
-	coverage = []
-	# Create an array representing each instruction of idxentry
-	for i in range(idxentry.len):
-		coverage.append(False)
-		
-	# Look through the targets of all matches...
+	# Gather the intervals of this entry the matches target
+	intervals = []
 	for match in matches.values():
 	 for target in match.targets:
 		# If this does not target this entry, move on
-		if target.entry != idxentry:
+		if target.entry is not idxentry and target.entry != idxentry:
 			continue
-		# Otherwise, mark the instructions it targets as covered
-		for i in range(target.offset,target.offset + target.len):
-			coverage[i] = True
-			
-	# Sum up the number of instructions that have been covered		
-	similar = 0
-	for i in range(idxentry.len):
-		if coverage[i]:
-			similar += 1
+		intervals.append( (target.offset, target.offset + target.len) )
 
 	# Return the similarity
 	# Note: idxentry.len includes the null-terminator, so it's
 	#  length is one too long
-	return( 1.0 * similar / (idxentry.len - 1))
+	return( 1.0 * covered_length(intervals, idxentry.len) /
+		(idxentry.len - 1))
+
+# The Coverage, files and partners shared with the worker processes
+#  of similarity_rows(), which inherit them when forked
+matrixShared = None
+
+# The number of rows given to a worker process at a time
+matrixBlock = 16
+
+def matrix_block(rows):
+	"""Compute the products of coverage of the cells (i, j), j >= i,
+	of rows in the upper triangle of the similarity matrix.  Only
+	cells whose files cover each other are computed, the rest are 0.
+	Returns a list of (i, j, product)."""
+	(cover, files, partners) = matrixShared
+
+	cells = []
+	for i in rows:
+		for j in partners[i]:
+			if j < i:
+				continue
+			# Compute the coverage of i by j, and of j by i
+			a = cover.coverage(files[i], files[j])
+			b = cover.coverage(files[j], files[i])
+			cells.append( (i, j, a * b) )
+	return(cells)
+
+def similarity_rows(matches, files, jobs=1):
+	"""Yield each row of the symmetric similarity matrix of files,
+	in order, as a dictionary of its non-zero products of coverage
+	keyed by column.  Each cell is computed once, in blocks of rows
+	spread over jobs processes, and only the cells not yet written
+	are kept in memory."""
+	import itertools
+	global matrixShared
+
+	cover = Coverage(matches)
+
+	# Only files that cover each other both ways can be similar
+	index = {}
+	for n in range(len(files)):
+		index[id(files[n])] = n
+	partners = [ [] for n in range(len(files)) ]
+	for (target, match) in cover.intervals.keys():
+		if target in index and match in index and \
+		   (match, target) in cover.intervals:
+			partners[index[target]].append(index[match])
+
+	blocks = []
+	for start in range(0, len(files), matrixBlock):
+		blocks.append(range(start, min(start + matrixBlock, len(files))))
+
+	matrixShared = (cover, files, partners)
+	pool = None
+	if jobs > 1 and len(blocks) > 1:
+		import multiprocessing
+		pool = multiprocessing.Pool(jobs)
+		results = pool.imap(matrix_block, blocks)
+	else:
+		results = itertools.imap(matrix_block, blocks)
 
-def similarity(matches,idxfiles,outfile):
+	try:
+		# The cells of rows not yet written, keyed by row
+		pending = {}
+		# Blocks come back in order, and every cell of a row is
+		#  known once its block is done
+		for (rows, cells) in itertools.izip(blocks, results):
+			for (i, j, product) in cells:
+				pending.setdefault(i, {})[j] = product
+				if j != i:
+					pending.setdefault(j, {})[i] = product
+			for i in rows:
+				yield pending.pop(i, {})
+		if pool:
+			pool.close()
+	except:
+		if pool:
+			pool.terminate()
+		raise
+	if pool:
+		pool.join()
+	matrixShared = None
+
+def similarity(matches,idxfiles,outfile,jobs=1):
 	"""Create a similarity table, suitable for LaTeX, and write
 	it to outfile"""
 	files = []
 
 	# Get a list of all the possible files
 	for idxfile in idxfiles.values():
-		for file in idxfile.entry:
+		for file in idxfile.cached_entries():
 			files.append(file)
 
 	# Print the column labels
@@ -745,48 +1285,42 @@ def similarity(matches,idxfiles,outfile):
 	outfile.write('\\\\\n')	
 
 	# Print the rows
-	for i in files:
-		outfile.write(' %s (%s) &' % (i.file, i.archive))
-		for j in files:
-			# Compute the coverage of i
-			a = coverage(i,j.filter(matches))
-			
-			# Compute the coverage of j
-			b = coverage(j,i.filter(matches))
-
-			outfile.write(' %g &' % (a * b))
+	i = 0
+	for row in similarity_rows(matches, files, jobs):
+		outfile.write(' %s (%s) &' % (files[i].file, files[i].archive))
+		for j in range(len(files)):
+			outfile.write(' %g &' % row.get(j, 0.0))
 		outfile.write('\\\\\n')
+		i += 1
 
-def distance(matches,idxfiles,outfile):
+def distance(matches,idxfiles,outfile,jobs=1):
 	"""Create a distance matrix, suitable for the Phylip suite
 	of phylogenetic software, and write it to outfile"""
+	import math
+
 	files = []
 
 	# Get a list of all the possible files
 	for idxfile in idxfiles.values():
-		for file in idxfile.entry:
+		for file in idxfile.cached_entries():
 			files.append(file)
 
 	outfile.write('%u\n' % len(files))
 
 	# Print the rows
-	for i in files:
+	i = 0
+	for row in similarity_rows(matches, files, jobs):
 		#(unused,name,unused2) = i.archive.split('-',3)
 		#outfile.write('%10s' % name)
-		outfile.write('%s ' % i.file)
-		for j in files:
-			# Compute the coverage of i
-			a = coverage(i,j.filter(matches))
-			
-			# Compute the coverage of j
-			b = coverage(j,i.filter(matches))
-
-			if (a*b):
-				import math
-				outfile.write('%g ' % (1.0 / math.sqrt(a * b) - 1.0))
+		outfile.write('%s ' % files[i].file)
+		for j in range(len(files)):
+			product = row.get(j, 0.0)
+			if product:
+				outfile.write('%g ' % (1.0 / math.sqrt(product) - 1.0))
 			else:
 				outfile.write('0 ')
 		outfile.write('\n')
+		i += 1
 
 def set_args():
 	from optparse import OptionParser
@@ -802,6 +1336,12 @@ def set_args():
 			  action="store_true",
 			  default=False,
 			  help="Create a distance table (PHYLIP format)")
+	parser.add_option("-j","--jobs",
+			  dest="jobs",
+			  type="int",
+			  default=1,
+			  metavar="N",
+			  help="Compute the similarity or distance table in N processes")
 	parser.add_option("-m","--motifs",
 			  dest="motifs",
 			  action="store_true",
@@ -812,6 +1352,12 @@ def set_args():
 			  action="store_true",
 			  default=False,
 			  help="Create a graph of the matches (graphviz dot format)")
+	parser.add_option("-f","--format",
+			  dest="format",
+			  type="choice",
+			  choices=["dot", "edges", "graphml"],
+			  default="dot",
+			  help="Write the graph as dot, a tab separated edge list (edges) or graphml")
 	parser.add_option("-a","--assembly",
 			  dest="assembly",
 			  action="store_true",
@@ -868,10 +1414,15 @@ if __name__ == "__main__":
 		(matches, idxfiles) = bincompare_matches(sys.stdin)
 
 		if options.similarity:
-			similarity(matches, idxfiles, sys.stdout)
+			similarity(matches, idxfiles, sys.stdout, options.jobs)
 		if options.distance:
-			distance(matches, idxfiles, sys.stdout)
+			distance(matches, idxfiles, sys.stdout, options.jobs)
 		if options.motifs:
 			add_motifs(matches, len(idxfiles))
 		if options.graph:
-			graph(matches,idxfiles,sys.stdout)
+			if options.format == 'edges':
+				graph_edgelist(matches,idxfiles,sys.stdout)
+			elif options.format == 'graphml':
+				graph_graphml(matches,idxfiles,sys.stdout)
+			else:
+				graph(matches,idxfiles,sys.stdout)
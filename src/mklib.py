@@ -29,18 +29,49 @@ mytempdir = "/home/hllywood/"
 alienbin = "/usr/bin/alien"
 # Archives supported by alien
 alienarc = ["rpm","lsb","deb","pkg"]
-# Other archives and their uncompression command.  Before this 
-#  command, the archive will be copied into a temp directory,
-#  the shell will cd into that temp directory, and then this
-#  command will be executed
-otherarc = { 'zip':'unzip', 'tgz':'tar -xzf ',
-           'tar.gz':'tar -xzf', 'gz':'gzip -d' }
+# Other archives, read in-process by extract_binaries()
+otherarc = ['zip','tgz','tar.gz','gz']
 # The total listing of archives
-archives = alienarc + otherarc.keys()
+archives = alienarc + otherarc
+
+# The leading bytes of the binary formats objdump is able to disassemble.
+#  Anything that does not start with one of these is never handed to
+#  objdump
+binarymagic = { '\x7fELF':'elf',
+           'MZ':'pe',                  # DOS/PE executables
+           '\x4c\x01':'coff',           # i386 COFF objects
+           '\x64\x86':'coff',           # x86-64 COFF objects
+           '\x07\x01':'a.out',          # OMAGIC
+           '\x08\x01':'a.out',          # NMAGIC
+           '\x0b\x01':'a.out',          # ZMAGIC
+           '\xcc\x00':'a.out',          # QMAGIC
+           '!<arch>\n':'ar' }
+# The most bytes needed to recognize any of binarymagic
+binarymagiclen = max(map(len, binarymagic.keys()))
+
+# The tokens already computed by compact_instruction(), keyed by
+#  (opcode, operands), and the most that will be kept
+tokenMemo = {}
+tokenMemoSize = 1 << 20
+# The tokens added to tokenMemo since process_shard() started on an
+#  archive, to be handed back to the parent, or None
+tokenMemoAdded = None
+
+# The binaries already written to each library, keyed by the library
+#  name and then the content digest, valued by their (start, len)
+#  token range in the .dat file.  See library_hashes()
+contentIndex = {}
+
+# The open LibraryWriters, keyed by library name.  See get_writer()
+libraryWriters = {}
 
 # The global database for storing information on the instruction frequencies
 instructionDB = {}
 
+# The instructionDB counts of each binary written with --dedup, keyed by
+#  content digest, while process_shard() is collecting them, or None
+binaryCounts = None
+
 # Need this to make temporary directories
 from tempfile import mkdtemp
 
@@ -51,6 +82,13 @@ class MklibOpts:
 	bin = False
 	verbose = False
 	database = True
+	cache = False
+	jobs = 1
+	tokenmemo = None
+	dedup = False
+	addresses = False
+	# Where name.dat and name.idx are written, if not distname
+	library = None
 	
 def set_args():
 	from optparse import OptionParser
@@ -83,6 +121,31 @@ def set_args():
 			  action="store_false",
 			  default=True,
 			  help="Do not produce the default database output, name.db")
+	parser.add_option("-c","--cache",
+			  dest="cache",
+			  action="store_true",
+			  default=False,
+			  help="Save each disassembly in the shared disassembly cache")
+	parser.add_option("-j","--jobs",
+			  dest="jobs",
+			  type="int",
+			  default=1,
+			  metavar="N",
+			  help="Process N archives at a time in separate processes")
+	parser.add_option("-k","--token-memo",
+			  dest="tokenmemo",
+			  metavar="FILE",
+			  help="Keep the instruction token memo in FILE between runs")
+	parser.add_option("-u","--dedup",
+			  dest="dedup",
+			  action="store_true",
+			  default=False,
+			  help="Store identical binaries in name.dat only once")
+	parser.add_option("-a","--addresses",
+			  dest="addresses",
+			  action="store_true",
+			  default=False,
+			  help="Also write name.addr and name.labels, the address and label of each instruction, for showing matches; name.addr is twice the size of name.dat")
 			  
 	
 	parser.set_defaults(distname="unknown")
@@ -127,28 +190,268 @@ def compact_instruction(instruction):
 	binary hash/truncation.  The result has:
 	byte 0: top byte of md5 hash of the first two letters of the operand
 	byte 1: top byte of md5 hash of the entire operand
-	byte 2-3: md5hash of the operands"""
-	import md5
+	byte 2-3: md5hash of the operands
+	Results are remembered in tokenMemo, as there are far fewer
+	distinct instructions than instructions."""
+
+	key = (instruction[0], instruction[1])
+	try:
+		return(tokenMemo[key])
+	except KeyError:
+		pass
+
+	from hashlib import md5
 
 	# Byte 0
-	hash = md5.new()
-	hash.update( (instruction[0])[0:2] )
-	this =        (hash.digest())[0]
+	this =        md5( (instruction[0])[0:2] ).digest()[0]
 
 	# Byte 1
-	hash = md5.new()
-	hash.update( (instruction[0])[:] )
-	this = this + (hash.digest())[0:1]
+	this = this + md5( (instruction[0])[:] ).digest()[0:1]
 
 	# Bytes 2-3
-	hash = md5.new()
-	hash.update( (instruction[1])[:] )
-	this = this + (hash.digest())[0:2]
+	this = this + md5( (instruction[1])[:] ).digest()[0:2]
+
+	# Keep the memo bounded
+	if len(tokenMemo) >= tokenMemoSize:
+		tokenMemo.clear()
+	tokenMemo[key] = this
+	if tokenMemoAdded is not None:
+		tokenMemoAdded[key] = this
 
 	return(this)
 
-def process_file(path,archive,distname,options):
-	"Process a binary file, dissasembling it and then recording stats" 
+def compact_instructions(instructions):
+	"""Reduce a sequence of instructions into a single string of
+	4-byte tokens, see compact_instruction()"""
+	return( ''.join( [ compact_instruction(i) for i in instructions ] ) )
+
+def load_token_memo(filename):
+	"""Load tokenMemo as saved by save_token_memo(), if it exists"""
+	import cPickle
+
+	try:
+		memo = open(filename,'rb')
+	except IOError:
+		return
+	try:
+		tokenMemo.update(cPickle.load(memo))
+	finally:
+		memo.close()
+
+def remember_tokens(tokens):
+	"""Add tokens, as computed by compact_instruction(), to tokenMemo"""
+	if len(tokenMemo) + len(tokens) > tokenMemoSize:
+		tokenMemo.clear()
+	tokenMemo.update(tokens)
+
+def save_token_memo(filename):
+	"""Save tokenMemo so it can be loaded by the next run"""
+	import cPickle
+
+	memo = open(filename,'wb')
+	try:
+		cPickle.dump(tokenMemo, memo, cPickle.HIGHEST_PROTOCOL)
+	finally:
+		memo.close()
+
+def binary_format(path):
+	"""Read the magic bytes at the start of path and return the
+	name of the binary format they belong to (see binarymagic), or
+	None if this is not something objdump could disassemble."""
+
+	try:
+		f = open(path,'rb')
+		try:
+			magic = f.read(binarymagiclen)
+		finally:
+			f.close()
+	except IOError:
+		return None
+
+	return(magic_format(magic))
+
+def magic_format(magic):
+	"""Return the name of the binary format whose magic bytes start
+	the string magic, or None"""
+	for (prefix, format) in binarymagic.items():
+		if magic.startswith(prefix):
+			return format
+	return None
+
+def cache_name(path,archive,distname):
+	"""The name under which a file is kept in the disassembly
+	cache, matching its entry in the .idx file"""
+	return( (remove_temp_path(path), remove_temp_path(archive), distname) )
+
+class LibraryWriter:
+	"""Keeps the .dat, .idx (and .hashes, .addr and .labels) files of
+	a library open for a whole run, writing through large buffers and
+	tracking the current token offset in memory.  Nothing is
+	guaranteed to be on disk until commit(), which is called at
+	archive boundaries so the library on disk always ends with a
+	complete archive.  See library.py for the .addr and .labels
+	sidecars, which are written if addresses is set (mklib
+	--addresses) or the library already has them.  Tokens from before
+	they were started have no address."""
+
+	bufSize = 1 << 20
+
+	def __init__(self, library, addresses=False):
+		import library as binlibrary
+		import os
+
+		# Converted libraries can't be appended to as text
+		if binlibrary.is_binary_index(library + ".idx"):
+			raise IOError("%s.idx is a binary index and can't be "
+				"added to" % library)
+		self.library = library
+		self.dat = open(library + ".dat","ab",self.bufSize)
+		# Make sure that the dat file is at the end
+		self.dat.seek(0,2)
+		self.offset = self.dat.tell() / 4
+		self.idx = open(library + ".idx","a",self.bufSize)
+		self.hashes = None
+
+		# The .addr file follows the .dat file token for token
+		self.addr = None
+		self.labels = None
+		if addresses or os.path.exists(library + ".addr"):
+			self.addr = open(library + ".addr","ab",self.bufSize)
+			self.addr.seek(0,2)
+			if self.addr.tell() != self.offset * 8:
+				# Extending fills the tokens without an address
+				#  with zeros, sparsely
+				self.addr.truncate(self.offset * 8)
+				self.addr.seek(0,2)
+
+	def entry(self, start, path, archive, distname):
+		"""Write the index entry for a file"""
+		self.idx.write("%ld,%s,%s,%s\n" % ( 
+			start,                     # Start location
+			remove_temp_path(path),    # File name
+			remove_temp_path(archive), # Archive
+			distname) )                # Distribution name
+
+	def entry_line(self, line):
+		"""Write an already-formatted index line"""
+		self.idx.write(line)
+
+	def tokens(self, data, addrs=None):
+		"""Append data, a string of 4-byte tokens, to the .dat file,
+		and addrs, their 8-byte addresses, to the .addr file.
+		Tokens without addrs have no address."""
+		self.dat.write(data)
+		self.offset += len(data) / 4
+		if self.addr is not None:
+			if addrs is None:
+				addrs = '\x00' * (len(data) * 2)
+			self.addr.write(addrs)
+
+	def label(self, token, label):
+		"""Record that token is labelled label, see library.py"""
+		if self.addr is None:
+			return
+		if self.labels is None:
+			self.labels = open(self.library + ".labels","a",self.bufSize)
+		self.labels.write("%ld\t%s\n" % (token, label))
+
+	def hash(self, digest, start, dlen):
+		"""Record a binary's content digest, see record_hash()"""
+		if self.hashes is None:
+			self.hashes = open(self.library + ".hashes","a")
+		self.hashes.write("%s %ld %ld\n" % (digest, start, dlen))
+
+	def commit(self):
+		"""Put everything written so far on disk.  The .dat file
+		goes first so the .idx file never refers past its end."""
+		import os
+
+		for f in [self.dat, self.addr, self.labels, self.hashes,
+			  self.idx]:
+			if f is None:
+				continue
+			f.flush()
+			os.fsync(f.fileno())
+
+	def close(self):
+		self.commit()
+		for f in [self.dat, self.addr, self.labels, self.hashes,
+			  self.idx]:
+			if f is not None:
+				f.close()
+
+def get_writer(library, addresses=False):
+	"""Return the LibraryWriter for library, opening it if needed, see
+	LibraryWriter for addresses"""
+	try:
+		return(libraryWriters[library])
+	except KeyError:
+		writer = LibraryWriter(library, addresses)
+		libraryWriters[library] = writer
+		return(writer)
+
+def close_writers(library=None):
+	"""Commit and close the writer for library, or all of them"""
+	if library is None:
+		names = libraryWriters.keys()
+	else:
+		names = [ library ]
+	for name in names:
+		writer = libraryWriters.pop(name, None)
+		if writer:
+			writer.close()
+
+def library_hashes(library):
+	"""Return the content digests of the binaries in library, a
+	dictionary valued by their (start, len) range in library.dat.
+	This is loaded from library.hashes the first time it is needed."""
+	import os
+
+	try:
+		return(contentIndex[library])
+	except KeyError:
+		pass
+
+	table = {}
+	try:
+		if library in libraryWriters:
+			datEnd = libraryWriters[library].offset
+		else:
+			datEnd = os.path.getsize(library + ".dat") / 4
+		hashes = open(library + ".hashes")
+	except (os.error, IOError):
+		contentIndex[library] = table
+		return(table)
+
+	for line in hashes:
+		try:
+			(digest, start, dlen) = line.split()
+			start = long(start)
+			dlen = long(dlen)
+		except ValueError:
+			continue
+		# Ignore anything past the end of the library
+		if start + dlen <= datEnd:
+			table[digest] = (start, dlen)
+	hashes.close()
+
+	contentIndex[library] = table
+	return(table)
+
+def record_hash(library, digest, start, dlen):
+	"""Note that the binary with content digest is stored at start
+	for dlen tokens in library"""
+	library_hashes(library)[digest] = (start, dlen)
+	get_writer(library).hash(digest, start, dlen)
+
+def process_file(path,archive,distname,options,instructions=None,digest=None):
+	"""Process a binary file, dissasembling it and then recording stats.
+	If instructions is given, it is used as the already-disassembled
+	contents of path rather than running objdump again.  If
+	options.dedup is set, a file whose content digest is already in
+	the library only gets an .idx entry pointing to the existing
+	tokens (and is not counted in the instructionDB).  Otherwise, its
+	counts are also kept in binaryCounts, if that is being kept."""
 
 	# For convenience, have an escaped path suitable for use in 
 	#  shell environments
@@ -161,216 +464,1038 @@ def process_file(path,archive,distname,options):
 	if os.path.islink(path):
 		return
 	
-	# Disassemble the file
-	import objdumputil
-	binaryFile = objdumputil.Objdump()
-	instructions = binaryFile.disassemble(path)
-	
-	# Nothing came out, return now
-	if len(instructions) == 0:
-		return
-	
-	# Prepare to write binary output
-	if options.bin:
-		# Open the files
-		dat = open(distname + ".dat","ab")
-		idx = open(distname + ".idx","a")
-		# Make sure that the dat file is at the end
-		dat.seek(0,2)
+	# The library being written
+	library = getattr(options,'library',None) or distname
 
-		# Write the index entry
-		idx.write("%ld,%s,%s,%s\n" % ( 
-			dat.tell() / 4,            # Start location
-			remove_temp_path(path),    # File name
-			remove_temp_path(archive), # Archive
-			distname) )                # Distribution name
-		idx.close()
+	# Has this been seen before?
+	dedup = options.bin and getattr(options,'dedup',False)
+	if dedup:
+		import disasmcache
+		if digest is None:
+			digest = disasmcache.file_digest(path)
+		try:
+			(start, dlen) = library_hashes(library)[digest]
+		except KeyError:
+			pass
+		else:
+			get_writer(library).entry(start, path, archive, distname)
+			if options.verbose:
+				print "+ process_file %s (duplicate)" % escapedPath
+			return
 
-	# Add any useful information to the global instructionDB
+	# Disassemble the file, one instruction at a time
+	if instructions is None and options.cache:
+		import disasmcache
+		cache = disasmcache.get_cache()
+		if cache:
+			instructions = cache.disassemble(path, True,
+				cache_name(path,archive,distname))[0]
+	if instructions is None:
+		import objdumputil
+		binaryFile = objdumputil.Objdump()
+		instructions = binaryFile.iter_disassemble(path)
+	import struct
+	count = 0
+	# The instructionDB counts of this file
+	counts = {}
+	# Instructions waiting to be written to the .dat file, and their
+	#  addresses
+	block = []
+	addrs = []
+	
 	for instruction in instructions:
+		# Prepare to write binary output when the first
+		#  instruction shows up; if nothing ever comes out,
+		#  nothing is written
+		if count == 0 and options.bin:
+			writer = get_writer(library,
+				getattr(options,'addresses',False))
+			start = writer.offset
+
+			# Write the index entry
+			writer.entry(start, path, archive, distname)
+		count += 1
+
+		# Add any useful information to the global instructionDB
 		try:
-			instructionDB[ instruction[0] ] += 1
+			counts[ instruction[0] ] += 1
 		except KeyError:
-			instructionDB[ instruction[0] ] = 1
+			counts[ instruction[0] ] = 1
 
 		# If we're writing the binary, compact and write
+		#  in blocks
 		if options.bin:
-			dat.write( compact_instruction(instruction) )
+			block.append( instruction )
+			try:
+				address = long(instruction[2], 16)
+			except (IndexError, ValueError):
+				address = 0
+			addrs.append( struct.pack('<Q', address) )
+			if len(instruction) > 3:
+				writer.label(start + count - 1, instruction[3])
+			if len(block) >= 4096:
+				writer.tokens( compact_instructions(block),
+					''.join(addrs) )
+				block = []
+				addrs = []
+
+	# Nothing came out, return now
+	if count == 0:
+		return
+
+	add_counts(instructionDB, counts)
+	if dedup and binaryCounts is not None:
+		binaryCounts[digest] = counts
 
 	if options.bin:
-		dat.write('\x00\x00\x00\x00')
-		dat.close()
+		addrs.append('\x00' * 8)
+		writer.tokens( compact_instructions(block) + '\x00\x00\x00\x00',
+			''.join(addrs) )
+
+		# Including the terminator
+		if dedup:
+			record_hash(library, digest, start, count + 1)
 
 	if options.verbose:		
 		print "+ process_file %s" % escapedPath
-		print ">>> %d instructions" % len(instructions)
+		print ">>> %d instructions" % count
 
-def unpack_archive(archive):
-	"""Create a temporary directory and unpack archive to that
-	directory.  If this is a package format, use alien to first
-	convert it into a tar'd gzip'd archive that can be easily unpacked.
-	Returns the temporary directory."""
+def alien_convert(archive, tmpdir):
+	"""Use alien to convert the package archive into a tar'd gzip'd
+	archive in tmpdir, returning the path of the new archive"""
 	import os
+	import glob
 
-	# Create a temporary directory
-	tmpdir = mkdtemp(dir=mytempdir)
-
-	# Is this a package to be processed by alien?
-	parts = archive.split('.')
-	if parts[-1] in alienarc:
-		# Create a .tgz version of the package
-		os.system('cp %s %s' % (archive, tmpdir))
-		parts =  archive.split("/")
-		archiveName = parts[-1]
-		
-		os.system('cd %s && %s -t %s/%s 2>/dev/null 1>/dev/null' % (tmpdir,alienbin,tmpdir,archiveName)) 
-		parts = archiveName.split('.')
-		parts[-1] = 'tgz'
-		archive = tmpdir + '/' + '.'.join(parts)
-
-		# Ocassionally, alien munges the extension
-		os.system('mv %s/*.tgz %s' % (tmpdir, archive))
-	else:
-		# If this wasn't something for alien, move it
-		#  to the tmpdir
-		os.system('cp -u %s %s/.' % (archive,tmpdir))
-		
-	# Figure out how to uncompress this archive
-	extension = archive.split('.')[-1]
 	archiveName = archive.split("/")[-1]
-	uncompress = otherarc[extension]
-	os.system('cd %s && %s %s' % ( \
-			tmpdir, # cd %s
-			uncompress,archiveName # %s %s 
-		))
+	os.system('cd %s && %s -t %s 2>/dev/null 1>/dev/null' % (tmpdir,alienbin,os.path.abspath(archive))) 
+	parts = archiveName.split('.')
+	parts[-1] = 'tgz'
+	converted = tmpdir + '/' + '.'.join(parts)
 
-	return(tmpdir)
+	# Ocassionally, alien munges the extension
+	found = glob.glob('%s/*.tgz' % tmpdir)
+	if found and found[0] != converted:
+		os.rename(found[0], converted)
 
-def process_archive(archive, distname,options):
-	""""Use alien to unpack an archive in a temp directory, then process 
-	each binary file with process_file()"""
+	return(converted)
+
+def save_member(member, name, tmpdir):
+	"""Copy the archive member, an open file-like object, to name
+	under tmpdir if it is a binary objdump can disassemble.
+	Returns the path it was saved to, or None if it was not a
+	binary (in which case nothing is written)."""
 	import os
-	
-	def scanFunc(unused, dirname, files):
-		
-		# Traverse each file in the directory
-		for filename in files:
-			# Figure out the absolute path name
-			path = os.path.join(dirname, filename)
+	import shutil
 
-			# Make sure the file still exists
-			try:
-				t = os.stat(path)
-			except os.error:
-				# This should only happy if the file
-				#  was deleted between when the walk
-				#  started and when we looked at it.
-				# Keep the code stable by moving on
-				continue
+	magic = member.read(binarymagiclen)
+	if not magic_format(magic):
+		return None
 
-			# Process this file
-			process_file(path,archive,distname,options)
+	# Keep the member inside tmpdir
+	name = os.path.normpath('/' + name).lstrip('/')
+	if not name:
+		return None
+	path = os.path.join(tmpdir, name)
 
+	dirname = os.path.dirname(path)
+	if not os.path.isdir(dirname):
+		os.makedirs(dirname)
+
+	out = open(path,'wb')
 	try:
-		# Unpack the archive
-		tmpdir = unpack_archive(archive)
+		out.write(magic)
+		shutil.copyfileobj(member, out, 1 << 20)
+	finally:
+		out.close()
+	return(path)
+
+def extract_binaries(archive, tmpdir):
+	"""Read archive in-process and save only its binary members
+	under tmpdir, see save_member().  Package formats are first
+	converted with alien.  Returns a tuple of the list of saved
+	paths and the number of members that were skipped."""
+	import tarfile
+	import zipfile
+
+	paths = []
+	skipped = 0
+
+	if archive.split('.')[-1] in alienarc:
+		archive = alien_convert(archive, tmpdir)
+
+	if tarfile.is_tarfile(archive):
+		# This handles .tar.gz, .tgz and compressed tars 
+		#  named .gz
+		tar = tarfile.open(archive,'r:*')
+		try:
+			for info in tar:
+				# Symbolic links add nothing new, and are
+				#  skipped by process_file() anyway.  Hard
+				#  links are files like any other.
+				if not (info.isfile() or info.islnk()):
+					if not info.isdir():
+						skipped += 1
+					continue
+				try:
+					member = tar.extractfile(info)
+				except KeyError:
+					# A hard link to a missing member
+					skipped += 1
+					continue
+				path = save_member(member, info.name, tmpdir)
+				member.close()
+				if path:
+					paths.append(path)
+				else:
+					skipped += 1
+		finally:
+			tar.close()
+
+	elif zipfile.is_zipfile(archive):
+		zipped = zipfile.ZipFile(archive)
+		try:
+			for info in zipped.infolist():
+				if info.filename.endswith('/'):
+					continue
+				member = zipped.open(info)
+				path = save_member(member, info.filename, tmpdir)
+				member.close()
+				if path:
+					paths.append(path)
+				else:
+					skipped += 1
+		finally:
+			zipped.close()
+
+	elif archive.endswith('.gz'):
+		# A single compressed file
+		import gzip
+
+		member = gzip.open(archive,'rb')
+		try:
+			path = save_member(member,
+				archive.split('/')[-1][:-3], tmpdir)
+		finally:
+			member.close()
+		if path:
+			paths.append(path)
+		else:
+			skipped += 1
+
+	return( (paths, skipped) )
+
+def process_archive(archive, distname,options):
+	""""Extract the binaries from an archive into a temp directory, then
+	process each binary file with process_file()"""
+	import os
+	import tarfile
+	import zipfile
+	
+	tmpdir = None
+	try:
+		# Pull the binaries out of the archive
+		tmpdir = mkdtemp(dir=mytempdir)
 		
 		# Print out information, if requested
 		if options.verbose:
 			print "= process_archive(%s,%s) in %s" % \
 				(archive, distname, tmpdir)
 
-		# Process the directory
-		os.path.walk(tmpdir,scanFunc,None)
+		try:
+			(paths, skipped) = extract_binaries(archive, tmpdir)
+		except (IOError, EOFError, tarfile.TarError, zipfile.BadZipfile):
+			# Keep going with the rest of the distribution
+			import sys
+			print sys.exc_info()[0]
+			paths = []
+			skipped = 0
+		if options.verbose:
+			print "= %d binaries accepted, %d files skipped" % \
+				(len(paths), skipped)
+
+		# Binaries already in the library don't need objdump
+		digests = {}
+		duplicates = set()
+		if options.bin and getattr(options,'dedup',False):
+			import disasmcache
+			library = getattr(options,'library',None) or distname
+			known = library_hashes(library)
+			for path in paths:
+				digests[path] = disasmcache.file_digest(path)
+				if digests[path] in known:
+					duplicates.add(path)
+
+		# Process the files in order, sharing objdump processes
+		import objdumputil
+		binaryFile = objdumputil.Objdump()
+		cache = None
+		if options.cache:
+			import disasmcache
+			cache = disasmcache.get_cache()
+
+		# Keep the bytes as well for the match viewers
+		batch = binaryFile.iter_batch([ path for path in paths
+			if path not in duplicates ], bool(cache))
+		for path in paths:
+			if path in duplicates:
+				process_file(path,archive,distname,options,
+					digest=digests[path])
+				continue
+
+			(path, instructions) = batch.next()
+			if cache:
+				# The cache needs the whole disassembly anyway
+				records = instructions
+				instructions = []
+				bytes = []
+				for (instruction, data) in records:
+					instructions.append(instruction)
+					bytes.append(data)
+				if instructions:
+					cache.store(path, instructions, bytes,
+						cache_name(path,archive,distname))
+			process_file(path,archive,distname,options,
+				instructions,digests.get(path))
 	except:
 		raise
+	# This archive is done, make sure it's on disk
+	if options.bin:
+		library = getattr(options,'library',None) or distname
+		if library in libraryWriters:
+			libraryWriters[library].commit()
+
 	# Clean up
 	if tmpdir:
 		os.system('rm -rf %s' % tmpdir)
 	
+class DirectorySource:
+	"""The archives of a distribution unpacked in a directory tree"""
+
+	def __init__(self, dir):
+		self.dir = dir
+
+	def __str__(self):
+		return(self.dir)
+
+	def archives(self):
+		"""Walk through the directory looking for archive files (but
+		not binaries), returning their paths in a fixed order"""
+		import os.path
+
+		def scanfunc(unused, dirname, files):
+			import os
+			
+			# Traverse each file in the directory
+			for filename in files:
+				# Figure out the absolute path name
+				path = os.path.join(dirname, filename)
+
+				# Make sure the file still exists
+				try:
+					t = os.stat(path)
+				except os.error:
+					# This should only happy if the file
+					#  was deleted between when the walk
+					#  started and when we looked at it.
+					# Keep the code stable by moving on
+					continue
+
+				# Figure out if this is an extension we should
+				#  consider
+				parts = filename.split('.')
+				extension = parts[-1]
+
+				if extension in archives:
+					found.append(path)
+		
+		found = []
+		os.path.walk(self.dir,scanfunc,None)
+		return(found)
+
+	def stat(self, archive):
+		"""Return the (size, mtime) of archive"""
+		import os
+
+		stat = os.stat(archive)
+		return( (long(stat.st_size), long(stat.st_mtime)) )
+
+	def digest(self, archive):
+		import disasmcache
+		return(disasmcache.file_digest(archive))
+
+	def process(self, archive, distname, options):
+		process_archive(archive, distname, options)
+
+class ISOSource:
+	"""The archives of a distribution ISO, read straight from the
+	image with the iso9660 module rather than by mounting it"""
+
+	def __init__(self, isofile):
+		self.isofile = isofile
+		self.iso = None
+
+	def __str__(self):
+		return(self.isofile)
+
+	def __getstate__(self):
+		# Each process opens the image for itself
+		return( { 'isofile':self.isofile, 'iso':None } )
+
+	def image(self):
+		if self.iso is None:
+			import iso9660
+			self.iso = iso9660.ISO9660(self.isofile)
+		return(self.iso)
+
+	def archives(self):
+		"""The paths, within the image, of every archive on it"""
+		found = []
+		for (dirname, dirs, files) in self.image().walk():
+			for filename in files:
+				if filename.split('.')[-1] in archives:
+					found.append(dirname.rstrip('/') + '/' + filename)
+		return(found)
+
+	def stat(self, archive):
+		entry = self.image().entry(archive)
+		return( (entry.size, entry.mtime) )
+
+	def digest(self, archive):
+		import hashlib
+
+		hash = hashlib.sha1()
+		member = self.image().open(archive)
+		block = member.read(1 << 16)
+		while block:
+			hash.update(block)
+			block = member.read(1 << 16)
+		member.close()
+		return(hash.hexdigest())
+
+	def process(self, archive, distname, options):
+		"""Copy archive out of the image to a temporary directory,
+		where it gets the same path as under a mount point, and
+		process it there"""
+		import os
+
+		tmpdir = mkdtemp(dir=mytempdir)
+		try:
+			path = tmpdir + archive
+			if not os.path.isdir(os.path.dirname(path)):
+				os.makedirs(os.path.dirname(path))
+			self.image().extract(archive, path)
+			process_archive(path, distname, options)
+		finally:
+			os.system('rm -rf %s' % tmpdir)
+
 def scan_distdir(dir, distname,options):
 	"""Walk through a distribution directory looking for archive files (but
 	not binaries) and then invoke process_archive()"""
-	import os.path
+	scan_source(DirectorySource(dir), distname, options)
+
+def scan_isofile(isofile, distname, options):
+	"""Process every archive on a distribution ISO, without mounting it"""
+	scan_source(ISOSource(isofile), distname, options)
+
+def scan_source(source, distname, options):
+	"""Process every archive in source, a DirectorySource or ISOSource"""
+
+	print "Scanning %s in %s" % (distname, source)
+
+	# Find all of the archives first, so that the order they are
+	#  added to the library in is fixed
+	found = source.archives()
+
+	# Pick up where any previous run left off
+	manifest = None
+	if options.bin:
+		manifest = BuildManifest(getattr(options,'library',None) or distname)
+		manifest.restore()
+		manifest.rewind(found, source)
+		todo = []
+		for path in found:
+			if path in manifest.archives:
+				if options.verbose:
+					print "= %s unchanged, skipping" % path
+				# It was counted when it was committed
+				add_counts(instructionDB,
+					manifest.archives[path]['counts'])
+			else:
+				todo.append(path)
+		found = todo
 
-	print "Scanning %s in %s" % (distname, dir)
+	jobs = getattr(options,'jobs',1) or 1
+	if jobs <= 1:
+		for path in found:
+			if manifest:
+				start = manifest.mark()
+			counts = process_counted(source, path, distname, options)
+			if manifest:
+				manifest.commit(path, start, source, counts)
+	else:
+		process_parallel(found, distname, options, jobs, manifest, source)
+
+	close_writers()
+
+def add_counts(counts, more):
+	"""Add the instructionDB counts more to counts"""
+	for (opcode, count) in more.items():
+		try:
+			counts[opcode] += count
+		except KeyError:
+			counts[opcode] = count
+
+def process_counted(source, archive, distname, options):
+	"""Process archive, found in source, and return the instructionDB
+	counts of just this archive, which are added to instructionDB as
+	well"""
+	saved = dict(instructionDB)
+	instructionDB.clear()
+	try:
+		source.process(archive, distname, options)
+	finally:
+		counts = dict(instructionDB)
+		instructionDB.clear()
+		instructionDB.update(saved)
+		add_counts(instructionDB, counts)
+	return(counts)
+
+class BuildManifest:
+	"""A record of the archives that have been fully added to a
+	library, kept in library.manifest.  Each line holds an archive's
+	size, mtime and content digest, the .dat token range and .idx
+	byte range it was written to and its instructionDB counts, so a
+	rerun can skip archives that have not changed and an interrupted
+	run can throw away whatever it had only partly written.  The
+	first line holds the ends of whatever was in the library before
+	the manifest was started."""
 
-	def scanfunc(unused, dirname, files):
+	def __init__(self, library):
+		self.library = library
+		self.name = library + '.manifest'
+		# The committed archives, keyed by path
+		self.archives = {}
+		# (path, record, line) for each line, in the order they
+		#  were committed
+		self.records = []
+		# The base line
+		self.base = None
+		# The end of the last committed archive in .dat (tokens)
+		#  and .idx (bytes), None if there is no manifest yet
+		self.datEnd = None
+		self.idxEnd = None
+
+		try:
+			manifest = open(self.name)
+		except IOError:
+			return
+		# Nothing was committed by a run that died before writing
+		#  the base line
+		self.datEnd = 0
+		self.idxEnd = 0
+		for line in manifest:
+			# A partial line means the run died while writing it
+			if not line.endswith('\n'):
+				break
+			fields = line[:-1].split('\t',8)
+			if fields[0] == '#base':
+				try:
+					self.datEnd = long(fields[1])
+					self.idxEnd = long(fields[2])
+				except (IndexError, ValueError):
+					break
+				self.base = line
+				continue
+			try:
+				(size, mtime, digest, datStart, datEnd, idxStart,
+				 idxEnd) = fields[:7]
+				record = { 'size':long(size), 'mtime':long(mtime),
+					'digest':digest,
+					'dat':(long(datStart), long(datEnd)),
+					'idx':(long(idxStart), long(idxEnd)) }
+				if len(fields) == 9:
+					record['counts'] = load_counts(fields[7])
+					path = fields[8]
+				else:
+					# Written before the counts were kept
+					record['counts'] = None
+					path = fields[7]
+			except ValueError:
+				break
+			self.archives[path] = record
+			self.records.append( (path, record, line) )
+			self.datEnd = record['dat'][1]
+			self.idxEnd = record['idx'][1]
+		manifest.close()
+
+	def restore(self):
+		"""Truncate the library to the end of the last committed
+		archive, removing anything from an interrupted run.  A new
+		manifest is started with whatever is already in the
+		library as its base."""
+
+		close_writers(self.library)
+		if self.datEnd is None:
+			(self.datEnd, self.idxEnd) = self.mark()
+			self.base = '#base\t%d\t%d\n' % (self.datEnd, self.idxEnd)
+			self.rewrite()
+			return
+		self.truncate()
+
+	def rewind(self, found, source=None):
+		"""Forget the first committed archive that has changed since,
+		is no longer in found or has no counts, and everything
+		committed after it, and remove them from the library so they
+		can be added again in order"""
+		present = set(found)
+		for i in range(len(self.records)):
+			(path, record, line) = self.records[i]
+			if path in present and self.archives[path] is record and \
+			   record['counts'] is not None and \
+			   self.unchanged(path, source):
+				continue
+
+			close_writers(self.library)
+			self.datEnd = record['dat'][0]
+			self.idxEnd = record['idx'][0]
+			self.records = self.records[:i]
+			self.archives = {}
+			for (path, record, line) in self.records:
+				self.archives[path] = record
+			self.rewrite()
+			self.truncate()
+			return
+
+	def rewrite(self):
+		"""Write the manifest out again from base and records"""
 		import os
-		
-		# Traverse each file in the directory
-		for filename in files:
-			# Figure out the absolute path name
-			path = os.path.join(dirname, filename)
 
-			# Make sure the file still exists
+		manifest = open(self.name + '.new','w')
+		if self.base:
+			manifest.write(self.base)
+		for (path, record, line) in self.records:
+			manifest.write(line)
+		manifest.flush()
+		os.fsync(manifest.fileno())
+		manifest.close()
+		os.rename(self.name + '.new', self.name)
+
+	def truncate(self):
+		"""Truncate the library files to datEnd and idxEnd"""
+		for (ext, end) in [ ('.dat', self.datEnd * 4),
+		                    ('.addr', self.datEnd * 8),
+		                    ('.idx', self.idxEnd) ]:
 			try:
-				t = os.stat(path)
-			except os.error:
-				# This should only happy if the file
-				#  was deleted between when the walk
-				#  started and when we looked at it.
-				# Keep the code stable by moving on
+				f = open(self.library + ext, 'r+b')
+			except IOError:
 				continue
+			f.seek(0,2)
+			if f.tell() > end:
+				f.truncate(end)
+			f.close()
 
-			# Figure out if this is an extension we should
-			#  consider
-			parts = filename.split('.')
-			extension = parts[-1]
+		# Forget any labels that were thrown away
+		try:
+			labels = open(self.library + '.labels')
+		except IOError:
+			labels = None
+		if labels:
+			lines = labels.readlines()
+			labels.close()
+			keep = [ line for line in lines
+				if long(line.split('\t',1)[0]) < self.datEnd ]
+			if len(keep) != len(lines):
+				labels = open(self.library + '.labels','w')
+				labels.writelines(keep)
+				labels.close()
 
-			if extension in archives:
-				process_archive(path, distname,options)
-	
-	os.path.walk(dir,scanfunc,None)
-	
-def mount_isofile(isofile):
-	"""Mount an ISO on a temporary directory and return that directory"""
+		# Forget any binaries that were thrown away
+		try:
+			hashes = open(self.library + '.hashes')
+		except IOError:
+			return
+		lines = hashes.readlines()
+		hashes.close()
+		keep = []
+		for line in lines:
+			try:
+				(digest, start, dlen) = line.split()
+				if long(start) + long(dlen) <= self.datEnd:
+					keep.append(line)
+			except ValueError:
+				continue
+		if len(keep) != len(lines):
+			hashes = open(self.library + '.hashes','w')
+			hashes.writelines(keep)
+			hashes.close()
+			contentIndex.pop(self.library, None)
 
-	# Create a temporary directory
-	mountdir = mkdtemp(dir=mytempdir)
-	
-	# Attempt to mount the iso in loopback to this directory
-	try:
+	def unchanged(self, archive, source=None):
+		"""True if archive, found in source, was committed and has
+		not changed since"""
 		import os
-		os.system('mount -oloop %s %s' % (isofile, mountdir))
-		print "%s mounted on %s" % (isofile, mountdir)
-	except os.error:
-		import sys
-		print sys.exc_info()[0]
-		rmdir(mountdir)
-	
-	return(mountdir)
 
-def main():
-	options = set_args()
+		if source is None:
+			source = DirectorySource(None)
+		try:
+			record = self.archives[archive]
+			(size, mtime) = source.stat(archive)
+		except (KeyError, os.error, IOError):
+			return False
+
+		if record['size'] != size:
+			return False
+		if record['mtime'] == mtime:
+			return True
+		# Touched, but maybe not changed
+		return(record['digest'] == source.digest(archive))
+
+	def mark(self):
+		"""Return the current (.dat tokens, .idx bytes) ends of the
+		library, to be passed to commit()"""
+		import os
+
+		ends = []
+		for ext in ['.dat', '.idx']:
+			try:
+				ends.append(os.path.getsize(self.library + ext))
+			except os.error:
+				ends.append(0)
+		return( (ends[0] / 4, ends[1]) )
+
+	def commit(self, archive, start, source=None, counts=None):
+		"""Record archive, found in source, as fully written to the
+		library, from start, as returned by mark(), to the current
+		ends, with counts, its instructionDB counts"""
+		import os
 
+		if source is None:
+			source = DirectorySource(None)
+		if counts is None:
+			counts = {}
+		end = self.mark()
+		(size, mtime) = source.stat(archive)
+		digest = source.digest(archive)
+
+		line = '%d\t%d\t%s\t%d\t%d\t%d\t%d\t%s\t%s\n' % (
+			size, mtime, digest,
+			start[0], end[0], start[1], end[1],
+			dump_counts(counts), archive )
+		manifest = open(self.name,'a')
+		manifest.write(line)
+		manifest.flush()
+		os.fsync(manifest.fileno())
+		manifest.close()
+
+		record = { 'size':size,
+			'mtime':mtime, 'digest':digest,
+			'dat':(start[0], end[0]), 'idx':(start[1], end[1]),
+			'counts':dict(counts) }
+		self.archives[archive] = record
+		self.records.append( (archive, record, line) )
+		self.datEnd = end[0]
+		self.idxEnd = end[1]
+
+def dump_counts(counts):
+	"""instructionDB counts as a manifest field"""
+	import json
+	return(json.dumps(counts, sort_keys=True))
+
+def load_counts(field):
+	"""The instructionDB counts of a manifest field"""
+	import json
 	try:
-		# If there is an iso file, mount it
-		if options.file:
-			options.distdir = mount_isofile(options.file)
-			
-		# Scan the distribution directory
-		scan_distdir(options.distdir, options.distname, options)
+		counts = json.loads(field)
+	except ValueError:
+		raise ValueError('Bad counts in manifest')
+	return( dict([ (str(opcode), count)
+		for (opcode, count) in counts.items() ]) )
 
+# The files of a library that process_shard() writes
+shardExtensions = ['.dat', '.idx', '.addr', '.labels', '.hashes']
+
+def shard_sizes(shard):
+	"""Return the size in bytes of each of the files of shard, by
+	extension"""
+	import os
+
+	sizes = {}
+	for ext in shardExtensions:
+		try:
+			sizes[ext] = os.path.getsize(shard + ext)
+		except os.error:
+			sizes[ext] = 0
+	return(sizes)
+
+def read_range(name, start, end):
+	"""Return bytes start to end of the file name"""
+	if end <= start:
+		return('')
+	f = open(name,'rb')
+	try:
+		f.seek(start)
+		return(f.read(end - start))
 	finally:
-	# If there was an iso file, unmount it and remove the directory
-		if options.file:
-			try:
-				import os
-				import time
-				os.system('umount -d %s' % options.distdir)
+		f.close()
 
-				# Umount is non-blocking
-				time.sleep(1)
-				os.rmdir(options.distdir)
-			except os.error:
-				import sys
-				print sys.exc_info()[0]
+def process_shard(args):
+	"""Process a single archive into the shard of this worker process,
+	a library in sharddir, see process_parallel().  Returns the shard,
+	the shard_sizes() before and after the archive, the
+	instructionDB counts for just this archive, or with --dedup the
+	binaryCounts of each binary it wrote instead, and, if the token
+	memo is being kept, the tokens it added to it."""
+	import copy
+	import os
+	global tokenMemoAdded
+	global binaryCounts
+	(archive, distname, options, sharddir, source) = args
+	shard = os.path.join(sharddir, 'shard%d' % os.getpid())
+
+	# This process may have handled other archives before.  Their
+	#  binaries are in the shard too, but each archive is merged on
+	#  its own, so it may only refer to its own binaries
+	instructionDB.clear()
+	contentIndex.clear()
+	contentIndex[shard] = {}
+	if getattr(options,'tokenmemo',None):
+		tokenMemoAdded = {}
+	# Binaries the merge finds are already in the library must not be
+	#  counted, see merge_shard_dedup()
+	dedup = options.bin and getattr(options,'dedup',False)
+	if dedup:
+		binaryCounts = {}
+
+	options = copy.copy(options)
+	options.library = shard
+	start = shard_sizes(shard)
+	try:
+		source.process(archive, distname, options)
+	finally:
+		close_writers(shard)
+
+	if dedup:
+		return( (shard, start, shard_sizes(shard), binaryCounts,
+			tokenMemoAdded) )
+	return( (shard, start, shard_sizes(shard), dict(instructionDB),
+		tokenMemoAdded) )
+
+def merge_shard(shard, library, start, end, addresses=False):
+	"""Append an archive written by process_shard() to library, from
+	the start to the end shard_sizes() of shard, rebasing its offsets
+	to follow whatever is already in the library.  See LibraryWriter
+	for addresses."""
+
+	# Where this archive starts in the library
+	writer = get_writer(library, addresses)
+	base = writer.offset - start['.dat'] / 4
+
+	for line in read_range(shard + ".idx", start['.idx'],
+			       end['.idx']).splitlines(True):
+		(token, rest) = line.split(',',1)
+		writer.entry_line("%ld,%s" % (long(token) + base, rest))
 
+	for line in read_range(shard + ".labels", start['.labels'],
+			       end['.labels']).splitlines():
+		(token, label) = line.split('\t',1)
+		writer.label(long(token) + base, label)
+
+	if end['.dat'] > start['.dat']:
+		sharddat = open(shard + ".dat","rb")
+		sharddat.seek(start['.dat'])
+		shardaddr = open_shard_addr(shard, start['.dat'] / 4)
+		remaining = end['.dat'] - start['.dat']
+		while remaining > 0:
+			block = sharddat.read(min(remaining, 1 << 20))
+			if not block:
+				break
+			writer.tokens(block, shard_addrs(shardaddr, len(block)))
+			remaining -= len(block)
+		sharddat.close()
+		if shardaddr:
+			shardaddr.close()
+	writer.commit()
+
+def open_shard_addr(shard, token=0):
+	"""Open the .addr file of shard at token, or return None"""
+	try:
+		shardaddr = open(shard + ".addr","rb")
+	except IOError:
+		return(None)
+	shardaddr.seek(token * 8)
+	return(shardaddr)
+
+def shard_addrs(shardaddr, size):
+	"""Read the addresses of size bytes of tokens from shardaddr, or
+	return None if there aren't any"""
+	if shardaddr is None:
+		return(None)
+	addrs = shardaddr.read(size * 2)
+	if len(addrs) != size * 2:
+		return(None)
+	return(addrs)
+
+def merge_shard_dedup(shard, library, start, end, addresses=False):
+	"""Like merge_shard(), but only append the archive's binaries that
+	are not already in library; .idx entries for the others point to
+	the existing copies.  Returns the digests of the binaries that
+	were appended."""
+	import bisect
+
+	added = []
+	if end['.idx'] == start['.idx']:
+		return(added)
+
+	known = library_hashes(library)
+
+	# Copy the archive's binaries over, in order, noting where each
+	#  shard offset ended up
+	rebased = {}
+	writer = get_writer(library, addresses)
+	sharddat = open(shard + ".dat","rb")
+	shardaddr = open_shard_addr(shard)
+	shardlabels = []
+	for line in read_range(shard + ".labels", start['.labels'],
+			       end['.labels']).splitlines():
+		(token, label) = line.split('\t',1)
+		shardlabels.append( (long(token), label) )
+	for line in read_range(shard + ".hashes", start['.hashes'],
+			       end['.hashes']).splitlines():
+		(digest, first, dlen) = line.split()
+		first = long(first)
+		dlen = long(dlen)
+
+		sharddat.seek(first * 4)
+		if digest in known:
+			rebased[first] = known[digest][0]
+			continue
+
+		rebased[first] = writer.offset
+		for (token, label) in shardlabels[
+			bisect.bisect_left(shardlabels, (first,)):
+			bisect.bisect_left(shardlabels, (first + dlen,))]:
+			writer.label(token - first + rebased[first], label)
+		if shardaddr:
+			shardaddr.seek(first * 8)
+		remaining = dlen * 4
+		while remaining > 0:
+			block = sharddat.read(min(remaining, 1 << 20))
+			if not block:
+				break
+			writer.tokens(block, shard_addrs(shardaddr, len(block)))
+			remaining -= len(block)
+		record_hash(library, digest, rebased[first], dlen)
+		added.append(digest)
+	sharddat.close()
+	if shardaddr:
+		shardaddr.close()
+
+	for line in read_range(shard + ".idx", start['.idx'],
+			       end['.idx']).splitlines(True):
+		(token, rest) = line.split(',',1)
+		writer.entry_line("%ld,%s" % (rebased[long(token)], rest))
+	writer.commit()
+	return(added)
+
+def process_parallel(found, distname, options, jobs, manifest=None,
+		     source=None):
+	"""Process the archives in found, from source, using a pool of
+	jobs processes.
+	Each process writes the archives it is given to its own shard, in
+	a temporary directory that is removed afterwards, and the archives
+	are merged from the shards into the library in the order of found,
+	so the result is the same as processing the archives one at a
+	time.  Each merged archive is committed to manifest, if given."""
+	import copy
+	import multiprocessing
+	import os
+	import shutil
+
+	library = getattr(options,'library',None) or distname
+	if source is None:
+		source = DirectorySource(None)
+
+	# The shards need addresses if the library keeps them
+	addresses = getattr(options,'addresses',False)
+	if options.bin and os.path.exists(library + ".addr"):
+		addresses = True
+	options = copy.copy(options)
+	options.addresses = addresses
+
+	sharddir = mkdtemp(prefix='shards-', dir=mytempdir)
+	try:
+		tasks = []
+		for path in found:
+			tasks.append( (path, distname, options, sharddir, source) )
+
+		pool = multiprocessing.Pool(jobs)
+		try:
+			# Results come back in order, so each archive can be
+			#  merged as soon as it and everything before it are
+			#  done
+			i = 0
+			for (shard, start, end, counts, tokens) in \
+			    pool.imap(process_shard, tasks):
+				# The token memo is saved by this process
+				if tokens:
+					remember_tokens(tokens)
+				if options.bin:
+					if manifest:
+						mark = manifest.mark()
+					if getattr(options,'dedup',False):
+						# Only count the binaries that
+						#  were added, as a serial run
+						#  would
+						binaries = counts
+						counts = {}
+						for digest in merge_shard_dedup(shard,
+							library, start, end,
+							addresses):
+							add_counts(counts,
+								binaries[digest])
+					else:
+						merge_shard(shard, library, start, end,
+							addresses)
+					if manifest:
+						manifest.commit(found[i], mark, source,
+							counts)
+				add_counts(instructionDB, counts)
+				i += 1
+			pool.close()
+		except:
+			pool.terminate()
+			raise
+		pool.join()
+	finally:
+		shutil.rmtree(sharddir, True)
+	
+def main():
+	options = set_args()
+
+	if options.tokenmemo:
+		load_token_memo(options.tokenmemo)
+
+	try:
+		# Read an iso file directly, otherwise scan the
+		#  distribution directory
+		if options.file:
+			scan_isofile(options.file, options.distname, options)
+		else:
+			scan_distdir(options.distdir, options.distname, options)
+
+		# Only a complete run has counted everything; archives
+		#  skipped as unchanged are counted from the manifest
 		if options.database:
 			import pickle
 			dbsave = open(options.distname + '.db','w')
 			pickle.dump(instructionDB,dbsave)
+			dbsave.close()
+
+	finally:
+		close_writers()
+
+		if options.tokenmemo:
+			save_token_memo(options.tokenmemo)
 
 if __name__ == "__main__":
 	main()
@@ -20,6 +20,17 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 
+
+import re
+
+# The patterns used to break up objdump output, compiled once rather
+#  than on every line
+labelPattern  = re.compile(r'[0-9a-fA-F]+\W*<(.*)>:')
+offsetPattern = re.compile(r'\W*(\w*)')
+opcodePattern = re.compile(r'\W*(\w*)(.*)')
+# objdump starts the output for each file it is given with one of these
+headerPattern = re.compile(r'^(?:In archive (.*):|(.*):\s+file format \S+)\s*$')
+
 class Objdump:
 	"""A wrapper for processing files using objdump.  The
 	objdump binary and its appropriate arguments must be
@@ -28,42 +39,70 @@ class Objdump:
 	
 	objdumpBin = "/usr/bin/objdump"
 	objdumpArgs = "-Mintel -d"
+	# The pipe buffer size; objdump output is read in blocks of
+	#  this many bytes rather than a line at a time
+	bufSize = 1 << 16
+	# The most files handed to a single objdump process by
+	#  iter_batch(), keeping the command line a sane length
+	batchSize = 256
 	
-	def objdump(self,fileName):
+	def objdump(self,fileName,start=None,stop=None):
 		"""Returns the filestream from invoking
 		objdump on fileName.  If fileName is not
 		a binary format recognized by objdump, this
-		will be an empty stream.
+		will be an empty stream.  start and stop
+		limit the disassembly to those addresses.
 		"""
 
 		import os
 
+		window = ""
+		if start is not None:
+			window += " --start-address=0x%x" % start
+		if stop is not None:
+			window += " --stop-address=0x%x" % stop
+
 		(child_stdin, child_stdout, child_stderr) =  \
 		          os.popen3(self.objdumpBin + " " + \
-			  self.objdumpArgs + " " + \
+			  self.objdumpArgs + window + " " + \
 		          fileName,   
-			  4096) # Include a 4K bufsize to address
-			        #  larger binaries
+			  self.bufSize) # Use a large bufsize to address
+			                #  larger binaries
 	
 		return child_stdout
-	
-	def disassemble(self,fileName,returnbytes=False):
-		"""Returns a list of (opcode, operand, [label]) tuples as
-		disassembled from fileName.  If fileName is not
-		a binary format recognized by objdump, an empty
-		list [] is returned."""
-		import re
 
-		# Start disassembly
-		instructions = []
-		bytes = []
+	def objdump_many(self,fileNames):
+		"""Returns the filestream from invoking objdump once
+		on every file in fileNames.  Files objdump does not
+		recognize produce no output at all."""
+
+		import os
+		import subprocess
+
+		devnull = open(os.devnull,'w')
+		child = subprocess.Popen([self.objdumpBin] + \
+				self.objdumpArgs.split() + list(fileNames),
+			bufsize=self.bufSize,
+			stdout=subprocess.PIPE,
+			stderr=devnull)
+		devnull.close()
+
+		return child.stdout
+
+	def parse(self,lines,returnbytes=False):
+		"""A generator over lines, the text output of objdump, that
+		yields each [opcode, operands, offset, [label]] record as
+		soon as it is complete.  If returnbytes is set, yields
+		(record, bytes) pairs instead."""
+
 		label = ''
-		disassembly = self.objdump(fileName)
+		# The last record is held back until the next instruction
+		#  is seen, since any nops that follow are folded into its
+		#  bytes
+		pending = None
+		pendingBytes = ''
 
-		# Work with this line-by-line
-		#  This is effectively a do-while loop
-		line = disassembly.readline()
-		while line:
+		for line in lines:
 			# Reduce the input into fields
 			field = line.split('\t')
 			
@@ -71,14 +110,12 @@ class Objdump:
 			if len(field) == 1:
 				# Labels will be in the form 
 				# offset <label>:
-				parts = re.match('[0-9a-fA-F]+\W*<(.*)>:',field[0])
-				try:
+				parts = labelPattern.match(field[0])
+				if parts:
 					label = parts.group(1)
-				except AttributeError:
-					pass
 					
 			# The opcode is in the 3rd field [0,1,2,...]
-			if len(field) > 2:
+			elif len(field) > 2:
 				# Isolate the opcode, everything up to the
 				#  first non-alphanumeric character
 				# This allows for arbitrary-length instructions
@@ -86,34 +123,135 @@ class Objdump:
 				# it wasn't able to disassemble the memory
 				# space, will be entered as an empty 
 				# opcode '' and the operands '(bad)'
-				import re
-
-				parts  = re.match('\W*(\w*).*', field[0])
-				offset  = parts.group(1)
+				offset = offsetPattern.match(field[0]).group(1)
 
-				parts = re.match('\W*(\w*)(.*)', field[2])
+				parts = opcodePattern.match(field[2])
 				opcode = parts.group(1)
 				operands = parts.group(2).strip()
 
-				# If there was a label, add it and then remove
-				#  it
 				# REMOVE NOPS!
 				if opcode == 'nop':
-					bytes[-1] += field[1]
-					pass
-				elif label == '':
-					bytes.append(field[1])
-					instructions.append([opcode, operands, offset])
+					pendingBytes += field[1]
+					continue
+
+				# Everything before this is complete
+				if pending:
+					if returnbytes:
+						yield (pending, pendingBytes)
+					else:
+						yield pending
+
+				# If there was a label, add it and then remove
+				#  it
+				if label == '':
+					pending = [opcode, operands, offset]
 				else:
-					bytes.append(field[1])
-					instructions.append([opcode, operands, offset, \
-							     label])
+					pending = [opcode, operands, offset, label]
 					label = ''
-				
-			# Any more?
-			line = disassembly.readline()
+				pendingBytes = field[1]
+
+		# Don't forget the last instruction
+		if pending:
+			if returnbytes:
+				yield (pending, pendingBytes)
+			else:
+				yield pending
+
+	def iter_disassemble(self,fileName,returnbytes=False,start=None,stop=None):
+		"""A generator that yields the [opcode, operand, offset,
+		[label]] records of fileName as objdump produces them, so
+		that the whole disassembly never has to be held in memory.
+		If returnbytes is set, (record, bytes) pairs are yielded.
+		If fileName is not a binary format recognized by objdump,
+		nothing is yielded.  start and stop limit the disassembly
+		to the instructions between those addresses."""
+
+		disassembly = self.objdump(fileName,start,stop)
+		try:
+			for record in self.parse(disassembly,returnbytes):
+				yield record
+		finally:
+			disassembly.close()
+	
+	def disassemble(self,fileName,returnbytes=False):
+		"""Returns a list of (opcode, operand, [label]) tuples as
+		disassembled from fileName.  If fileName is not
+		a binary format recognized by objdump, an empty
+		list [] is returned."""
+
 		if not returnbytes:
-			return instructions
-		else:
-			return [instructions, bytes]
+			return list(self.iter_disassemble(fileName))
+
+		instructions = []
+		bytes = []
+		for (instruction, data) in self.iter_disassemble(fileName,True):
+			instructions.append(instruction)
+			bytes.append(data)
+		return [instructions, bytes]
+
+	def iter_batch(self,fileNames,returnbytes=False):
+		"""A generator that disassembles every file in fileNames
+		with as few objdump processes as possible, yielding a
+		(fileName, records) pair for each file in order.  records
+		yields what iter_disassemble() would have for that file,
+		nothing for anything objdump did not recognize, and must be
+		used before the next pair is asked for; whatever is left
+		unread is skipped."""
+
+		fileNames = list(fileNames)
+		for start in range(0,len(fileNames),self.batchSize):
+			chunk = fileNames[start:start + self.batchSize]
+			for result in self._batch(chunk,returnbytes):
+				yield result
 
+	def _batch(self,fileNames,returnbytes):
+		"""Run a single objdump over fileNames and split its output
+		on the per-file headers, see iter_batch()"""
+
+		disassembly = self.objdump_many(fileNames)
+		lines = iter(disassembly)
+
+		# The index of the file whose output is being read, and of
+		#  the file whose header ended it
+		state = { 'current':-1, 'next':len(fileNames) }
+
+		def file_lines():
+			"""Yield the lines of the current file, stopping at
+			the header of the next"""
+			for line in lines:
+				parts = headerPattern.match(line)
+				if parts:
+					name = parts.group(1) or parts.group(2)
+					# Only a header naming one of the
+					#  files still to come starts a new
+					#  file; anything else (e.g. archive
+					#  members) belongs to the current one
+					try:
+						state['next'] = fileNames.index(name,
+							state['current'] + 1)
+						return
+					except ValueError:
+						pass
+				yield line
+			state['next'] = len(fileNames)
+
+		try:
+			# Anything before the first header belongs to no file
+			for line in file_lines():
+				pass
+			while True:
+				# Files skipped by objdump had no output
+				for i in range(state['current'] + 1,state['next']):
+					yield (fileNames[i], iter([]))
+				if state['next'] >= len(fileNames):
+					break
+				state['current'] = state['next']
+
+				current = file_lines()
+				yield (fileNames[state['current']],
+					self.parse(current,returnbytes))
+				# Skip whatever wasn't read
+				for line in current:
+					pass
+		finally:
+			disassembly.close()
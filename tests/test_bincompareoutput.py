@@ -0,0 +1,156 @@
+# Tests for bincompareoutput.py
+
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import testutil
+import bincompareoutput
+from bincompareoutput import COMPARISON, MATCHES, COMMENT
+
+def sample_output():
+	"""Text bincompare output with matches relative to the offsets,
+	absolute matches, a comparison with no matches and one with more
+	matches than fit in a binary chunk"""
+	rand = random.Random(19)
+	lines = []
+	for (n, count, timed) in [ (0, 5, False), (1, 3, True), (2, 0, False),
+		(3, bincompareoutput.chunkSize * 2 + 7, False), (4, 0, True) ]:
+		lines.append('File lib%d.dat, offset %d, len 5000' % (n, n * 100))
+		lines.append('File other.dat, offset 0, len %d' % (1 << 33))
+		if timed:
+			lines.append('Comparison took %g seconds.' % (n / 4.0))
+		for i in range(count):
+			lines.append('%d,%d,%d,%d' % (rand.randint(0, 4999),
+				rand.randint(0, (1 << 32) - 1),
+				rand.randint(-50, 500), rand.randint(1, 100)))
+		if not timed:
+			lines.append('Comparison took %g seconds.' % (n / 4.0))
+	return('\n'.join(lines) + '\n')
+
+def comparisons(records):
+	"""The comparisons, their times and their matches in records,
+	however the matches are split up"""
+	found = []
+	for (kind, record) in records:
+		if kind == COMPARISON:
+			found.append( (record, []) )
+		elif kind == MATCHES:
+			found[-1][1].extend(record)
+	return([ (repr(comparison), comparison.timed, comparison.seconds,
+		matches) for (comparison, matches) in found ])
+
+def binary(records):
+	output = StringIO()
+	bincompareoutput.write_binary(records, output)
+	return(output.getvalue())
+
+def text(records):
+	output = StringIO()
+	bincompareoutput.write_text(records, output)
+	return(output.getvalue())
+
+class RoundTripTest(unittest.TestCase):
+	"""Text converted to binary and back must come out unchanged,
+	whichever way the binary is read"""
+
+	def setUp(self):
+		self.text = sample_output()
+		self.binary = binary(bincompareoutput.parse(StringIO(self.text)))
+		self.tmpdir = tempfile.mkdtemp()
+		self.name = os.path.join(self.tmpdir, 'output.bin')
+		f = open(self.name, 'wb')
+		f.write(self.binary)
+		f.close()
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpdir, True)
+
+	def parse_file(self):
+		stream = open(self.name, 'rb')
+		try:
+			return(comparisons(bincompareoutput.parse(stream)))
+		finally:
+			stream.close()
+
+	def test_text(self):
+		records = list(bincompareoutput.parse(StringIO(self.text), 1024))
+		self.assertEqual(text(records), self.text)
+
+	def test_mapped(self):
+		# A regular file is read through an mmap
+		expected = comparisons(bincompareoutput.parse(
+			StringIO(self.text)))
+		self.assertEqual(self.parse_file(), expected)
+		stream = open(self.name, 'rb')
+		try:
+			self.assertEqual(text(bincompareoutput.parse(stream)),
+				self.text)
+		finally:
+			stream.close()
+
+	def test_stream(self):
+		expected = comparisons(bincompareoutput.parse(
+			StringIO(self.text)))
+		self.assertEqual(comparisons(bincompareoutput.parse(
+			StringIO(self.binary))), expected)
+		self.assertEqual(text(bincompareoutput.parse(
+			StringIO(self.binary))), self.text)
+
+	def test_pipe(self):
+		child = subprocess.Popen(['cat', self.name],
+			stdout=subprocess.PIPE)
+		try:
+			self.assertEqual(text(bincompareoutput.parse(child.stdout)),
+				self.text)
+		finally:
+			child.stdout.close()
+			child.wait()
+
+	def test_concatenated(self):
+		f = open(self.name, 'ab')
+		f.write(self.binary)
+		f.close()
+		self.assertEqual(self.parse_file(), comparisons(
+			bincompareoutput.parse(StringIO(self.text * 2))))
+
+	def test_mapped_blocks(self):
+		found = list(bincompareoutput.mapped_blocks(self.binary))
+		expected = comparisons(bincompareoutput.parse(
+			StringIO(self.text)))
+		self.assertEqual(len(found), len(expected))
+		for ((comparison, chunks), (header, timed, seconds, matches)) in \
+		    zip(found, expected):
+			self.assertEqual(repr(comparison), header)
+			self.assertEqual(comparison.seconds, seconds)
+			self.assertEqual(sum([ count for (pos, count) in chunks ]),
+				len(matches))
+
+	def test_comments_dropped(self):
+		records = list(bincompareoutput.parse(StringIO(
+			'# a comment\n' + self.text)))
+		self.assertEqual(records[0], (COMMENT, '# a comment'))
+		self.assertEqual(binary(records), self.binary)
+
+	def test_truncated(self):
+		for end in (4, 10, bincompareoutput.blockHeader.size + 4,
+			len(self.binary) - 1):
+			f = open(self.name, 'wb')
+			f.write(self.binary[:end])
+			f.close()
+			self.assertRaises(IOError, self.parse_file)
+			self.assertRaises(IOError, list, bincompareoutput.parse(
+				StringIO(self.binary[:end])))
+
+	def test_out_of_range(self):
+		records = list(bincompareoutput.parse(StringIO(
+			'File a, offset 0, len 1\nFile b, offset 0, len 1\n' +
+			'%d,0,1,1\nComparison took 1 seconds.\n' % (1 << 32))))
+		self.assertRaises(ValueError, binary, records)
+
+if __name__ == '__main__':
+	unittest.main()
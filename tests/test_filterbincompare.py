@@ -0,0 +1,188 @@
+# Tests for filterbincompare.py
+
+import random
+import sys
+import unittest
+from StringIO import StringIO
+
+import testutil
+import filterbincompare
+
+def parse_options(args):
+	"""filterbincompare's options for the command line args"""
+	saved = sys.argv
+	sys.argv = [ 'filterbincompare.py' ] + args
+	try:
+		return(filterbincompare.set_args()[0])
+	finally:
+		sys.argv = saved
+
+def sample_input(seed, count=300):
+	"""Text bincompare output of a few comparisons, with matches that
+	overlap, share scores and fall below the noise"""
+	rand = random.Random(seed)
+	lines = []
+	for n in range(3):
+		lenA = rand.randint(500, 2000)
+		lines.append('File lib.dat, offset %d, len %d' % (n * 5000, lenA))
+		lines.append('File other.dat, offset %d, len 90000' % (n * 7))
+		for i in range(count):
+			dlen = rand.choice([1, 20, 30, 45])
+			a = rand.randint(0, lenA - dlen)
+			lines.append('%d,%d,%d,%d' % (a, rand.randint(0, 80000),
+				rand.choice([5, 100, 110, 120, 150]), dlen))
+		lines.append('Comparison took 0.5 seconds.')
+	return('\n'.join(lines) + '\n')
+
+def filtered(text, args):
+	output = StringIO()
+	filterbincompare.filter_stream(StringIO(text), output,
+		parse_options(args))
+	return(output.getvalue())
+
+def list_coverage(lenA, matches, offset):
+	"""The coverage lines for matches, (a, dlen) pairs, worked out one
+	instruction at a time with a list, as filterbincompare used to"""
+	cov = [False] * lenA
+	for (a, dlen) in matches:
+		for i in range(a, a + dlen):
+			cov[i] = True
+
+	lines = []
+	lastCoveredIndex = 0
+	inCovered = False
+	for i in range(len(cov)):
+		if cov[i] and (not inCovered):
+			lastCoveredIndex = i
+			inCovered = True
+		elif (not cov[i]) and inCovered:
+			lines.append('%d,0,-1,%d\n' % (lastCoveredIndex + offset,
+				i - lastCoveredIndex))
+			inCovered = False
+	if inCovered:
+		lines.append('%d,0,-1,%d\n' % (lastCoveredIndex + offset,
+			len(cov) - lastCoveredIndex))
+	return(''.join(lines))
+
+def bytearray_coverage(lenA, matches, offset):
+	cov = bytearray(lenA)
+	for (a, dlen) in matches:
+		filterbincompare.mark_coverage(cov, a, dlen)
+	output = StringIO()
+	filterbincompare.print_coverage(cov, offset, output)
+	return(output.getvalue())
+
+class CoverageTest(unittest.TestCase):
+	"""The bytearray coverage must give what the list of flags did"""
+
+	def test_same_as_list(self):
+		rand = random.Random(24)
+		for trial in range(200):
+			lenA = rand.randint(1, 300)
+			matches = []
+			for i in range(rand.randint(0, 12)):
+				a = rand.randint(0, lenA - 1)
+				matches.append( (a, rand.randint(0, lenA - a)) )
+			offset = rand.randint(0, 10000)
+			self.assertEqual(bytearray_coverage(lenA, matches, offset),
+				list_coverage(lenA, matches, offset))
+
+	def test_edges(self):
+		for matches in ([], [ (0, 10) ], [ (0, 1), (9, 1) ],
+			[ (2, 3), (5, 2) ], [ (3, 4), (4, 1) ]):
+			self.assertEqual(bytearray_coverage(10, matches, 7),
+				list_coverage(10, matches, 7))
+
+	def test_past_end(self):
+		self.assertEqual(bytearray_coverage(10, [ (8, 5), (12, 3) ], 0),
+			'8,0,-1,2\n')
+
+	def test_filter_stream(self):
+		text = sample_input(24)
+		output = filtered(text, [ '-a' ])
+		# The matches that get through the filters, for each
+		#  comparison, without the coverage
+		kept = filtered(text, [ '-n', '-d' ])
+		expected = []
+		for block in kept.split('File lib.dat')[1:]:
+			lines = block.split('\n')
+			lenA = long(lines[0].split()[-1])
+			offset = long(lines[0].split()[2].rstrip(','))
+			matches = [ tuple(map(long, line.split(',')[0::3]))
+				for line in lines if line[:1].isdigit() ]
+			expected.append(list_coverage(lenA, matches, offset))
+		covered = [ ''.join([ line + '\n' for line in block.split('\n')
+			if line[:1].isdigit() ])
+			for block in output.split('File lib.dat')[1:] ]
+		self.assertEqual(covered, expected)
+		self.assertTrue(len(''.join(expected)) > 0)
+
+class FilterTest(unittest.TestCase):
+
+	def test_empty_match(self):
+		# Skipped, like any other match too short to mean anything
+		text = ('File a, offset 0, len 100\nFile b, offset 0, len 100\n'
+			'10,20,150,0\n10,20,150,30\nComparison took 1 seconds.\n')
+		for (args, expected) in (([ '-l', '0' ], '10,20,150,30'),
+			([ '-l', '0', '-n' ], '10,20,150,30'),
+			([ '-l', '0', '-a' ], '10,0,-1,30')):
+			lines = [ line for line in filtered(text, args).split('\n')
+				if line[:1].isdigit() ]
+			self.assertEqual(lines, [ expected ])
+
+def match_runs(output):
+	"""The match lines of output, a list for each comparison"""
+	runs = []
+	for line in output.split('\n'):
+		if line.startswith('File lib.dat'):
+			runs.append([])
+		elif line[:1].isdigit():
+			runs[-1].append(line)
+	return(runs)
+
+def score(line):
+	return(long(line.split(',')[2]))
+
+class SortTest(unittest.TestCase):
+	"""Spilling to temporary files must not change the sorted output"""
+
+	def setUp(self):
+		self.text = sample_input(25)
+		self.sorted = filtered(self.text, [])
+		self.savedwidth = filterbincompare.mergeWidth
+
+	def tearDown(self):
+		filterbincompare.mergeWidth = self.savedwidth
+
+	def test_order(self):
+		# Decreasing score, equal scores as they came
+		unsorted = match_runs(filtered(self.text, [ '-n' ]))
+		expected = [ sorted(run, key=lambda line: -score(line))
+			for run in unsorted ]
+		self.assertEqual(match_runs(self.sorted), expected)
+		self.assertNotEqual(expected, unsorted)
+
+	def test_tiny_sortmem(self):
+		# Every line spilled on its own, and runs of a few lines
+		for sortmem in ('0', '0.0005', '0.002'):
+			self.assertEqual(filtered(self.text, [ '-m', sortmem ]),
+				self.sorted)
+
+	def test_merge_levels(self):
+		# Enough runs to merge runs of merged runs
+		filterbincompare.mergeWidth = 3
+		self.assertEqual(filtered(self.text, [ '-m', '0' ]), self.sorted)
+
+	def test_top(self):
+		full = match_runs(self.sorted)
+		for k in (1, 7, 100, 10000):
+			for sortmem in ('256', '0'):
+				self.assertEqual(match_runs(filtered(self.text,
+					[ '-k', str(k), '-m', sortmem ])),
+					[ run[:k] for run in full ])
+		# The top without sorting everything
+		self.assertEqual(match_runs(filtered(self.text,
+			[ '-n', '-k', '7' ])), [ run[:7] for run in full ])
+
+if __name__ == '__main__':
+	unittest.main()
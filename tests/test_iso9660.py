@@ -0,0 +1,272 @@
+# Tests for iso9660.py
+
+import calendar
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import testutil
+import iso9660
+from iso9660 import SECTOR
+
+# Every record is dated 2006-01-02 03:04:05 UTC
+recordDate = struct.pack('6Bb', 106, 1, 2, 3, 4, 5, 0)
+
+def both(format, value):
+	"""value in little- then big-endian, as ISO9660 stores numbers"""
+	return(struct.pack('<' + format, value) + struct.pack('>' + format, value))
+
+def dir_record(name, sector, size, flags=0, susp=''):
+	"""A directory record for name at sector, size bytes long"""
+	record = '\x00' + both('I', sector) + both('I', size) + recordDate + \
+		chr(flags) + '\x00\x00' + both('H', 1) + chr(len(name)) + name
+	# The system use area starts on an even byte
+	if len(name) % 2 == 0:
+		record += '\x00'
+	record += susp
+	return(chr(len(record) + 1) + record)
+
+def susp_entry(sig, data):
+	return(sig + chr(len(data) + 4) + '\x01' + data)
+
+def nm(name):
+	return(susp_entry('NM', '\x00' + name))
+
+class ImageBuilder:
+	"""Lays out a small ISO9660 image, a sector at a time"""
+
+	def __init__(self):
+		self.sectors = {}
+		self.next = 20
+
+	def reserve(self, count=1):
+		sector = self.next
+		self.next += count
+		return(sector)
+
+	def put(self, sector, data):
+		self.sectors[sector] = data
+
+	def file(self, data):
+		"""Store data, returning its (sector, size)"""
+		sector = self.reserve(max(1, (len(data) + SECTOR - 1) / SECTOR))
+		self.put(sector, data)
+		return( (sector, len(data)) )
+
+	def directory(self, pages, dot=''):
+		"""Store a directory of the records in pages, a list for each
+		sector, returning its (sector, size).  dot is the system use
+		field of its `.' record."""
+		sector = self.reserve(len(pages))
+		size = len(pages) * SECTOR
+		pages = [ list(page) for page in pages ]
+		pages[0][0:0] = [ dir_record('\x00', sector, size, 2, dot),
+			dir_record('\x01', sector, size, 2) ]
+		data = ''
+		for page in pages:
+			page = ''.join(page)
+			data += page + '\x00' * (SECTOR - len(page))
+		self.put(sector, data)
+		return( (sector, size) )
+
+	def descriptor(self, type, root, escape=''):
+		"""A volume descriptor with root, the (sector, size) of the
+		root directory"""
+		data = chr(type) + 'CD001\x01' + '\x00' * 81 + escape
+		data += '\x00' * (156 - len(data))
+		data += dir_record('\x00', root[0], root[1], 2)
+		return(data + '\x00' * (SECTOR - len(data)))
+
+	def write(self, name, primary, joliet=None):
+		descriptors = [ self.descriptor(1, primary) ]
+		if joliet is not None:
+			descriptors.append(self.descriptor(2, joliet, '%/E'))
+		descriptors.append(chr(255) + 'CD001\x01' + '\x00' * (SECTOR - 7))
+		for (n, data) in enumerate(descriptors):
+			self.put(16 + n, data)
+
+		image = open(name, 'wb')
+		for sector in sorted(self.sectors):
+			image.seek(sector * SECTOR)
+			image.write(self.sectors[sector])
+		image.seek(self.next * SECTOR - 1)
+		image.write('\x00')
+		image.close()
+
+class ImageTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+		self.name = os.path.join(self.tmpdir, 'test.iso')
+		self.images = []
+
+	def tearDown(self):
+		for image in self.images:
+			image.close()
+		shutil.rmtree(self.tmpdir, True)
+
+	def open(self):
+		image = iso9660.ISO9660(self.name)
+		self.images.append(image)
+		return(image)
+
+	def read(self, image, path):
+		member = image.open(path)
+		data = member.read()
+		member.close()
+		return(data)
+
+class PlainTest(ImageTest):
+	"""Plain ISO9660 names, multi-extent files and directories of more
+	than one sector"""
+
+	def setUp(self):
+		ImageTest.setUp(self)
+		builder = ImageBuilder()
+		self.first = 'a' * SECTOR
+		self.second = 'b' * 100
+		true = builder.file('true contents')
+		first = builder.file(self.first)
+		builder.file('between')
+		second = builder.file(self.second)
+		bin = builder.directory([ [
+			dir_record('TRUE.;1', true[0], true[1]),
+			dir_record('MULTI.;1', first[0], first[1], 0x80),
+			dir_record('MULTI.;1', second[0], second[1]) ] ])
+		noext = builder.file('no extension')
+		root = builder.directory([
+			[ dir_record('BIN', bin[0], bin[1], 2) ],
+			[ dir_record('NOEXT.;1', noext[0], noext[1]) ] ])
+		builder.write(self.name, root)
+
+	def test_names(self):
+		image = self.open()
+		self.assertEqual(image.listdir(), [ 'bin', 'noext' ])
+		self.assertEqual(image.listdir('/bin'), [ 'multi', 'true' ])
+		self.assertTrue(image.isdir('/bin'))
+		self.assertTrue(image.isfile('/bin/true'))
+		self.assertFalse(image.isfile('/bin/false'))
+		self.assertEqual(list(image.walk()), [ ('/', [ 'bin' ], [ 'noext' ]),
+			('/bin', [], [ 'multi', 'true' ]) ])
+
+	def test_read(self):
+		image = self.open()
+		self.assertEqual(self.read(image, '/bin/true'), 'true contents')
+		self.assertEqual(self.read(image, 'noext'), 'no extension')
+		self.assertEqual(image.entry('/bin/true').mtime,
+			calendar.timegm( (2006, 1, 2, 3, 4, 5, 0, 0, 0) ))
+		self.assertRaises(IOError, image.open, '/bin')
+		self.assertRaises(IOError, image.open, '/bin/false')
+
+	def test_multiextent(self):
+		image = self.open()
+		self.assertEqual(image.entry('/bin/multi').size,
+			len(self.first) + len(self.second))
+		self.assertEqual(self.read(image, '/bin/multi'),
+			self.first + self.second)
+		member = image.open('/bin/multi')
+		member.seek(-104, 2)
+		self.assertEqual(member.read(10), 'aaaabbbbbb')
+		self.assertEqual(member.tell(), len(self.first) + 6)
+
+	def test_extract(self):
+		image = self.open()
+		destination = os.path.join(self.tmpdir, 'multi')
+		image.extract('/bin/multi', destination)
+		f = open(destination, 'rb')
+		self.assertEqual(f.read(), self.first + self.second)
+		f.close()
+
+class RockRidgeTest(ImageTest):
+	"""Rock Ridge names, continued entries and relocated directories"""
+
+	def setUp(self):
+		ImageTest.setUp(self)
+		builder = ImageBuilder()
+		readme = builder.file('read me')
+		long = builder.file('long')
+		moved = builder.file('moved file')
+		# The rest of the long name is in a continuation area
+		rest = nm('-continued')
+		continuation = builder.file('\x00' * 10 + rest)
+		ce = susp_entry('CE', both('I', continuation[0]) + both('I', 10) +
+			both('I', len(rest)))
+
+		# /Deep/moved really lives in /rr_moved/moved
+		relocated = builder.directory([ [ dir_record('FILE.;1',
+			moved[0], moved[1], 0, nm('File.Bin')) ] ])
+		rrmoved = builder.directory([ [ dir_record('MOVED', relocated[0],
+			relocated[1], 2, nm('moved') + susp_entry('RE', '')) ] ])
+		deep = builder.directory([ [ dir_record('MOVED', 0, 0, 0,
+			nm('moved') + susp_entry('CL', both('I', relocated[0]))) ] ])
+		root = builder.directory([ [
+			dir_record('README.;1', readme[0], readme[1], 0,
+				nm('ReadMe.txt')),
+			dir_record('LONGNAME.;1', long[0], long[1], 0,
+				nm('a-very-long-name') + ce),
+			dir_record('DEEP', deep[0], deep[1], 2, nm('Deep')),
+			dir_record('RR_MOVED', rrmoved[0], rrmoved[1], 2,
+				nm('rr_moved')) ] ],
+			susp_entry('SP', '\xbe\xef\x00'))
+		builder.write(self.name, root)
+
+	def test_names(self):
+		image = self.open()
+		self.assertTrue(image.rockridge)
+		self.assertEqual(image.listdir(), [ 'Deep', 'ReadMe.txt',
+			'a-very-long-name-continued', 'rr_moved' ])
+		self.assertEqual(self.read(image, '/ReadMe.txt'), 'read me')
+		self.assertEqual(self.read(image, '/a-very-long-name-continued'),
+			'long')
+
+	def test_relocated(self):
+		image = self.open()
+		self.assertEqual(image.listdir('/rr_moved'), [])
+		self.assertTrue(image.isdir('/Deep/moved'))
+		self.assertEqual(image.listdir('/Deep/moved'), [ 'File.Bin' ])
+		self.assertEqual(self.read(image, '/Deep/moved/File.Bin'),
+			'moved file')
+
+class JolietTest(ImageTest):
+	"""Joliet names, used when there is no Rock Ridge"""
+
+	def setUp(self):
+		ImageTest.setUp(self)
+		builder = ImageBuilder()
+		notes = builder.file('some notes')
+		docs = builder.directory([ [ dir_record(u'Release Notes.txt;1'.encode(
+			'utf_16_be'), notes[0], notes[1]) ] ])
+		joliet = builder.directory([ [ dir_record(u'Docs'.encode('utf_16_be'),
+			docs[0], docs[1], 2) ] ])
+		plain = builder.directory([ [ dir_record('DOCS', docs[0],
+			docs[1], 2) ] ])
+		builder.write(self.name, plain, joliet)
+
+	def test_names(self):
+		image = self.open()
+		self.assertTrue(image.joliet)
+		self.assertEqual(list(image.walk()), [ ('/', [ 'Docs' ], []),
+			('/Docs', [], [ 'Release Notes.txt' ]) ])
+		self.assertEqual(self.read(image, '/Docs/Release Notes.txt'),
+			'some notes')
+
+class NotAnImageTest(ImageTest):
+
+	def test_not_an_image(self):
+		f = open(self.name, 'wb')
+		f.write('\x00' * SECTOR * 20)
+		f.close()
+		self.assertRaises(IOError, iso9660.ISO9660, self.name)
+
+	def test_no_primary(self):
+		# Just the terminator
+		f = open(self.name, 'wb')
+		f.write('\x00' * SECTOR * 16 + chr(255) + 'CD001\x01' +
+			'\x00' * (SECTOR - 7))
+		f.close()
+		self.assertRaises(IOError, iso9660.ISO9660, self.name)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,260 @@
+# Tests for mklib.py
+
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import testutil
+import mklib
+
+class Interrupted(Exception):
+	pass
+
+class LibraryTest(unittest.TestCase):
+	"""Builds small libraries from a directory of tar archives"""
+
+	def setUp(self):
+		if not testutil.have_objdump():
+			self.skipTest('objdump is not installed')
+		binaries = testutil.binaries(3)
+		if len(binaries) < 3:
+			self.skipTest('not enough binaries to archive')
+
+		self.tmpdir = tempfile.mkdtemp()
+		self.savedtempdir = mklib.mytempdir
+		mklib.mytempdir = os.path.join(self.tmpdir, 'work')
+		os.mkdir(mklib.mytempdir)
+
+		# Every binary turns up in more than one archive
+		self.dist = os.path.join(self.tmpdir, 'dist')
+		os.mkdir(self.dist)
+		for n in range(4):
+			members = [ binaries[n % 3], binaries[(n + 1) % 3] ]
+			self.make_archive('a%d.tgz' % n, members)
+		# The archives in the order a build adds them
+		self.order = []
+		self.savedprocess = mklib.process_archive
+		mklib.process_archive = self.process_archive
+		try:
+			self.build('order')
+		finally:
+			mklib.process_archive = self.savedprocess
+
+	def tearDown(self):
+		mklib.mytempdir = self.savedtempdir
+		mklib.process_archive = self.savedprocess
+		shutil.rmtree(self.tmpdir, True)
+
+	def make_archive(self, name, members):
+		archive = tarfile.open(os.path.join(self.dist, name), 'w:gz')
+		for path in members:
+			archive.add(path, 'usr/bin/' + os.path.basename(path))
+		archive.close()
+
+	def build(self, name, **settings):
+		"""Run a mklib -b build of the test distribution into the
+		library name, returning its path and instructionDB"""
+		library = os.path.join(self.tmpdir, name)
+		options = mklib.MklibOpts()
+		options.bin = True
+		options.distname = 'test'
+		options.library = library
+		for (setting, value) in settings.items():
+			setattr(options, setting, value)
+
+		mklib.contentIndex.clear()
+		mklib.libraryWriters.clear()
+		mklib.instructionDB.clear()
+		saved = sys.stdout
+		sys.stdout = StringIO()
+		try:
+			mklib.scan_distdir(self.dist, 'test', options)
+		finally:
+			sys.stdout = saved
+			mklib.close_writers()
+		return( (library, dict(mklib.instructionDB)) )
+
+	def process_archive(self, archive, distname, options):
+		self.order.append(os.path.basename(archive))
+
+	def interrupted(self, name, failname, **settings):
+		"""Start a build of name that dies after writing the archive
+		failname, but before the manifest commits it"""
+		def dying(archive, distname, options):
+			self.savedprocess(archive, distname, options)
+			if os.path.basename(archive) == failname:
+				raise Interrupted
+
+		mklib.process_archive = dying
+		try:
+			self.assertRaises(Interrupted, self.build, name, **settings)
+		finally:
+			mklib.process_archive = self.savedprocess
+
+	def read(self, library, extension):
+		f = open(library + extension, 'rb')
+		data = f.read()
+		f.close()
+		return(data)
+
+	def assertNoShards(self):
+		"""Nothing is left of the shards of a parallel build"""
+		self.assertEqual(os.listdir(mklib.mytempdir), [])
+		self.assertEqual([ name for name in os.listdir(self.tmpdir)
+			if 'shard' in name ], [])
+
+	def assertSameFiles(self, library, other):
+		self.assertTrue(self.read(library, '.dat'), 'nothing was written')
+		for extension in ('.dat', '.idx'):
+			self.assertEqual(self.read(library, extension),
+				self.read(other, extension), extension + ' differs')
+
+	def assertSameLibrary(self, first, second):
+		(library, counts) = first
+		(other, othercounts) = second
+		self.assertSameFiles(library, other)
+		self.assertEqual(counts, othercounts)
+
+class ResumeTest(LibraryTest):
+	"""An interrupted build finished by a rerun must match a build
+	that was never interrupted"""
+
+	def test_interrupted(self):
+		clean = self.build('clean')
+		self.interrupted('resumed', self.order[2])
+		self.assertSameLibrary(self.build('resumed'), clean)
+
+	def test_interrupted_repeatedly(self):
+		clean = self.build('clean')
+		self.interrupted('resumed', self.order[1])
+		self.interrupted('resumed', self.order[1])
+		self.interrupted('resumed', self.order[3])
+		self.assertSameLibrary(self.build('resumed'), clean)
+
+	def test_interrupted_before_first_commit(self):
+		clean = self.build('clean')
+		self.interrupted('resumed', self.order[0])
+		self.assertSameLibrary(self.build('resumed'), clean)
+
+	def test_rerun(self):
+		self.build('resumed')
+		self.assertSameLibrary(self.build('resumed'), self.build('clean'))
+
+	def test_changed_archive(self):
+		self.build('resumed')
+		self.make_archive('a1.tgz', testutil.binaries(1))
+		os.remove(os.path.join(self.dist, 'a3.tgz'))
+		self.assertSameLibrary(self.build('resumed'),
+			self.build('clean'))
+
+	def test_library_before_manifest(self):
+		# What was there is kept, and everything is added after it
+		clean = self.build('clean')
+		old = os.path.join(self.tmpdir, 'old')
+		for extension in ('.dat', '.idx'):
+			shutil.copy(clean[0] + extension, old + extension)
+		self.interrupted('old', self.order[1])
+		self.build('old')
+		self.assertEqual(self.read(old, '.dat'),
+			self.read(clean[0], '.dat') * 2)
+		self.assertEqual(len(self.read(old, '.idx').splitlines()),
+			len(self.read(clean[0], '.idx').splitlines()) * 2)
+
+	def test_interrupted_parallel(self):
+		clean = self.build('clean')
+		self.interrupted('resumed', self.order[2], jobs=2)
+		self.assertNoShards()
+		self.assertSameLibrary(self.build('resumed', jobs=2), clean)
+
+class ArchiveTest(LibraryTest):
+
+	def test_hard_link(self):
+		# Both names of a hard-linked binary are added
+		binary = testutil.binaries(1)[0]
+		archive = tarfile.open(os.path.join(self.dist, 'a0.tgz'), 'w:gz')
+		archive.add(binary, 'usr/bin/first')
+		link = tarfile.TarInfo('usr/bin/second')
+		link.type = tarfile.LNKTYPE
+		link.linkname = 'usr/bin/first'
+		archive.addfile(link)
+		archive.close()
+		(library, counts) = self.build('linked')
+		names = [ line.split(',')[1]
+			for line in self.read(library, '.idx').splitlines() ]
+		self.assertTrue('/usr/bin/first' in names)
+		self.assertTrue('/usr/bin/second' in names)
+
+class ParallelTest(LibraryTest):
+	"""A build with --jobs must match a serial build"""
+
+	def test_parallel(self):
+		self.assertSameLibrary(self.build('parallel', jobs=2),
+			self.build('serial'))
+		self.assertNoShards()
+
+	def test_parallel_token_memo(self):
+		# The workers' tokens are kept for the memo file
+		memo = os.path.join(self.tmpdir, 'memo')
+		mklib.tokenMemo.clear()
+		self.build('serial', tokenmemo=memo)
+		serial = dict(mklib.tokenMemo)
+		mklib.tokenMemo.clear()
+		self.build('parallel', jobs=2, tokenmemo=memo)
+		self.assertTrue(serial)
+		self.assertEqual(mklib.tokenMemo, serial)
+
+	def test_parallel_dedup(self):
+		serial = self.build('serial', dedup=True)
+		self.assertSameLibrary(self.build('parallel', jobs=2,
+			dedup=True), serial)
+		# Each binary is stored, and counted, only the first time
+		#  it is written
+		everything = self.build('all')
+		self.assertTrue(len(self.read(serial[0], '.dat')) <
+			len(self.read(everything[0], '.dat')))
+		self.assertNotEqual(serial[1], everything[1])
+
+class WriterTest(unittest.TestCase):
+	"""The .addr file must follow the .dat file token for token"""
+
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+		self.library = os.path.join(self.tmpdir, 'lib')
+		f = open(self.library + '.dat', 'wb')
+		f.write('\x01\x02\x03\x04' * 1000)
+		f.close()
+		open(self.library + '.idx', 'w').close()
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpdir, True)
+
+	def addresses(self):
+		writer = mklib.LibraryWriter(self.library, True)
+		writer.close()
+		f = open(self.library + '.addr', 'rb')
+		data = f.read()
+		f.close()
+		return(data)
+
+	def test_started_late(self):
+		# Tokens from before --addresses have no address
+		self.assertEqual(self.addresses(), '\x00' * 8000)
+
+	def test_too_long(self):
+		f = open(self.library + '.addr', 'wb')
+		f.write('\x05' * 9000)
+		f.close()
+		self.assertEqual(self.addresses(), '\x05' * 8000)
+
+	def test_too_short(self):
+		f = open(self.library + '.addr', 'wb')
+		f.write('\x05' * 16)
+		f.close()
+		self.assertEqual(self.addresses(), '\x05' * 16 + '\x00' * 7984)
+
+if __name__ == '__main__':
+	unittest.main()
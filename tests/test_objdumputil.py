@@ -0,0 +1,71 @@
+# Tests for objdumputil.py
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import testutil
+import objdumputil
+
+class BatchTest(unittest.TestCase):
+	"""iter_batch() must give every file exactly what a separate
+	objdump of it would"""
+
+	def setUp(self):
+		if not testutil.have_objdump():
+			self.skipTest('objdump is not installed')
+		self.binaries = testutil.binaries(3)
+		if len(self.binaries) < 2:
+			self.skipTest('no binaries to disassemble')
+
+		self.tmpdir = tempfile.mkdtemp()
+		text = os.path.join(self.tmpdir, 'notes.txt')
+		f = open(text, 'w')
+		f.write('not a binary\n')
+		f.close()
+		# Files objdump skips, between and around the binaries
+		self.files = [ text, self.binaries[0], text,
+			os.path.join(self.tmpdir, 'missing') ] + \
+			self.binaries[1:] + [ text ]
+		self.objdump = objdumputil.Objdump()
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpdir, True)
+
+	def separately(self, returnbytes=False):
+		return([ (name, list(self.objdump.iter_disassemble(name,
+			returnbytes))) for name in self.files ])
+
+	def test_same_as_separate(self):
+		batched = [ (name, list(records)) for (name, records) in
+			self.objdump.iter_batch(self.files) ]
+		self.assertEqual(batched, self.separately())
+
+	def test_same_as_separate_with_bytes(self):
+		batched = [ (name, list(records)) for (name, records) in
+			self.objdump.iter_batch(self.files, True) ]
+		self.assertEqual(batched, self.separately(True))
+
+	def test_small_batches(self):
+		self.objdump.batchSize = 2
+		batched = [ (name, list(records)) for (name, records) in
+			self.objdump.iter_batch(self.files) ]
+		self.assertEqual(batched, self.separately())
+
+	def test_unread_records_are_skipped(self):
+		firsts = [ (name, list(records)[:1]) for (name, records) in
+			self.objdump.iter_batch(self.files) ]
+		batched = []
+		for (name, records) in self.objdump.iter_batch(self.files):
+			for record in records:
+				batched.append( (name, [ record ]) )
+				break
+			else:
+				batched.append( (name, []) )
+		self.assertEqual(batched, firsts)
+		self.assertEqual(batched, [ (name, records[:1])
+			for (name, records) in self.separately() ])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,59 @@
+# Program:    testutil.py
+# Programmer: Scott Miller
+# Function:   Shared helpers for the binBLAST tests
+
+# binBLAST suite of binary analysis tools
+# Copyright (C) 2006 Scott Miller
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import sys
+
+# The tools are run from src/, so import them from there
+srcdir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+	os.pardir, 'src')
+if srcdir not in sys.path:
+	sys.path.insert(0, srcdir)
+
+# Small binaries to disassemble, where the system has them
+binaryCandidates = [ '/bin/true', '/bin/false', '/usr/bin/true',
+	'/usr/bin/false', '/usr/bin/env', '/usr/bin/basename',
+	'/usr/bin/dirname', '/usr/bin/tty', '/usr/bin/sleep' ]
+
+def have_objdump():
+	"""True if objdumputil's objdump is installed"""
+	import objdumputil
+	return(os.access(objdumputil.Objdump.objdumpBin, os.X_OK))
+
+def binaries(count=None):
+	"""Up to count distinct ELF binaries on this system"""
+	found = []
+	seen = set()
+	for path in binaryCandidates:
+		try:
+			f = open(path, 'rb')
+			magic = f.read(4)
+			f.close()
+			real = os.path.realpath(path)
+		except IOError:
+			continue
+		if magic != '\x7fELF' or real in seen:
+			continue
+		seen.add(real)
+		found.append(path)
+		if count is not None and len(found) == count:
+			break
+	return(found)